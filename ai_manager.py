@@ -19,6 +19,7 @@ class AIManager:
     def __init__(self):
         self.ollama_model = Config.OLLAMA_MODEL
         self.embedding_model = self._load_embedding_model()
+        self.state_classifier = self._load_state_classifier()
         self.tools = {}
         self._register_default_tools()
         # 创建线程池用于异步执行记忆总结
@@ -31,19 +32,38 @@ class AIManager:
         self.register_tool("getCurrentTime", current_time_tool.getCurrentTime, "为了感知当前时间，你可以调用这个工具")
 
         from emo_serv import EmotionalStateMachine, generate_reply
-        def emotion_tool(message: str, state: str = None):
+        from emotion_rules import evaluate_batch
+        def run_state_machine(message, state=None, variables=None, embedding=None):
             esm = EmotionalStateMachine()
             if state:
                 esm.current_state = state
-            new_state = esm.determine_state(message)
-            reply = generate_reply(new_state, message, esm)
-            return {
-                "reply": reply,
+            if variables:
+                # 在调用方已载入的变量基础上更新，而不是每轮从默认值重新开始
+                esm.variables.update(variables)
+            classify = None
+            if embedding is not None and self.state_classifier:
+                # 复用检索已算出的消息向量，只与各状态质心做点积，不再额外编码
+                classify = lambda rules: self.state_classifier.classify(rules, embedding)
+            new_state = esm.determine_state(message, classify)
+            return esm, {
                 "new_state": new_state,
                 "state_description": esm.get_state_description(new_state),
                 "variables": esm.variables
             }
+
+        def emotion_state_tool(message: str, state: str = None, variables: dict = None, embedding: list = None):
+            # 只计算状态转移，不渲染回复（聊天流程由大模型生成回复，不需要模板回复）
+            return run_state_machine(message, state, variables, embedding)[1]
+
+        def emotion_tool(message: str, state: str = None, variables: dict = None, render_reply: bool = True, embedding: list = None):
+            esm, result = run_state_machine(message, state, variables, embedding)
+            if render_reply:
+                # 模板回复包含完整角色卡，只在调用方需要时生成
+                result["reply"] = generate_reply(result["new_state"], message, esm)
+            return result
+        self.register_tool("emotion_state", emotion_state_tool, "根据消息计算情感状态转移（不生成回复）")
         self.register_tool("emotion_state_machine", emotion_tool, "根据消息检测情感状态并生成符合人格的回复")
+        self.register_tool("emotion_state_batch", evaluate_batch, "批量计算多条消息的情感状态转移（items: [{user_id, message, variables, hour}]）")
     
     def register_tool(self, name: str, func: callable, description: str):
         """注册工具"""
@@ -96,6 +116,21 @@ class AIManager:
             # 降级方案：使用简单的关键词匹配
             return None
     
+    def _load_state_classifier(self):
+        """嵌入模型可用时创建情感状态分类器，并在启动时预先计算当前规则的状态质心"""
+        if not Config.EMOTION_CLASSIFIER_ENABLED or self.embedding_model is None:
+            return None
+        from emotion_rules import emotion_rules
+        from state_classifier import StateClassifier
+        try:
+            classifier = StateClassifier(self.embedding_model)
+            classifier.centroids_for(emotion_rules.get())
+            return classifier
+        except Exception as e:
+            logger.error(f"情感状态分类器初始化失败，仅使用关键词规则: {e}")
+            logger.debug(traceback.format_exc())
+            return None
+    
     def get_ollama_response(self, prompt, think=False, raw=False):
         """调用本地 Ollama 模型获取响应，可选返回原始结构与推理链"""
         start_time = time.time()
@@ -106,7 +141,7 @@ class AIManager:
                 prompt=prompt,
                 think=think,
                 stream=False,
-                options={"temperature": 0.6, "top_p": 0.9, "gpu_layers": 999, "num_thread": 12, "n_ctx": 4096}
+                options={"temperature": 0.6, "top_p": 0.9, "gpu_layers": 999, "num_thread": 12, "num_ctx": Config.OLLAMA_NUM_CTX}
             )
             
             if raw:
@@ -147,7 +182,7 @@ class AIManager:
                 prompt=prompt,
                 think=think,
                 stream=False,
-                options={"temperature": 0.6, "top_p": 0.9, "gpu_layers": 999, "num_thread": 12, "n_ctx": 4096}
+                options={"temperature": 0.6, "top_p": 0.9, "gpu_layers": 999, "num_thread": 12, "num_ctx": Config.OLLAMA_NUM_CTX}
             )
             # 过滤掉不需要的元数据，只保留必要的字段
             filtered_response = {
@@ -227,7 +262,7 @@ class AIManager:
                 prompt=prompt,
                 think=False,
                 stream=False,
-                options={"temperature": 0.1, "gpu_layers": 999, "num_thread": 12, "n_ctx": 4096}
+                options={"temperature": 0.1, "gpu_layers": 999, "num_thread": 12, "num_ctx": Config.OLLAMA_NUM_CTX}
             )
             end_time = time.time()
             raw_response = response.get("response", "").strip()
@@ -287,6 +322,44 @@ class AIManager:
             logger.debug(traceback.format_exc())
             return {"error": "模型调用失败"}
     
+    def merge_user_profile(self, current_profile, new_summaries):
+        """将新的对话总结增量合并进已有的用户档案，失败时返回原档案"""
+        start_time = time.time()
+        summaries_text = "\n".join(f"- {summary}" for summary in new_summaries)
+        prompt = f"""
+        你负责维护智子对哥哥（用户）的长期档案。请把新的对话总结合并进已有档案：
+
+        已有档案：
+        {current_profile or "（暂无）"}
+
+        新的对话总结：
+        {summaries_text}
+
+        要求：
+        1. 只保留稳定的信息：称呼、名字、喜好、习惯、作息、重要经历等
+        2. 新信息与旧信息冲突时以新信息为准，删除一次性的闲聊内容
+        3. 使用简短的要点，总长度不超过{Config.USER_PROFILE_MAX_CHARS}字
+        4. 只输出档案正文，禁止任何其他文本
+        """
+        try:
+            logger.info(f"开始调用 Ollama 模型（档案合并）({Config.OLLAMA_MODEL})")
+            response = ollama.generate(
+                model=Config.OLLAMA_MODEL,
+                prompt=prompt,
+                think=False,
+                stream=False,
+                options={"temperature": 0.1, "gpu_layers": 999, "num_thread": 12, "num_ctx": Config.OLLAMA_NUM_CTX}
+            )
+            profile = response.get("response", "").strip()
+            end_time = time.time()
+            logger.info(f"Ollama 模型（档案合并）调用完成，档案长度: {len(profile)} 字符，耗时: {end_time - start_time:.2f} 秒")
+            return profile[:Config.USER_PROFILE_MAX_CHARS] if profile else current_profile
+        except Exception as e:
+            end_time = time.time()
+            logger.error(f"调用Ollama失败（档案合并）: {e}，耗时: {end_time - start_time:.2f} 秒")
+            logger.debug(traceback.format_exc())
+            return current_profile
+
     def summarize_conversation(self, user_msg, assistant_msg, current_state, async_mode=True):
         """使用 LLM 总结对话并生成情感摘要，支持异步执行"""
         if async_mode:
@@ -1,7 +1,6 @@
 from flask import Flask
 from flask_cors import CORS
 from waitress import serve
-import chromadb
 import os
 import sys
 
@@ -11,6 +10,7 @@ if not os.path.abspath(os.path.join(os.path.dirname(__file__), 'emotion_state_se
 
 from config import Config
 from memory_manager import MemoryManager
+from vector_store import create_vector_store
 from ai_manager import AIManager
 from prompt_generator import PromptGenerator
 from chat_service import ChatService
@@ -28,20 +28,17 @@ def create_app():
     # 启用CORS支持
     CORS(app, resources={"/*": {"origins": "*"}})
     
-    # 确保Chroma持久化目录存在
-    os.makedirs(Config.CHROMA_PERSIST_DIRECTORY, exist_ok=True)
-    
-    # 初始化向量数据库（持久化存储）
-    chroma_client = chromadb.PersistentClient(path=Config.CHROMA_PERSIST_DIRECTORY)
+    # 初始化向量存储（后端由Config.VECTOR_STORE_BACKEND决定）
+    vector_store = create_vector_store()
     
     # 初始化各个组件
     emotional_machine = EmotionalStateMachine()
     ai_manager = AIManager()
-    memory_manager = MemoryManager(chroma_client, ai_manager.embedding_model)
+    memory_manager = MemoryManager(vector_store, ai_manager.embedding_model)
     prompt_generator = PromptGenerator(emotional_machine, memory_manager)
     
     # 初始化聊天服务并注册路由
-    chat_service = ChatService(emotional_machine, memory_manager, ai_manager, prompt_generator, chroma_client)
+    chat_service = ChatService(emotional_machine, memory_manager, ai_manager, prompt_generator, vector_store)
     chat_service.register_routes(app)
     
     return app
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天记录归档脚本，将早于指定天数的聊天记录压缩移入 chat_history_archives，保持 chat_histories 热表精简
+建议通过cron定期运行，例如每天一次: python archive_chat_history.py --vacuum
+"""
+
+import sys
+import argparse
+import traceback
+from sqlalchemy import text
+from config import Config
+from database import init_db, engine, SessionLocal, archive_chat_histories
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="归档旧的聊天记录")
+    parser.add_argument("--older-than-days", type=float, default=Config.CHAT_HISTORY_ARCHIVE_AFTER_DAYS,
+                        help=f"归档早于该天数的记录，默认{Config.CHAT_HISTORY_ARCHIVE_AFTER_DAYS}")
+    parser.add_argument("--segment-rows", type=int, default=Config.CHAT_HISTORY_ARCHIVE_SEGMENT_ROWS,
+                        help=f"每个归档段最多包含的记录数，默认{Config.CHAT_HISTORY_ARCHIVE_SEGMENT_ROWS}")
+    parser.add_argument("--dry-run", action="store_true", help="只统计不归档")
+    parser.add_argument("--vacuum", action="store_true", help="归档后执行VACUUM回收空间")
+    args = parser.parse_args()
+
+    try:
+        init_db()
+        db = SessionLocal()
+        try:
+            archived = archive_chat_histories(db, args.older_than_days, args.segment_rows, dry_run=args.dry_run)
+        finally:
+            db.close()
+        for user_id, count in archived.items():
+            print(f"用户 {user_id}: {count} 条记录{'待归档' if args.dry_run else '已归档'}")
+        print(f"共 {len(archived)} 个用户，{sum(archived.values())} 条记录")
+        if args.vacuum and not args.dry_run and archived:
+            with engine.connect() as connection:
+                connection.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+            print("VACUUM完成")
+    except Exception as e:
+        print(f"归档失败: {e}")
+        print(traceback.format_exc())
+        sys.exit(1)
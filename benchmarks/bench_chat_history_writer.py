@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天记录写入基准测试：多个请求线程同时写入聊天记录，
+对比逐条提交（direct）与 ChatHistoryWriter 组提交（sync / async 两种持久性）的吞吐、提交次数与请求线程耗时
+
+示例: python benchmarks/bench_chat_history_writer.py --threads 16 --seconds 5
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from database import Base, User, ChatHistory, create_configured_engine
+from chat_history_writer import ChatHistoryWriter
+
+def _percentile(values, ratio):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+def run(mode, threads, seconds, users):
+    work_dir = tempfile.mkdtemp(prefix=f"bench_history_{mode}_")
+    database_url = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    try:
+        write_engine = create_configured_engine(database_url)
+        Base.metadata.create_all(bind=write_engine)
+        WriteSession = sessionmaker(autocommit=False, autoflush=False, bind=write_engine)
+        db = WriteSession()
+        for i in range(users):
+            db.add(User(email=f"bench{i}@example.com", is_verified=True))
+        db.commit()
+        user_ids = [user.id for user in db.query(User).all()]
+        db.close()
+
+        commits = {"count": 0}
+        event.listen(write_engine, "commit", lambda *_: commits.__setitem__("count", commits["count"] + 1))
+        writer = ChatHistoryWriter(WriteSession, enabled=(mode != "direct"), durability="async" if mode == "direct" else mode)
+
+        stop = threading.Event()
+        latencies = []
+        latencies_lock = threading.Lock()
+
+        def worker(index):
+            turn = 0
+            local = []
+            while not stop.is_set():
+                start = time.perf_counter()
+                writer.submit(user_ids[(index + turn) % len(user_ids)], f"消息{turn}", f"回复{turn}" * 20, "S1")
+                local.append((time.perf_counter() - start) * 1000)
+                turn += 1
+            with latencies_lock:
+                latencies.extend(local)
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in workers:
+            thread.join()
+        writer.shutdown()
+        elapsed = time.perf_counter() - start
+
+        db = WriteSession()
+        stored = db.query(ChatHistory).count()
+        db.close()
+        write_engine.dispose()
+        return {
+            "mode": mode,
+            "rows_per_s": round(stored / elapsed, 1),
+            "rows_per_commit": round(stored / max(1, commits["count"]), 1),
+            "submit_p50_ms": round(_percentile(latencies, 0.5), 3),
+            "submit_p95_ms": round(_percentile(latencies, 0.95), 3),
+            "lost": len(latencies) - stored,
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对比逐条提交与组提交的聊天记录写入")
+    parser.add_argument("--threads", type=int, default=16, help="请求线程数，默认16")
+    parser.add_argument("--seconds", type=float, default=5, help="每种模式运行秒数，默认5")
+    parser.add_argument("--users", type=int, default=50, help="用户数，默认50")
+    args = parser.parse_args()
+
+    columns = ["mode", "rows_per_s", "rows_per_commit", "submit_p50_ms", "submit_p95_ms", "lost"]
+    results = [run(mode, args.threads, args.seconds, args.users) for mode in ("direct", "sync", "async")]
+    print("\t".join(columns))
+    for result in results:
+        print("\t".join(str(result[column]) for column in columns))
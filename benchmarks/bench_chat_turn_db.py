@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+单轮对话数据库开销基准测试：统计每轮对话的连接获取次数、提交次数与耗时，
+对比原先每步单独 get_db() 提交的流程（legacy）、database.UnitOfWork 的单事务流程（uow），
+以及情感状态改由 EmotionalStateStore 内存读写、批量写回的流程（store，写回开销计入总数后平摊）
+
+示例: python benchmarks/bench_chat_turn_db.py --turns 500 --users 20
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from database import (
+    Base, User, UnitOfWork, create_configured_engine, check_user_verified, get_or_create_user,
+    get_or_create_memory_collection, get_user_by_email, get_memory_collection_by_user,
+    get_or_create_user_emotional_state, update_user_emotional_state, create_chat_history
+)
+from emo_serv import EmotionalStateMachine
+from emotional_state_store import EmotionalStateStore
+
+def _percentile(values, ratio):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+def _legacy_turn(WriteSession, ReadSession, email, turn):
+    """原流程：身份、读取状态、保存状态、保存记录各自打开会话并提交"""
+    db = WriteSession()
+    try:
+        check_user_verified(db, email)
+        user = get_or_create_user(db, email)
+        get_or_create_memory_collection(db, user.id, email)
+        user_id = user.id
+    finally:
+        db.close()
+    db = WriteSession()
+    try:
+        state = get_or_create_user_emotional_state(db, user_id)
+        current_state = state.current_state
+    finally:
+        db.close()
+    db = WriteSession()
+    try:
+        update_user_emotional_state(db, user_id, current_state=current_state, affection=50 + turn % 50)
+    finally:
+        db.close()
+    db = WriteSession()
+    try:
+        create_chat_history(db, user_id, f"消息{turn}", f"回复{turn}", current_state)
+    finally:
+        db.close()
+
+def _uow_turn(WriteSession, ReadSession, email, turn):
+    """新流程：读操作共用只读会话，写操作在结束时同一事务提交"""
+    with UnitOfWork(WriteSession, ReadSession) as uow:
+        user = get_user_by_email(uow.read_db, email)
+        get_memory_collection_by_user(uow.read_db, user.id)
+        machine = EmotionalStateMachine(user.id)
+        machine.load_from_db(uow.read_db)
+        uow.release_reads()
+        machine.variables["affection"] = 50 + turn % 50
+        uow.add(machine.save_to_db)
+        uow.add(create_chat_history, user.id, f"消息{turn}", f"回复{turn}", machine.current_state)
+
+def _store_turn(WriteSession, ReadSession, email, turn, store):
+    """内存状态流程：情感状态读写内存，只有聊天记录进入本轮事务"""
+    with UnitOfWork(WriteSession, ReadSession) as uow:
+        user = get_user_by_email(uow.read_db, email)
+        get_memory_collection_by_user(uow.read_db, user.id)
+        uow.release_reads()
+        machine = EmotionalStateMachine(user.id)
+        store.load_into(machine)
+        machine.variables["affection"] = 50 + turn % 50
+        store.save_from(machine)
+        uow.add(create_chat_history, user.id, f"消息{turn}", f"回复{turn}", machine.current_state)
+
+def run(flow, turns, users):
+    work_dir = tempfile.mkdtemp(prefix=f"bench_turn_{flow}_")
+    database_url = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    try:
+        write_engine = create_configured_engine(database_url)
+        read_engine = create_configured_engine(database_url, read_only=True)
+        Base.metadata.create_all(bind=write_engine)
+        WriteSession = sessionmaker(autocommit=False, autoflush=False, bind=write_engine)
+        ReadSession = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+        db = WriteSession()
+        emails = [f"bench{i}@example.com" for i in range(users)]
+        for email in emails:
+            db.add(User(email=email, is_verified=True))
+        db.commit()
+        for user in db.query(User).all():
+            get_or_create_memory_collection(db, user.id, user.email)
+            get_or_create_user_emotional_state(db, user.id)
+        db.close()
+
+        counters = {"checkouts": 0, "commits": 0}
+        def on_checkout(*_):
+            counters["checkouts"] += 1
+        def on_commit(*_):
+            counters["commits"] += 1
+        for engine in (write_engine, read_engine):
+            event.listen(engine, "checkout", on_checkout)
+            event.listen(engine, "commit", on_commit)
+
+        latencies = []
+        if flow == "store":
+            # 不启动后台线程，结束时统一写回一次
+            store = EmotionalStateStore(WriteSession, ReadSession, enabled=True, flush_batch=turns + 1)
+            store._stopped.set()
+            for turn in range(turns):
+                start = time.perf_counter()
+                _store_turn(WriteSession, ReadSession, emails[turn % users], turn, store)
+                latencies.append((time.perf_counter() - start) * 1000)
+            store.flush()
+        else:
+            turn_fn = _legacy_turn if flow == "legacy" else _uow_turn
+            for turn in range(turns):
+                start = time.perf_counter()
+                turn_fn(WriteSession, ReadSession, emails[turn % users], turn)
+                latencies.append((time.perf_counter() - start) * 1000)
+        write_engine.dispose()
+        read_engine.dispose()
+
+        return {
+            "flow": flow,
+            "checkouts_per_turn": round(counters["checkouts"] / turns, 2),
+            "commits_per_turn": round(counters["commits"] / turns, 2),
+            "turn_p50_ms": round(_percentile(latencies, 0.5), 3),
+            "turn_p95_ms": round(_percentile(latencies, 0.95), 3),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对比单轮对话的数据库连接获取与提交次数")
+    parser.add_argument("--turns", type=int, default=500, help="对话轮数，默认500")
+    parser.add_argument("--users", type=int, default=20, help="用户数，默认20")
+    args = parser.parse_args()
+
+    columns = ["flow", "checkouts_per_turn", "commits_per_turn", "turn_p50_ms", "turn_p95_ms"]
+    results = [run(flow, args.turns, args.users) for flow in ("legacy", "uow", "store")]
+    print("\t".join(columns))
+    for result in results:
+        print("\t".join(str(result[column]) for column in columns))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+情感状态批量计算基准测试：对比逐条创建状态机计算（per_call）、进程内 evaluate_batch（batch），
+以及通过 emo_serv JSON-RPC 逐条请求（rpc_single）、请求数组（rpc_array）和一次 evaluate_batch 请求（rpc_batch）的每条耗时
+HTTP部分使用Flask测试客户端，不含网络往返，实际部署时逐条请求的开销更大
+
+示例: python benchmarks/bench_emotion_batch.py --messages 2000 --users 100
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "emotion_state_serv"))
+
+import emo_serv
+from emo_serv import EmotionalStateMachine
+from emotion_rules import emotion_rules, evaluate_batch
+
+def build_items(count, users, seed):
+    rng = random.Random(seed)
+    keywords = list(emotion_rules.get().automaton.keywords)
+    filler = "今天天气不错我们一起去吃饭吧你在做什么呢好的谢谢"
+    items = []
+    for _ in range(count):
+        parts = [rng.choice(keywords) if rng.random() < 0.15 else rng.choice(filler) for _ in range(rng.randint(5, 40))]
+        items.append({"user_id": rng.randrange(users), "message": "".join(parts)})
+    return items
+
+def per_call(items):
+    """与 emotion_state 工具相同：每条消息创建一个状态机，变量沿用该用户上一条的结果"""
+    latest = {}
+    results = []
+    for item in items:
+        machine = EmotionalStateMachine()
+        if item["user_id"] in latest:
+            machine.variables.update(latest[item["user_id"]])
+        new_state = machine.determine_state(item["message"])
+        latest[item["user_id"]] = machine.variables
+        results.append({"new_state": new_state, "state_description": machine.get_state_description(new_state),
+                        "variables": machine.variables})
+    return results
+
+def rpc_single(client, items):
+    for index, item in enumerate(items):
+        client.post("/", json={"jsonrpc": "2.0", "method": "evaluate_batch", "params": {"items": [item]}, "id": index})
+
+def rpc_array(client, items, chunk):
+    for start in range(0, len(items), chunk):
+        client.post("/", json=[{"jsonrpc": "2.0", "method": "evaluate_batch", "params": {"items": [item]}, "id": index}
+                               for index, item in enumerate(items[start:start + chunk])])
+
+def rpc_batch(client, items, chunk):
+    for start in range(0, len(items), chunk):
+        client.post("/", json={"jsonrpc": "2.0", "method": "evaluate_batch", "params": {"items": items[start:start + chunk]}, "id": start})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对比逐条与批量计算情感状态")
+    parser.add_argument("--messages", type=int, default=2000, help="消息条数，默认2000")
+    parser.add_argument("--users", type=int, default=100, help="用户数，默认100")
+    parser.add_argument("--chunk", type=int, default=500, help="每个HTTP批量请求包含的消息数，默认500")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子，默认42")
+    args = parser.parse_args()
+
+    items = build_items(args.messages, args.users, args.seed)
+    client = emo_serv.app.test_client()
+    modes = {
+        "per_call": lambda: per_call(items),
+        "batch": lambda: evaluate_batch(items),
+        "rpc_single": lambda: rpc_single(client, items),
+        "rpc_array": lambda: rpc_array(client, items, args.chunk),
+        "rpc_batch": lambda: rpc_batch(client, items, args.chunk),
+    }
+    print("\t".join(["mode", "us_per_message"]))
+    for mode, run in modes.items():
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        print(f"{mode}\t{round(elapsed * 1e6 / len(items), 2)}")
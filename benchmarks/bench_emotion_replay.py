@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+情感状态机回放基准测试：按用户、按时间顺序把已记录的用户消息重新输入情感状态机，
+统计吞吐、状态分布和状态转移矩阵，可同时回放第二个版本的规则文件并对比两者的差异
+
+数据来源：
+  --database-url  逐个用户流式读取 chat_histories（含已归档的记录），任一时刻只保存当前用户的状态，内存占用与记录数无关
+  --jsonl         每行 {"user_id", "user_message"（或 "message"）, "created_at"（可选，ISO格式UTC时间）, "state"（可选）}，
+                  按文件顺序回放，每个用户保存一份情感变量（内存与用户数成正比）
+每条消息的处理与线上一致：先按距该用户上一条消息的时间计算衰减，再扫描关键词、更新变量、判断状态；
+小时取消息的发送时间（本地时区），随机增量使用固定种子，两个规则版本使用相同的随机序列。
+
+示例: python benchmarks/bench_emotion_replay.py
+      python benchmarks/bench_emotion_replay.py --jsonl chats.jsonl --compare-rules emotion_state_serv/emotion_rules_new.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from collections import Counter
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "emotion_state_serv"))
+
+from config import Config
+from emotion_rules import DEFAULT_RULES_PATH, load_rules
+
+SKIPPED_MESSAGES = {"[INIT]"}  # 开场白等不是用户输入的记录
+
+def iter_database(database_url, batch_size):
+    """产出 (user_id, user_message, created_at, recorded_state)，同一用户的记录连续且按时间正序"""
+    from sqlalchemy import select, union
+    from sqlalchemy.orm import sessionmaker
+    from database import ChatHistory, ChatHistoryArchive, create_configured_engine, iter_chat_histories_by_user
+    engine = create_configured_engine(database_url, read_only=True)
+    db = sessionmaker(bind=engine)()
+    try:
+        user_ids = db.scalars(union(select(ChatHistory.user_id), select(ChatHistoryArchive.user_id))).all()
+        for user_id in sorted(user_ids):
+            for row in iter_chat_histories_by_user(db, user_id, batch_size):
+                yield user_id, row.user_message, row.created_at, row.state
+            db.expunge_all()
+    finally:
+        db.close()
+        engine.dispose()
+
+def iter_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            created_at = record.get("created_at")
+            if created_at:
+                created_at = datetime.fromisoformat(created_at)
+            yield record["user_id"], record.get("user_message", record.get("message", "")), created_at, record.get("state")
+
+class Replayer:
+    """用一个规则版本回放消息，保存每个用户的情感状态，并累计状态分布和转移矩阵"""
+    def __init__(self, rules, seed, keep_all_users):
+        self.rules = rules
+        self.rng = random.Random(seed)
+        self.keep_all_users = keep_all_users
+        self.users = {}  # user_id -> (状态, 变量, 上一条消息时间)
+        self.current_user = None
+        self.distribution = Counter()
+        self.transitions = Counter()  # (上一个状态, 新状态) -> 次数
+        self.engine_seconds = 0.0
+
+    def step(self, user_id, message, created_at):
+        if not self.keep_all_users and user_id != self.current_user:
+            self.users.clear()  # 数据库来源按用户连续产出，切换用户后不再需要上一个用户的状态
+        self.current_user = user_id
+        rules = self.rules
+        start = time.perf_counter()
+        entry = self.users.get(user_id)
+        if entry is None:
+            state, variables, last_time = rules.default_state, rules.default_variables(), None
+        else:
+            state, variables, last_time = entry
+        hour = created_at.replace(tzinfo=timezone.utc).astimezone().hour if created_at else 12
+        if last_time is not None and created_at is not None:
+            if rules.decay_variables(variables, (created_at - last_time).total_seconds()):
+                state = rules.settle_state(state, variables, hour)
+        hits = rules.scan(message)
+        rules.update_variables(variables, hits, hour, self.rng)
+        new_state = rules.decide(variables, hits, hour)
+        self.users[user_id] = (new_state, variables, created_at)
+        self.engine_seconds += time.perf_counter() - start
+        self.distribution[new_state] += 1
+        self.transitions[(state, new_state)] += 1
+        return new_state
+
+def print_matrix(title, counts, rows, columns):
+    print(f"\n# {title}（行: {rows[0]}，列: {columns[0]}）")
+    row_labels = sorted({row for row, _ in counts})
+    column_labels = sorted({column for _, column in counts})
+    print("\t".join([""] + column_labels))
+    for row in row_labels:
+        print("\t".join([row] + [str(counts.get((row, column), 0)) for column in column_labels]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="回放聊天记录，统计情感状态机的吞吐与状态分布，对比两个规则版本")
+    parser.add_argument("--database-url", default=Config.DATABASE_URL, help="读取chat_histories的数据库，默认Config.DATABASE_URL")
+    parser.add_argument("--jsonl", help="改为从JSONL文件读取消息")
+    parser.add_argument("--rules", default=DEFAULT_RULES_PATH, help=f"规则文件，默认{DEFAULT_RULES_PATH}")
+    parser.add_argument("--compare-rules", help="对比用的第二个规则文件")
+    parser.add_argument("--limit", type=int, help="最多回放的消息条数")
+    parser.add_argument("--batch-size", type=int, default=Config.CHAT_HISTORY_EXPORT_BATCH_SIZE, help="每次从数据库读取的条数")
+    parser.add_argument("--seed", type=int, default=42, help="随机增量的种子，默认42")
+    args = parser.parse_args()
+
+    source = iter_jsonl(args.jsonl) if args.jsonl else iter_database(args.database_url, args.batch_size)
+    keep_all_users = bool(args.jsonl)
+    base = Replayer(load_rules(args.rules), args.seed, keep_all_users)
+    other = Replayer(load_rules(args.compare_rules), args.seed, keep_all_users) if args.compare_rules else None
+    recorded_total = recorded_match = 0
+    differences = Counter()  # (规则1状态, 规则2状态) -> 次数
+    rows = 0
+    users = set() if keep_all_users else None
+    user_count = 0
+    last_user = None
+
+    start = time.perf_counter()
+    for user_id, message, created_at, recorded_state in source:
+        if message in SKIPPED_MESSAGES:
+            continue
+        if user_id != last_user:
+            last_user = user_id
+            if users is None:
+                user_count += 1
+            else:
+                users.add(user_id)
+        state = base.step(user_id, message, created_at)
+        if recorded_state:
+            recorded_total += 1
+            recorded_match += state == recorded_state
+        if other is not None:
+            differences[(state, other.step(user_id, message, created_at))] += 1
+        rows += 1
+        if args.limit and rows >= args.limit:
+            break
+    elapsed = time.perf_counter() - start
+
+    print("\t".join(["rows", "users", "seconds", "rows_per_s", "engine_rows_per_s", "recorded_match"]))
+    print("\t".join(str(value) for value in [
+        rows,
+        len(users) if users is not None else user_count,
+        round(elapsed, 2),
+        round(rows / elapsed, 1) if elapsed else 0,
+        round(rows / base.engine_seconds, 1) if base.engine_seconds else 0,
+        f"{recorded_match / recorded_total:.1%}" if recorded_total else "-",
+    ]))
+
+    print("\n# 状态分布")
+    print("\t".join(["state", "count", "ratio"] + (["compare_count", "compare_ratio"] if other else [])))
+    for state in sorted(set(base.distribution) | set(other.distribution if other else ())):
+        line = [state, str(base.distribution[state]), f"{base.distribution[state] / max(1, rows):.1%}"]
+        if other:
+            line += [str(other.distribution[state]), f"{other.distribution[state] / max(1, rows):.1%}"]
+        print("\t".join(line))
+
+    print_matrix("状态转移矩阵", base.transitions, ["上一个状态"], ["新状态"])
+    if other:
+        changed = sum(count for (left, right), count in differences.items() if left != right)
+        print(f"\n# 规则对比: {args.rules} -> {args.compare_rules}")
+        print(f"状态不同的消息: {changed} / {rows}（{changed / max(1, rows):.1%}）")
+        print_matrix("规则对比矩阵", differences, [os.path.basename(args.rules)], [os.path.basename(args.compare_rules)])
+        print_matrix("对比规则的状态转移矩阵", other.transitions, ["上一个状态"], ["新状态"])
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+情感关键词匹配基准测试：对比逐个关键词 `in` / `count` 扫描消息（legacy，原状态机的做法）
+与 keyword_automaton 单次扫描（automaton），关键词表从现有规模逐步扩大
+
+示例: python benchmarks/bench_keyword_automaton.py --messages 2000 --sizes 0,100,1000,5000
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "emotion_state_serv"))
+
+from keyword_automaton import KeywordAutomaton
+from emotion_rules import load_rules
+
+# 随机消息与合成关键词使用的常用汉字
+CHARS = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指"
+
+def legacy_scan(rules, user_msg, lowered_groups):
+    """原实现：每个关键词各扫描一次消息，部分规则组每次重新转换小写"""
+    distinct, counts = {}, {}
+    for category, keywords in rules.items():
+        msg = user_msg.lower() if category in lowered_groups else user_msg
+        hit, total = 0, 0
+        for keyword in keywords:
+            if keyword in msg:
+                hit += 1
+                total += msg.count(keyword)
+        if hit:
+            distinct[category], counts[category] = hit, total
+    return counts, distinct
+
+def build_rules(extra_keywords, seed):
+    """在现有规则文件的关键词表基础上，把合成关键词平均分配到各个类别"""
+    rules = {category: list(keywords) for category, keywords in load_rules().keyword_rules.items()}
+    rng = random.Random(seed)
+    categories = list(rules)
+    for i in range(extra_keywords):
+        category = rules[categories[i % len(categories)]]
+        keyword = "".join(rng.choice(CHARS) for _ in range(rng.randint(2, 4)))
+        while keyword in category:  # 同一类别内的关键词不重复
+            keyword = "".join(rng.choice(CHARS) for _ in range(rng.randint(2, 4)))
+        category.append(keyword)
+    return rules
+
+def build_messages(rules, count, length, seed):
+    rng = random.Random(seed)
+    keywords = [keyword for keywords in rules.values() for keyword in keywords]
+    messages = []
+    for _ in range(count):
+        parts = []
+        while sum(len(part) for part in parts) < length:
+            # 约十分之一的片段是关键词，其余为随机汉字
+            parts.append(rng.choice(keywords) if rng.random() < 0.1 else rng.choice(CHARS))
+        messages.append("".join(parts))
+    return messages
+
+def run(extra_keywords, message_count, length, seed):
+    rules = build_rules(extra_keywords, seed)
+    messages = build_messages(rules, message_count, length, seed + 1)
+    lowered_groups = {category for category in rules if not category.startswith("variable:")}
+
+    start = time.perf_counter()
+    automaton = KeywordAutomaton(rules)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    legacy_results = [legacy_scan(rules, message, lowered_groups) for message in messages]
+    legacy_us = (time.perf_counter() - start) * 1e6 / message_count
+
+    start = time.perf_counter()
+    automaton_results = [automaton.scan(message) for message in messages]
+    automaton_us = (time.perf_counter() - start) * 1e6 / message_count
+
+    mismatches = sum(1 for legacy, hits in zip(legacy_results, automaton_results)
+                     if legacy != (hits.counts, hits.distinct))
+    return {
+        "keywords": len(automaton.keywords),
+        "build_ms": round(build_ms, 2),
+        "legacy_us": round(legacy_us, 2),
+        "automaton_us": round(automaton_us, 2),
+        "speedup": round(legacy_us / automaton_us, 2),
+        "mismatches": mismatches,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对比逐关键词扫描与Aho-Corasick单次扫描")
+    parser.add_argument("--messages", type=int, default=2000, help="消息条数，默认2000")
+    parser.add_argument("--length", type=int, default=40, help="每条消息的大致字数，默认40")
+    parser.add_argument("--sizes", default="0,100,1000,5000", help="额外合成的关键词数量，逗号分隔，默认0,100,1000,5000")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子，默认42")
+    args = parser.parse_args()
+
+    columns = ["keywords", "build_ms", "legacy_us", "automaton_us", "speedup", "mismatches"]
+    print("\t".join(columns))
+    for size in (int(value) for value in args.sizes.split(",")):
+        result = run(size, args.messages, args.length, args.seed)
+        print("\t".join(str(result[column]) for column in columns))
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+记忆租户模式基准测试：对比 per_user 与 shared 两种布局的打开文件数、RSS 和查询延迟
+
+每种布局在独立子进程中运行，避免相互影响内存和文件句柄统计。
+示例: python benchmarks/bench_memory_tenancy.py --users 10000 --memories-per-user 5
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _open_file_count():
+    """当前进程打开的文件描述符数量"""
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return -1
+
+def _rss_mb():
+    """当前进程常驻内存（MB）"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _random_vector(rng, dim):
+    vec = [rng.gauss(0, 1) for _ in range(dim)]
+    norm = sum(v * v for v in vec) ** 0.5 or 1.0
+    return [v / norm for v in vec]
+
+def run_layout(layout, users, memories_per_user, dim, queries, seed):
+    """在单个进程内构建指定布局并测量"""
+    import chromadb
+    from config import Config
+    from memory_manager import SharedTenantCollection, shared_collection_name
+
+    Config.MEMORY_TENANCY_MODE = layout
+    rng = random.Random(seed)
+    persist_dir = tempfile.mkdtemp(prefix=f"bench_tenancy_{layout}_")
+    try:
+        client = chromadb.PersistentClient(path=persist_dir)
+
+        def collection_for(user_id):
+            if layout == "shared":
+                return SharedTenantCollection(client.get_or_create_collection(name=shared_collection_name(user_id, dim)), user_id)
+            return client.get_or_create_collection(name=f"memory_bench_user_{user_id}__d{dim}")
+
+        build_start = time.time()
+        for user_id in range(users):
+            collection = collection_for(user_id)
+            collection.add(
+                ids=[f"memory_{i}" for i in range(memories_per_user)],
+                documents=[f"用户{user_id}的第{i}条记忆" for i in range(memories_per_user)],
+                embeddings=[_random_vector(rng, dim) for _ in range(memories_per_user)],
+                metadatas=[{"memory_type": "conversation", "importance": 0.5} for _ in range(memories_per_user)]
+            )
+        build_seconds = time.time() - build_start
+
+        latencies = []
+        for _ in range(queries):
+            user_id = rng.randrange(users)
+            query_embedding = _random_vector(rng, dim)
+            start = time.perf_counter()
+            collection_for(user_id).query(query_embeddings=[query_embedding], n_results=3)
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+
+        return {
+            "layout": layout,
+            "users": users,
+            "memories_per_user": memories_per_user,
+            "collections": len(client.list_collections()),
+            "build_seconds": round(build_seconds, 2),
+            "open_files": _open_file_count(),
+            "rss_mb": round(_rss_mb(), 1),
+            "query_p50_ms": round(latencies[len(latencies) // 2], 3),
+            "query_p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+            "query_p99_ms": round(latencies[int(len(latencies) * 0.99) - 1], 3),
+        }
+    finally:
+        shutil.rmtree(persist_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对比per_user与shared记忆租户布局")
+    parser.add_argument("--users", type=int, default=10000, help="用户数，默认10000")
+    parser.add_argument("--memories-per-user", type=int, default=5, help="每个用户的记忆条数，默认5")
+    parser.add_argument("--dim", type=int, default=512, help="向量维度，默认512（bge-small-zh）")
+    parser.add_argument("--queries", type=int, default=1000, help="查询次数，默认1000")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--layout", choices=["per_user", "shared"], help="只运行单个布局（内部使用）")
+    args = parser.parse_args()
+
+    if args.layout:
+        print(json.dumps(run_layout(args.layout, args.users, args.memories_per_user, args.dim, args.queries, args.seed), ensure_ascii=False))
+        sys.exit(0)
+
+    results = []
+    for layout in ("per_user", "shared"):
+        print(f"正在测试布局: {layout} ...")
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--layout", layout,
+             "--users", str(args.users), "--memories-per-user", str(args.memories_per_user),
+             "--dim", str(args.dim), "--queries", str(args.queries), "--seed", str(args.seed)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    columns = ["layout", "collections", "build_seconds", "open_files", "rss_mb", "query_p50_ms", "query_p95_ms", "query_p99_ms"]
+    print("\t".join(columns))
+    for result in results:
+        print("\t".join(str(result[column]) for column in columns))
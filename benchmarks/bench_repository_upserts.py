@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据库仓储操作基准测试：对比原先"先查询、再插入/更新、再refresh"的实现（legacy）
+与 database 中基于 INSERT ... ON CONFLICT DO UPDATE ... RETURNING 的实现（upsert），
+统计每个操作的SQL语句数和延迟
+
+示例: python benchmarks/bench_repository_upserts.py --iterations 2000
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+import database
+from database import Base, User, MemoryCollection, UserEmotionalState, create_configured_engine
+
+# ---- 原实现（仅用于对比） ----
+def legacy_get_or_create_user(db, email):
+    user = db.query(User).filter(User.email == email).first()
+    if not user:
+        user = User(email=email)
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+    return user
+
+def legacy_get_or_create_memory_collection(db, user_id, email):
+    collection = db.query(MemoryCollection).filter(MemoryCollection.user_id == user_id).first()
+    if collection:
+        return collection
+    collection = MemoryCollection(user_id=user_id, collection_name=f"memory_{email.replace('@', '_').replace('.', '_')}")
+    db.add(collection)
+    db.commit()
+    db.refresh(collection)
+    return collection
+
+def legacy_update_user_emotional_state(db, user_id, current_state=None, affection=None):
+    state = db.query(UserEmotionalState).filter(UserEmotionalState.user_id == user_id).first()
+    if not state:
+        state = UserEmotionalState(user_id=user_id)
+        db.add(state)
+        db.commit()
+        db.refresh(state)
+    if current_state is not None:
+        state.current_state = current_state
+    if affection is not None:
+        state.affection = max(0, min(100, affection))
+    db.commit()
+    db.refresh(state)
+    return state
+
+def legacy_create_verification_code(db, email):
+    user = db.query(User).filter(User.email == email).first()
+    if user and user.verification_code and user.verification_code_expires:
+        if user.verification_code_expires > datetime.utcnow():
+            remaining_time = (user.verification_code_expires - datetime.utcnow()).seconds
+            if remaining_time > 30:
+                return None, f"请等待{remaining_time}秒后再重新发送验证码"
+    verification_code = database.generate_verification_code()
+    expires_at = datetime.utcnow() + timedelta(minutes=5)
+    if user:
+        user.verification_code = verification_code
+        user.verification_code_expires = expires_at
+        user.failed_attempts = 0
+        user.last_attempt_time = None
+    else:
+        user = User(email=email, is_verified=False, verification_code=verification_code, verification_code_expires=expires_at)
+        db.add(user)
+    db.commit()
+    db.refresh(user)
+    return user, None
+
+IMPLEMENTATIONS = {
+    "legacy": {
+        "get_or_create_user": legacy_get_or_create_user,
+        "get_or_create_memory_collection": legacy_get_or_create_memory_collection,
+        "update_user_emotional_state": legacy_update_user_emotional_state,
+        "create_verification_code": legacy_create_verification_code,
+    },
+    "upsert": {
+        "get_or_create_user": database.get_or_create_user,
+        "get_or_create_memory_collection": database.get_or_create_memory_collection,
+        "update_user_emotional_state": database.update_user_emotional_state,
+        "create_verification_code": database.create_verification_code,
+    },
+}
+
+def _percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+def run(impl, iterations):
+    work_dir = tempfile.mkdtemp(prefix=f"bench_upsert_{impl}_")
+    try:
+        engine = create_configured_engine(f"sqlite:///{os.path.join(work_dir, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        statements = {"count": 0}
+        event.listen(engine, "before_cursor_execute", lambda *_: statements.__setitem__("count", statements["count"] + 1))
+        ops = IMPLEMENTATIONS[impl]
+
+        def expire_codes(db):
+            # 让下一轮可以重新发送验证码
+            db.query(User).update({"verification_code_expires": datetime.utcnow()})
+            db.commit()
+
+        # (场景名, 准备函数, 操作)
+        scenarios = [
+            ("create_user(new)", None, lambda db, i: ops["get_or_create_user"](db, f"new{i}@example.com")),
+            ("get_user(existing)", None, lambda db, i: ops["get_or_create_user"](db, f"new{i}@example.com")),
+            ("create_collection(new)", None, lambda db, i: ops["get_or_create_memory_collection"](db, i + 1, f"new{i}@example.com")),
+            ("get_collection(existing)", None, lambda db, i: ops["get_or_create_memory_collection"](db, i + 1, f"new{i}@example.com")),
+            ("update_state(new)", None, lambda db, i: ops["update_user_emotional_state"](db, i + 1, current_state="S2", affection=60)),
+            ("update_state(existing)", None, lambda db, i: ops["update_user_emotional_state"](db, i + 1, current_state="S3", affection=70)),
+            ("verification_code(new)", None, lambda db, i: ops["create_verification_code"](db, f"code{i}@example.com")),
+            ("verification_code(resend)", expire_codes, lambda db, i: ops["create_verification_code"](db, f"code{i}@example.com")),
+        ]
+        results = []
+        for name, prepare, operation in scenarios:
+            db = Session()
+            if prepare:
+                prepare(db)
+            latencies = []
+            statements["count"] = 0
+            for i in range(iterations):
+                start = time.perf_counter()
+                operation(db, i)
+                latencies.append((time.perf_counter() - start) * 1000)
+                db.expunge_all()  # 模拟每个请求使用新会话，避免命中ORM身份映射
+            db.close()
+            results.append({
+                "impl": impl,
+                "operation": name,
+                "statements": round(statements["count"] / iterations, 2),
+                "p50_ms": round(_percentile(latencies, 0.5), 3),
+                "p95_ms": round(_percentile(latencies, 0.95), 3),
+            })
+        engine.dispose()
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对比先查后写与单条upsert的仓储操作延迟")
+    parser.add_argument("--iterations", type=int, default=2000, help="每个场景的执行次数，默认2000")
+    args = parser.parse_args()
+
+    columns = ["operation", "impl", "statements", "p50_ms", "p95_ms"]
+    results = run("legacy", args.iterations) + run("upsert", args.iterations)
+    results.sort(key=lambda result: (result["operation"], result["impl"]))
+    print("\t".join(columns))
+    for result in results:
+        print("\t".join(str(result[column]) for column in columns))
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite并发基准测试：写线程（聊天记录插入 + 情感状态更新）与读线程（聊天记录查询）同时运行，
+对比默认引擎配置与 database.create_configured_engine（WAL、busy_timeout、独立只读连接池）
+
+示例: python benchmarks/bench_sqlite_concurrency.py --writers 8 --readers 8 --seconds 10
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from database import (
+    Base, User, create_configured_engine, create_chat_history,
+    update_user_emotional_state, get_chat_histories_by_user
+)
+
+def _percentile(values, ratio):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+def run(layout, writers, readers, seconds, users):
+    work_dir = tempfile.mkdtemp(prefix=f"bench_sqlite_{layout}_")
+    database_url = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    try:
+        if layout == "default":
+            write_engine = create_engine(database_url)
+            read_engine = write_engine
+        else:
+            write_engine = create_configured_engine(database_url)
+            read_engine = create_configured_engine(database_url, read_only=True)
+        Base.metadata.create_all(bind=write_engine)
+        WriteSession = sessionmaker(autocommit=False, autoflush=False, bind=write_engine)
+        ReadSession = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+        db = WriteSession()
+        for i in range(users):
+            db.add(User(email=f"bench{i}@example.com", is_verified=True))
+        db.commit()
+        user_ids = [user.id for user in db.query(User).all()]
+        # 预先创建情感状态，只测量锁竞争而不是首次创建时的并发冲突
+        for user_id in user_ids:
+            update_user_emotional_state(db, user_id)
+        db.close()
+
+        stop = threading.Event()
+        stats = {"write": [], "read": [], "errors": 0}
+        stats_lock = threading.Lock()
+
+        def writer(index):
+            turn = 0
+            while not stop.is_set():
+                user_id = user_ids[(index + turn) % len(user_ids)]
+                start = time.perf_counter()
+                session = WriteSession()
+                try:
+                    update_user_emotional_state(session, user_id, current_state="S1", affection=50 + turn % 50)
+                    create_chat_history(session, user_id, f"消息{turn}", f"回复{turn}" * 20, "S1")
+                    elapsed = (time.perf_counter() - start) * 1000
+                    with stats_lock:
+                        stats["write"].append(elapsed)
+                except Exception:
+                    session.rollback()
+                    with stats_lock:
+                        stats["errors"] += 1
+                finally:
+                    session.close()
+                turn += 1
+
+        def reader(index):
+            turn = 0
+            while not stop.is_set():
+                user_id = user_ids[(index + turn) % len(user_ids)]
+                start = time.perf_counter()
+                session = ReadSession()
+                try:
+                    get_chat_histories_by_user(session, user_id)
+                    elapsed = (time.perf_counter() - start) * 1000
+                    with stats_lock:
+                        stats["read"].append(elapsed)
+                except Exception:
+                    with stats_lock:
+                        stats["errors"] += 1
+                finally:
+                    session.close()
+                turn += 1
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+        threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        write_engine.dispose()
+        read_engine.dispose()
+
+        return {
+            "layout": layout,
+            "writes_per_s": round(len(stats["write"]) / seconds, 1),
+            "reads_per_s": round(len(stats["read"]) / seconds, 1),
+            "write_p95_ms": round(_percentile(stats["write"], 0.95), 2),
+            "read_p95_ms": round(_percentile(stats["read"], 0.95), 2),
+            "errors": stats["errors"],
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQLite写线程与读线程并发基准测试")
+    parser.add_argument("--writers", type=int, default=8, help="写线程数，默认8")
+    parser.add_argument("--readers", type=int, default=8, help="读线程数，默认8")
+    parser.add_argument("--seconds", type=float, default=10, help="每种配置运行秒数，默认10")
+    parser.add_argument("--users", type=int, default=50, help="用户数，默认50")
+    args = parser.parse_args()
+
+    columns = ["layout", "writes_per_s", "reads_per_s", "write_p95_ms", "read_p95_ms", "errors"]
+    results = [run(layout, args.writers, args.readers, args.seconds, args.users) for layout in ("default", "tuned")]
+    print("\t".join(columns))
+    for result in results:
+        print("\t".join(str(result[column]) for column in columns))
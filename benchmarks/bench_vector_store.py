@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量存储后端基准测试：对比 chroma 与 numpy 后端的启动耗时、RSS 和查询延迟
+
+先在子进程中写入数据，再在全新的子进程中测量冷启动，避免写入阶段的缓存影响结果。
+示例: python benchmarks/bench_vector_store.py --collections 200 --vectors 300
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _rss_mb():
+    """当前进程常驻内存（MB）"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _random_vector(rng, dim):
+    return [rng.gauss(0, 1) for _ in range(dim)]
+
+def build(backend, persist_dir, collections, vectors, dim, seed):
+    from vector_store import create_vector_store
+    rng = random.Random(seed)
+    store = create_vector_store(backend, persist_dir)
+    for c in range(collections):
+        collection = store.get_or_create_collection(f"memory_bench_user_{c}__d{dim}")
+        collection.add(
+            ids=[f"memory_{i}" for i in range(vectors)],
+            documents=[f"第{i}条记忆" for i in range(vectors)],
+            embeddings=[_random_vector(rng, dim) for _ in range(vectors)],
+            metadatas=[{"memory_type": "conversation", "importance": 0.5} for _ in range(vectors)]
+        )
+    return {"backend": backend}
+
+def measure(backend, persist_dir, collections, dim, queries, seed):
+    rng = random.Random(seed)
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    from vector_store import create_vector_store
+    store = create_vector_store(backend, persist_dir)
+    store.get_or_create_collection(f"memory_bench_user_0__d{dim}").query(query_embeddings=[_random_vector(rng, dim)], n_results=3)
+    startup_ms = (time.perf_counter() - start) * 1000
+
+    latencies = []
+    for _ in range(queries):
+        collection = store.get_or_create_collection(f"memory_bench_user_{rng.randrange(collections)}__d{dim}")
+        query_embedding = _random_vector(rng, dim)
+        start = time.perf_counter()
+        collection.query(query_embeddings=[query_embedding], n_results=3)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        "backend": backend,
+        "startup_ms": round(startup_ms, 1),
+        "rss_mb": round(_rss_mb(), 1),
+        "rss_delta_mb": round(_rss_mb() - rss_before, 1),
+        "query_p50_ms": round(latencies[len(latencies) // 2], 3),
+        "query_p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+    }
+
+def _run_phase(phase, backend, persist_dir, args):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--phase", phase, "--backend", backend, "--persist-dir", persist_dir,
+         "--collections", str(args.collections), "--vectors", str(args.vectors), "--dim", str(args.dim),
+         "--queries", str(args.queries), "--seed", str(args.seed)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对比chroma与numpy向量存储后端")
+    parser.add_argument("--collections", type=int, default=200, help="用户集合数，默认200")
+    parser.add_argument("--vectors", type=int, default=300, help="每个集合的向量数，默认300")
+    parser.add_argument("--dim", type=int, default=512, help="向量维度，默认512（bge-small-zh）")
+    parser.add_argument("--queries", type=int, default=1000, help="查询次数，默认1000")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--phase", choices=["build", "measure"], help="内部使用")
+    parser.add_argument("--backend", choices=["chroma", "numpy"], help="内部使用")
+    parser.add_argument("--persist-dir", help="内部使用")
+    args = parser.parse_args()
+
+    if args.phase == "build":
+        print(json.dumps(build(args.backend, args.persist_dir, args.collections, args.vectors, args.dim, args.seed)))
+        sys.exit(0)
+    if args.phase == "measure":
+        print(json.dumps(measure(args.backend, args.persist_dir, args.collections, args.dim, args.queries, args.seed)))
+        sys.exit(0)
+
+    results = []
+    for backend in ("chroma", "numpy"):
+        persist_dir = tempfile.mkdtemp(prefix=f"bench_vector_store_{backend}_")
+        try:
+            print(f"正在测试后端: {backend} ...")
+            _run_phase("build", backend, persist_dir, args)
+            results.append(_run_phase("measure", backend, persist_dir, args))
+        finally:
+            shutil.rmtree(persist_dir, ignore_errors=True)
+
+    columns = ["backend", "startup_ms", "rss_mb", "rss_delta_mb", "query_p50_ms", "query_p95_ms"]
+    print("\t".join(columns))
+    for result in results:
+        print("\t".join(str(result[column]) for column in columns))
@@ -0,0 +1,210 @@
+"""
+聊天记录组提交写入器
+
+请求线程只把聊天记录放入队列，后台线程攒批后用一条多行INSERT（executemany）写入并只提交一次。
+攒够 Config.CHAT_HISTORY_BATCH_SIZE 条或等待超过 Config.CHAT_HISTORY_FLUSH_INTERVAL 秒即写入。
+持久性：sync 模式下 submit 等到所在批次提交后才返回；async 模式下立即返回，进程崩溃时可能丢失最后一批。
+读取某个用户的聊天记录前调用 wait_for_user，保证能读到该用户刚提交的记录。
+批量写入连续失败 Config.CHAT_HISTORY_WRITE_RETRIES 次后改为逐条写入，写不进去的记录打印后丢弃，
+写入器继续处理后续批次；sync 模式下记录被丢弃的 submit 抛出RuntimeError。
+"""
+
+import time
+import queue
+import atexit
+import threading
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import insert
+from config import Config
+from database import SessionLocal, ChatHistory, create_chat_history
+
+class ChatHistoryWriter:
+    """后台组提交聊天记录"""
+    def __init__(self, session_factory=None, enabled=Config.CHAT_HISTORY_WRITER_ENABLED,
+                 durability=Config.CHAT_HISTORY_DURABILITY, batch_size=Config.CHAT_HISTORY_BATCH_SIZE,
+                 flush_interval=Config.CHAT_HISTORY_FLUSH_INTERVAL, timeout=Config.DB_POOL_TIMEOUT,
+                 max_retries=Config.CHAT_HISTORY_WRITE_RETRIES):
+        if durability not in ("sync", "async"):
+            raise ValueError(f"未知的聊天记录持久性模式: {durability}")
+        self._session_factory = session_factory or SessionLocal
+        self.enabled = enabled
+        self.durability = durability
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._queue = queue.Queue()
+        self._cond = threading.Condition()
+        self._pending_users = Counter()  # user_id -> 已提交到队列但尚未写入的条数
+        self._next_seq = 0
+        self._committed_seq = 0  # 批次按顺序处理，此前的全部序号均已落库或被丢弃
+        self._sync_seqs = set()  # 正在等待写入结果的sync提交
+        self._dropped_seqs = set()  # 其中写入失败被丢弃的序号
+        self._urgent = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def submit(self, user_id, user_message, assistant_message, state, durability=None, uow=None):
+        """提交一条聊天记录；durability为None时使用默认持久性模式。写入器关闭时登记到uow（未传入时立即写入数据库）"""
+        if not self.enabled:
+            if uow is not None:
+                uow.add(create_chat_history, user_id, user_message, assistant_message, state)
+                return
+            db = self._session_factory()
+            try:
+                create_chat_history(db, user_id, user_message, assistant_message, state)
+            finally:
+                db.close()
+            return
+        row = {
+            "user_id": user_id,
+            "user_message": user_message,
+            "assistant_message": assistant_message,
+            "state": state,
+        }
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("聊天记录写入器已关闭")
+            self._next_seq += 1
+            seq = self._next_seq
+            # 在锁内取提交时间，时间顺序与序号（即写入和ID的顺序）一致，按 (created_at, id) 排序时保持提交顺序
+            row["created_at"] = datetime.utcnow()
+            self._pending_users[user_id] += 1
+            sync = (durability or self.durability) == "sync"
+            if sync:
+                self._sync_seqs.add(seq)
+            self._queue.put((seq, row))
+        self._ensure_started()
+        if sync:
+            self._urgent.set()
+            try:
+                self._wait(lambda: self._committed_seq >= seq)
+            finally:
+                with self._cond:
+                    self._sync_seqs.discard(seq)
+                    dropped = seq in self._dropped_seqs
+                    self._dropped_seqs.discard(seq)
+            if dropped:
+                raise RuntimeError("聊天记录写入失败，已丢弃")
+
+    def wait_for_user(self, user_id, timeout=None):
+        """等待该用户已提交的记录全部写入（读自己写的一致性），没有待写入记录时立即返回"""
+        with self._cond:
+            if not self._pending_users[user_id]:
+                return
+        self._urgent.set()
+        self._wait(lambda: not self._pending_users[user_id], timeout)
+
+    def flush(self, timeout=None):
+        """等待当前队列中的全部记录写入"""
+        with self._cond:
+            seq = self._next_seq
+        if self._committed_seq >= seq:
+            return
+        self._urgent.set()
+        self._wait(lambda: self._committed_seq >= seq, timeout)
+
+    def _wait(self, predicate, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(predicate, timeout or self.timeout):
+                raise TimeoutError("等待聊天记录写入超时")
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="chat-history-writer", daemon=True)
+                self._thread.start()
+
+    def _collect_batch(self):
+        """取一批记录：有记录后继续攒批，直到达到批量大小、超过等待时间或有请求在等待"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._urgent.is_set() or self._stopped:
+                break
+            try:
+                batch.append(self._queue.get(timeout=min(remaining, 0.005)))
+            except queue.Empty:
+                pass
+        self._urgent.clear()
+        return batch
+
+    def _write(self, batch):
+        db = self._session_factory()
+        try:
+            db.execute(insert(ChatHistory), [row for _, row in batch])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _write_rows(self, batch):
+        """逐条写入，返回写入失败被丢弃的记录"""
+        dropped = []
+        for item in batch:
+            try:
+                self._write([item])
+            except Exception as e:
+                seq, row = item
+                print(f"聊天记录写入失败，已丢弃: 用户 {row['user_id']}，序号 {seq}，{e}")
+                dropped.append(item)
+        return dropped
+
+    def _run(self):
+        retry = []
+        attempts = 0
+        while True:
+            batch = retry or self._collect_batch()
+            if not batch:
+                if self._stopped and self._queue.empty():
+                    return
+                continue
+            dropped = []
+            try:
+                self._write(batch)
+            except Exception as e:
+                attempts += 1
+                if attempts <= self.max_retries:
+                    # 保留原批次按顺序重试，避免后续批次越过它提交
+                    print(f"聊天记录批量写入失败，稍后重试（第 {attempts} 次）: {e}")
+                    retry = batch
+                    time.sleep(self.flush_interval * 2 ** (attempts - 1))
+                    continue
+                print(f"聊天记录批量写入连续失败 {attempts} 次，改为逐条写入: {e}")
+                dropped = self._write_rows(batch)
+            retry = []
+            attempts = 0
+            with self._cond:
+                self._dropped_seqs.update(seq for seq, _ in dropped if seq in self._sync_seqs)
+                for seq, row in batch:
+                    self._pending_users[row["user_id"]] -= 1
+                    if not self._pending_users[row["user_id"]]:
+                        del self._pending_users[row["user_id"]]
+                self._committed_seq = batch[-1][0]
+                self._cond.notify_all()
+
+    def shutdown(self, timeout=None):
+        """停止接收新记录，写入队列中剩余的记录（进程退出时自动调用）"""
+        with self._cond:
+            self._stopped = True
+        self._urgent.set()
+        if self._thread is not None:
+            self._thread.join(timeout or self.timeout)
+
+# 全局共享的聊天记录写入器
+chat_history_writer = ChatHistoryWriter()
+atexit.register(chat_history_writer.shutdown)
@@ -1,25 +1,30 @@
-from flask import request, jsonify
+from flask import request, jsonify, Response, stream_with_context
+import json
+import zlib
 import traceback
 import threading
 from config import Config
 from database import (
-    get_db, get_or_create_user, get_or_create_memory_collection,
-    create_verification_code, verify_email_code, check_user_verified,
-    get_user_by_email
+    get_db, get_read_db, UnitOfWork, get_or_create_memory_collection, get_memory_collection_by_user,
+    create_verification_code, verify_email_code, get_user_by_email
 )
 from memory_manager import MemoryManager
 from emo_serv import EmotionalStateMachine
 from email_service import email_service
+from identity_cache import identity_cache
+from emotional_state_store import emotional_state_store
+from chat_history_writer import chat_history_writer
+from turn_context import TurnContext, turn_stats
 
 class ChatService:
     """聊天服务类"""
     
-    def __init__(self, emotional_machine, memory_manager, ai_manager, prompt_generator, chroma_client):
+    def __init__(self, emotional_machine, memory_manager, ai_manager, prompt_generator, vector_store):
         self.emotional_machine = emotional_machine
         self.memory_manager = memory_manager
         self.ai_manager = ai_manager
         self.prompt_generator = prompt_generator
-        self.chroma_client = chroma_client
+        self.vector_store = vector_store
     
     def register_routes(self, app):
         """注册路由"""
@@ -66,6 +71,20 @@ class ChatService:
             """
             return self._handle_get_chat_history_request()
         
+        @app.route("/chat/history/search", methods=["GET"])
+        def search_chat_history():
+            """
+            全文搜索特定用户的聊天记录
+            """
+            return self._handle_search_chat_history_request()
+        
+        @app.route("/chat/history/export", methods=["GET"])
+        def export_chat_history():
+            """
+            流式导出特定用户的全部聊天记录
+            """
+            return self._handle_export_chat_history_request()
+        
         @app.route("/chat/history/clear", methods=["POST"])
         def clear_chat_history():
             """
@@ -87,32 +106,56 @@ class ChatService:
             """
             return self._handle_verify_email_request()
     
-    def _handle_user_identity(self, data):
-        """处理用户身份，获取或创建用户及其记忆集合"""
+    def _handle_user_identity(self, data, uow=None):
+        """处理用户身份，获取或创建用户及其记忆集合；传入uow时复用其只读会话"""
         # 获取用户邮箱
         email = data.get("email", "default@example.com")
         
-        # 获取数据库会话
-        db_gen = get_db()
-        db = next(db_gen)
+        # 身份缓存命中时无需访问数据库
+        cached = identity_cache.get(email)
+        if cached:
+            return cached[0], cached[1], None
         
-        try:
-            # 检查用户是否已验证
-            if not check_user_verified(db, email):
-                return None, None, "邮箱未验证，请先验证邮箱"
-            
-            # 获取或创建用户
-            user = get_or_create_user(db, email)
-            print(f"用户: {user.email}, ID: {user.id}")
-            
-            # 获取或创建用户的记忆集合
-            memory_collection = get_or_create_memory_collection(db, user.id, user.email)
-            print(f"记忆集合: {memory_collection.collection_name}")
-            
-            return user.id, memory_collection.collection_name, None
-        finally:
-            # 关闭数据库会话
-            next(db_gen, None)
+        if uow is None:
+            with UnitOfWork() as uow:
+                return self._handle_user_identity(data, uow)
+        
+        # 常见情况下用户和记忆集合都已存在，只需走只读连接池
+        db = uow.read_db
+        
+        # 检查用户是否已验证
+        user = get_user_by_email(db, email)
+        if not (user and user.is_verified):
+            uow.release_reads()
+            return None, None, "邮箱未验证，请先验证邮箱"
+        print(f"用户: {user.email}, ID: {user.id}")
+        user_id = user.id
+        memory_collection = get_memory_collection_by_user(db, user_id)
+        collection_name = memory_collection.collection_name if memory_collection else None
+        # 只读查询到此结束，尽早归还连接
+        uow.release_reads()
+        if collection_name is None:
+            # 首次使用时创建用户的记忆集合，需立即提交以便后续使用
+            db_gen = get_db()
+            write_db = next(db_gen)
+            try:
+                collection_name = get_or_create_memory_collection(write_db, user_id, email).collection_name
+            finally:
+                next(db_gen, None)
+        print(f"记忆集合: {collection_name}")
+        identity_cache.set(email, user_id, collection_name)
+        
+        return user_id, collection_name, None
+    
+    def _update_user_profile(self, memory_manager, summary):
+        """将新的对话总结累积到用户档案，攒够一批后增量合并（在后台线程中调用）"""
+        summary_text = summary.get("summary") if isinstance(summary, dict) else summary
+        if not summary_text:
+            return
+        pending = memory_manager.add_profile_summary(summary_text)
+        if pending:
+            current_profile = memory_manager.get_user_profile()
+            memory_manager.save_user_profile(self.ai_manager.merge_user_profile(current_profile, pending))
     
     def _handle_chat_request(self):
         """处理聊天请求的内部方法"""
@@ -123,98 +166,94 @@ class ChatService:
             if not user_msg:
                 return jsonify({"error": "缺少message参数"}), 400
             
-            # 处理用户身份，获取或创建用户及其记忆集合
-            user_id, collection_name, error = self._handle_user_identity(data)
-            if error:
-                return jsonify({"error": error, "need_verification": True}), 401
+            # 本轮对话的工作单元：读操作共用只读会话，写操作在结束时一次提交
+            with UnitOfWork() as uow:
+                # 处理用户身份，获取或创建用户及其记忆集合
+                user_id, collection_name, error = self._handle_user_identity(data, uow)
+                if error:
+                    return jsonify({"error": error, "need_verification": True}), 401
             
-            # 创建临时情感状态机实例，避免共享状态
-            emotional_machine = EmotionalStateMachine(user_id)
-            db_gen = get_db()
-            db = next(db_gen)
-            try:
-                emotional_machine.load_from_db(db)
-            finally:
-                next(db_gen, None)
+                # 创建临时情感状态机实例，避免共享状态
+                emotional_machine = EmotionalStateMachine(user_id)
+                # 活跃用户的情感状态直接从内存读取
+                emotional_state_store.load_into(emotional_machine)
+                # 本轮对话的上下文：用户消息只编码一次，情感状态分类、记忆检索和异步总结共用
+                turn = TurnContext(user_id, user_msg)
+                query_embedding = self.memory_manager.encode(user_msg, turn)
             
-            # 更新情感状态（统一通过工具调用）
-            tool_res = self.ai_manager.execute_tool_call({
-                "name": "emotion_state_machine",
-                "arguments": {"message": user_msg, "state": emotional_machine.current_state}
-            })
-            new_state = tool_res.get("new_state", emotional_machine.current_state)
-            emotional_machine.current_state = new_state
-            if isinstance(tool_res, dict) and tool_res.get("variables"):
-                emotional_machine.variables = tool_res["variables"]
-            
-            # 保存更新后的情感状态
-            db_gen = get_db()
-            db = next(db_gen)
-            try:
-                emotional_machine.save_to_db(db)
-            finally:
-                next(db_gen, None)
+                # 更新情感状态（统一通过工具调用，只计算状态转移，不渲染模板回复）
+                tool_res = self.ai_manager.execute_tool_call({
+                    "name": "emotion_state",
+                    "arguments": {"message": user_msg, "state": emotional_machine.current_state,
+                                  "variables": emotional_machine.variables, "embedding": query_embedding}
+                })
+                new_state = tool_res.get("new_state", emotional_machine.current_state)
+                emotional_machine.current_state = new_state
+                turn.state = new_state
+                if isinstance(tool_res, dict) and tool_res.get("variables"):
+                    emotional_machine.variables = tool_res["variables"]
             
-            # 保存当前记忆管理器的集合，以便后续恢复
-            original_collection = self.memory_manager.collection_name
-            try:
-                # 设置当前用户的记忆集合
-                self.memory_manager.set_collection_by_name(collection_name)
+                # 保存当前记忆管理器的集合，以便后续恢复
+                original_collection = self.memory_manager.collection_name
+                original_user_id = self.memory_manager.user_id
+                try:
+                    # 设置当前用户的记忆集合
+                    self.memory_manager.set_collection_by_name(collection_name, user_id)
                 
-                prompt = self.prompt_generator.generate_chat_prompt(user_msg, new_state)
-                include_thinking = bool(data.get("include_thinking", False))
+                    prompt = self.prompt_generator.generate_chat_prompt(user_msg, new_state, turn)
+                    include_thinking = bool(data.get("include_thinking", False))
                 
-                # 一次调用获取响应和思考过程，避免两次API请求
-                ollama_result = self.ai_manager.get_ollama_response(prompt, think=include_thinking)
-                final_text = ollama_result["response"]
-                thinking_text = ollama_result["thinking"] if include_thinking else None
+                    # 一次调用获取响应和思考过程，避免两次API请求
+                    ollama_result = self.ai_manager.get_ollama_response(prompt, think=include_thinking)
+                    final_text = ollama_result["response"]
+                    thinking_text = ollama_result["thinking"] if include_thinking else None
                 
-                print(f"Ollama 回复: {final_text}")
-                # 确保final_text始终是字符串，避免将GenerateResponse对象传递给add_memory
-                if not isinstance(final_text, str):
-                    final_text = str(final_text)
+                    print(f"Ollama 回复: {final_text}")
+                    # 确保final_text始终是字符串，避免将GenerateResponse对象传递给add_memory
+                    if not isinstance(final_text, str):
+                        final_text = str(final_text)
                 
-                # 异步执行聊天记忆总结和保存
-                def async_memory_summary():
-                    try:
-                        summary = self.ai_manager.summarize_conversation(user_msg, final_text, new_state, async_mode=False)
-                        # 创建临时记忆管理器实例，避免共享状态
-                        temp_memory_manager = MemoryManager(self.chroma_client, self.ai_manager.embedding_model)
-                        temp_memory_manager.set_collection_by_name(collection_name)
-                        temp_memory_manager.add_memory(user_msg, summary, new_state)
-                    except Exception as e:
-                        print(f"异步记忆总结失败: {e}")
-                        print(traceback.format_exc())
+                    # 异步执行聊天记忆总结和保存
+                    def async_memory_summary():
+                        try:
+                            summary = self.ai_manager.summarize_conversation(user_msg, final_text, new_state, async_mode=False)
+                            # 创建临时记忆管理器实例，避免共享状态
+                            temp_memory_manager = MemoryManager(self.vector_store, self.ai_manager.embedding_model)
+                            temp_memory_manager.set_collection_by_name(collection_name, user_id)
+                            temp_memory_manager.add_memory(user_msg, summary, new_state, context=turn)
+                            self._update_user_profile(temp_memory_manager, summary)
+                        except Exception as e:
+                            print(f"异步记忆总结失败: {e}")
+                            print(traceback.format_exc())
+                        finally:
+                            turn.finish()
                 
-                # 使用线程异步执行，不阻塞响应返回
-                threading.Thread(target=async_memory_summary, daemon=True).start()
-            finally:
-                # 恢复原始记忆集合
-                if original_collection:
-                    self.memory_manager.set_collection_by_name(original_collection)
-                else:
-                    # 如果原来没有设置集合，清除当前集合
-                    self.memory_manager.collection_name = None
-                    self.memory_manager.collection = None
-            
-            # 保存聊天记录
-            db_gen = get_db()
-            db = next(db_gen)
-            try:
-                from database import create_chat_history
-                create_chat_history(db, user_id, user_msg, final_text, new_state)
-            finally:
-                next(db_gen, None)
+                    # 使用线程异步执行，不阻塞响应返回
+                    threading.Thread(target=async_memory_summary, daemon=True).start()
+                finally:
+                    # 恢复原始记忆集合
+                    if original_collection:
+                        self.memory_manager.set_collection_by_name(original_collection, original_user_id)
+                    else:
+                        # 如果原来没有设置集合，清除当前集合
+                        self.memory_manager.collection_name = None
+                        self.memory_manager.user_id = None
+                        self.memory_manager.collection = None
             
-            resp_payload = {
-                "response": final_text,
-                "current_state": new_state,
-                "state_description": emotional_machine.get_state_description(new_state),
-                "emotional_variables": emotional_machine.variables
-            }
-            if thinking_text:
-                resp_payload["thinking"] = thinking_text
-            return jsonify(resp_payload)
+                # 回复成功后再保存情感状态和聊天记录：状态存入内存由后台批量写回，聊天记录交给后台写入器组提交；
+                # 二者关闭时登记到本轮的工作单元一起提交，模型调用失败时状态不会先于聊天记录落库
+                emotional_state_store.save_from(emotional_machine, uow=uow)
+                chat_history_writer.submit(user_id, user_msg, final_text, new_state, uow=uow)
+            
+                resp_payload = {
+                    "response": final_text,
+                    "current_state": new_state,
+                    "state_description": emotional_machine.get_state_description(new_state),
+                    "emotional_variables": emotional_machine.variables
+                }
+                if thinking_text:
+                    resp_payload["thinking"] = thinking_text
+                return jsonify(resp_payload)
             
         except Exception as e:
             print(f"聊天服务错误: {e}")
@@ -248,132 +287,128 @@ class ChatService:
                         "id": request_id
                     }), 400
                 
-                # 处理用户身份，获取或创建用户及其记忆集合
-                user_id, collection_name, error = self._handle_user_identity(params)
-                if error:
-                    return jsonify({
-                        "jsonrpc": "2.0",
-                        "error": {"code": -32001, "message": error, "need_verification": True},
-                        "id": request_id
-                    }), 401
-                
-                # 创建临时情感状态机实例，避免共享状态
-                emotional_machine = EmotionalStateMachine(user_id)
-                db_gen = get_db()
-                db = next(db_gen)
-                try:
-                    emotional_machine.load_from_db(db)
-                finally:
-                    next(db_gen, None)
+                # 本轮对话的工作单元：读操作共用只读会话，写操作在结束时一次提交
+                with UnitOfWork() as uow:
+                    # 处理用户身份，获取或创建用户及其记忆集合
+                    user_id, collection_name, error = self._handle_user_identity(params, uow)
+                    if error:
+                        return jsonify({
+                            "jsonrpc": "2.0",
+                            "error": {"code": -32001, "message": error, "need_verification": True},
+                            "id": request_id
+                        }), 401
                 
-                # 更新情感状态（统一通过工具调用）
-                tool_res = self.ai_manager.execute_tool_call({
-                    "name": "emotion_state_machine",
-                    "arguments": {"message": user_msg, "state": emotional_machine.current_state}
-                })
-                new_state = tool_res.get("new_state", emotional_machine.current_state)
-                emotional_machine.current_state = new_state
-                if isinstance(tool_res, dict) and tool_res.get("variables"):
-                    emotional_machine.variables = tool_res["variables"]
+                    # 创建临时情感状态机实例，避免共享状态
+                    emotional_machine = EmotionalStateMachine(user_id)
+                    # 活跃用户的情感状态直接从内存读取
+                    emotional_state_store.load_into(emotional_machine)
+                    # 本轮对话的上下文：用户消息只编码一次，情感状态分类、记忆检索和异步总结共用
+                    turn = TurnContext(user_id, user_msg)
+                    query_embedding = self.memory_manager.encode(user_msg, turn)
                 
-                # 保存更新后的情感状态
-                db_gen = get_db()
-                db = next(db_gen)
-                try:
-                    emotional_machine.save_to_db(db)
-                finally:
-                    next(db_gen, None)
+                    # 更新情感状态（统一通过工具调用，只计算状态转移，不渲染模板回复）
+                    tool_res = self.ai_manager.execute_tool_call({
+                        "name": "emotion_state",
+                        "arguments": {"message": user_msg, "state": emotional_machine.current_state,
+                                      "variables": emotional_machine.variables, "embedding": query_embedding}
+                    })
+                    new_state = tool_res.get("new_state", emotional_machine.current_state)
+                    emotional_machine.current_state = new_state
+                    turn.state = new_state
+                    if isinstance(tool_res, dict) and tool_res.get("variables"):
+                        emotional_machine.variables = tool_res["variables"]
                 
-                # 保存当前记忆管理器的集合，以便后续恢复
-                original_collection = self.memory_manager.collection_name
-                try:
-                    # 设置当前用户的记忆集合
-                    self.memory_manager.set_collection_by_name(collection_name)
+                    # 保存当前记忆管理器的集合，以便后续恢复
+                    original_collection = self.memory_manager.collection_name
+                    original_user_id = self.memory_manager.user_id
+                    try:
+                        # 设置当前用户的记忆集合
+                        self.memory_manager.set_collection_by_name(collection_name, user_id)
                     
-                    # 生成带有角色设定和状态的提示
-                    prompt = self.prompt_generator.generate_chat_prompt(user_msg, new_state)
+                        # 生成带有角色设定和状态的提示
+                        prompt = self.prompt_generator.generate_chat_prompt(user_msg, new_state, turn)
                     
-                    # 调用 Ollama 获取响应，支持工具调用
-                    ollama_response = self.ai_manager.get_ollama_response_with_tools(prompt, think=include_thinking)
+                        # 调用 Ollama 获取响应，支持工具调用
+                        ollama_response = self.ai_manager.get_ollama_response_with_tools(prompt, think=include_thinking)
                     
-                    final_response = ollama_response.get("response", "")
-                    thinking_text = ollama_response.get("thinking")
+                        final_response = ollama_response.get("response", "")
+                        thinking_text = ollama_response.get("thinking")
                     
-                    # 检查是否有工具调用
-                    if "tool_calls" in ollama_response and ollama_response["tool_calls"]:
-                        tool_calls = ollama_response["tool_calls"]
-                        tool_results = []
+                        # 检查是否有工具调用
+                        if "tool_calls" in ollama_response and ollama_response["tool_calls"]:
+                            tool_calls = ollama_response["tool_calls"]
+                            tool_results = []
                         
-                        # 执行所有工具调用
-                        for tool_call in tool_calls:
-                            tool_name = tool_call["function"]["name"]
-                            arguments = tool_call["function"]["arguments"]
+                            # 执行所有工具调用
+                            for tool_call in tool_calls:
+                                tool_name = tool_call["function"]["name"]
+                                arguments = tool_call["function"]["arguments"]
                             
-                            # 执行工具调用
-                            result = self.ai_manager.execute_tool_call({
-                                "name": tool_name,
-                                "arguments": arguments
-                            })
+                                # 执行工具调用
+                                result = self.ai_manager.execute_tool_call({
+                                    "name": tool_name,
+                                    "arguments": arguments
+                                })
                             
-                            tool_results.append({
-                                "tool_call_id": tool_call["id"],
-                                "result": result
-                            })
+                                tool_results.append({
+                                    "tool_call_id": tool_call["id"],
+                                    "result": result
+                                })
                         
-                        # 如果有工具调用结果，再次调用模型获取最终回复
-                        if tool_results:
-                            # 构建带有工具结果的提示
-                            tool_result_prompt = f"{prompt}\n\n"
-                            for tool_result in tool_results:
-                                tool_result_prompt += f"工具调用结果: {json.dumps(tool_result['result'])}\n"
+                            # 如果有工具调用结果，再次调用模型获取最终回复
+                            if tool_results:
+                                # 构建带有工具结果的提示
+                                tool_result_prompt = f"{prompt}\n\n"
+                                for tool_result in tool_results:
+                                    tool_result_prompt += f"工具调用结果: {json.dumps(tool_result['result'])}\n"
                             
-                            # 调用模型获取最终回复
-                            final_response_data = self.ai_manager.get_ollama_response(tool_result_prompt)
-                            final_response = final_response_data["response"]
-                finally:
-                    # 恢复原始记忆集合
-                    if original_collection:
-                        self.memory_manager.set_collection_by_name(original_collection)
-                    else:
-                        # 如果原来没有设置集合，清除当前集合
-                        self.memory_manager.collection_name = None
-                        self.memory_manager.collection = None
+                                # 调用模型获取最终回复
+                                final_response_data = self.ai_manager.get_ollama_response(tool_result_prompt)
+                                final_response = final_response_data["response"]
+                    finally:
+                        # 恢复原始记忆集合
+                        if original_collection:
+                            self.memory_manager.set_collection_by_name(original_collection, original_user_id)
+                        else:
+                            # 如果原来没有设置集合，清除当前集合
+                            self.memory_manager.collection_name = None
+                            self.memory_manager.user_id = None
+                            self.memory_manager.collection = None
                 
-                # 异步执行聊天记忆总结和保存
-                def async_memory_summary():
-                    try:
-                        summary = self.ai_manager.summarize_conversation(user_msg, final_response, new_state, async_mode=False)
-                        # 创建临时记忆管理器实例，避免共享状态
-                        temp_memory_manager = MemoryManager(self.chroma_client, self.ai_manager.embedding_model)
-                        temp_memory_manager.set_collection_by_name(collection_name)
-                        temp_memory_manager.add_memory(user_msg, summary, new_state)
-                    except Exception as e:
-                        print(f"异步记忆总结失败: {e}")
-                        print(traceback.format_exc())
+                    # 异步执行聊天记忆总结和保存
+                    def async_memory_summary():
+                        try:
+                            summary = self.ai_manager.summarize_conversation(user_msg, final_response, new_state, async_mode=False)
+                            # 创建临时记忆管理器实例，避免共享状态
+                            temp_memory_manager = MemoryManager(self.vector_store, self.ai_manager.embedding_model)
+                            temp_memory_manager.set_collection_by_name(collection_name, user_id)
+                            temp_memory_manager.add_memory(user_msg, summary, new_state, context=turn)
+                            self._update_user_profile(temp_memory_manager, summary)
+                        except Exception as e:
+                            print(f"异步记忆总结失败: {e}")
+                            print(traceback.format_exc())
+                        finally:
+                            turn.finish()
                 
-                # 使用线程异步执行，不阻塞响应返回
-                threading.Thread(target=async_memory_summary, daemon=True).start()
+                    # 使用线程异步执行，不阻塞响应返回
+                    threading.Thread(target=async_memory_summary, daemon=True).start()
                 
-                # 存储聊天记录到数据库
-                db_gen = get_db()
-                db = next(db_gen)
-                try:
-                    from database import create_chat_history
-                    create_chat_history(db, user_id, user_msg, final_response, new_state)
-                finally:
-                    next(db_gen, None)
+                    # 回复成功后再保存情感状态和聊天记录：状态存入内存由后台批量写回，聊天记录交给后台写入器组提交；
+                    # 二者关闭时登记到本轮的工作单元一起提交，模型调用失败时状态不会先于聊天记录落库
+                    emotional_state_store.save_from(emotional_machine, uow=uow)
+                    chat_history_writer.submit(user_id, user_msg, final_response, new_state, uow=uow)
                 
-                return jsonify({
-                    "jsonrpc": "2.0",
-                    "result": {
-                        "response": final_response,
-                        "thinking": thinking_text,
-                        "state": new_state,
-                        "state_description": emotional_machine.get_state_description(new_state),
-                        "variables": emotional_machine.variables
-                    },
-                    "id": request_id
-                })
+                    return jsonify({
+                        "jsonrpc": "2.0",
+                        "result": {
+                            "response": final_response,
+                            "thinking": thinking_text,
+                            "state": new_state,
+                            "state_description": emotional_machine.get_state_description(new_state),
+                            "variables": emotional_machine.variables
+                        },
+                        "id": request_id
+                    })
             
             else:
                 return jsonify({
@@ -394,51 +429,46 @@ class ChatService:
     def _handle_initial_message_request(self):
         try:
             data = request.get_json()
-            user_id, collection_name, error = self._handle_user_identity(data)
-            if error:
-                return jsonify({"error": error, "need_verification": True}), 401
+            with UnitOfWork() as uow:
+                user_id, collection_name, error = self._handle_user_identity(data, uow)
+                if error:
+                    return jsonify({"error": error, "need_verification": True}), 401
             
-            # 创建临时情感状态机实例，避免共享状态
-            emotional_machine = EmotionalStateMachine(user_id)
-            db_gen = get_db()
-            db = next(db_gen)
-            try:
-                emotional_machine.load_from_db(db)
-            finally:
-                next(db_gen, None)
+                # 创建临时情感状态机实例，避免共享状态
+                emotional_machine = EmotionalStateMachine(user_id)
+                emotional_state_store.load_into(emotional_machine)
             
-            # 保存当前记忆管理器的集合，以便后续恢复
-            original_collection = self.memory_manager.collection_name
-            try:
-                # 设置当前用户的记忆集合
-                self.memory_manager.set_collection_by_name(collection_name)
+                # 保存当前记忆管理器的集合，以便后续恢复
+                original_collection = self.memory_manager.collection_name
+                original_user_id = self.memory_manager.user_id
+                try:
+                    # 设置当前用户的记忆集合
+                    self.memory_manager.set_collection_by_name(collection_name, user_id)
                 
-                if self.memory_manager.has_any_memory():
-                    return jsonify({"status": "skipped", "message": "已有历史记忆，不再生成开场白"})
-                state = emotional_machine.current_state
-                prompt = self.prompt_generator.generate_initial_prompt(state)
-                result = self.ai_manager.get_ollama_response(prompt)
-                final_text = result["response"]
-                self.memory_manager.add_memory("[INIT]", final_text, state, memory_type="conversation", category="system")
-            finally:
-                # 恢复原始记忆集合
-                if original_collection:
-                    self.memory_manager.set_collection_by_name(original_collection)
-                else:
-                    # 如果原来没有设置集合，清除当前集合
-                    self.memory_manager.collection_name = None
-                    self.memory_manager.collection = None
+                    if self.memory_manager.has_any_memory():
+                        return jsonify({"status": "skipped", "message": "已有历史记忆，不再生成开场白"})
+                    state = emotional_machine.current_state
+                    prompt = self.prompt_generator.generate_initial_prompt(state)
+                    result = self.ai_manager.get_ollama_response(prompt)
+                    final_text = result["response"]
+                    turn = TurnContext(user_id, "[INIT]")
+                    turn.state = state
+                    self.memory_manager.add_memory("[INIT]", final_text, state, memory_type="conversation", category="system", context=turn)
+                    turn.finish()
+                finally:
+                    # 恢复原始记忆集合
+                    if original_collection:
+                        self.memory_manager.set_collection_by_name(original_collection, original_user_id)
+                    else:
+                        # 如果原来没有设置集合，清除当前集合
+                        self.memory_manager.collection_name = None
+                        self.memory_manager.user_id = None
+                        self.memory_manager.collection = None
             
-            # 保存聊天记录
-            db_gen = get_db()
-            db = next(db_gen)
-            try:
-                from database import create_chat_history
-                create_chat_history(db, user_id, "[INIT]", final_text, state)
-            finally:
-                next(db_gen, None)
+                # 聊天记录交给后台写入器组提交
+                chat_history_writer.submit(user_id, "[INIT]", final_text, state, uow=uow)
             
-            return jsonify({"status": "success", "response": final_text, "current_state": state, "state_description": emotional_machine.get_state_description(state), "emotional_variables": emotional_machine.variables})
+                return jsonify({"status": "success", "response": final_text, "current_state": state, "state_description": emotional_machine.get_state_description(state), "emotional_variables": emotional_machine.variables})
         except Exception as e:
             print(f"生成开场白服务错误: {e}")
             print(traceback.format_exc())
@@ -446,7 +476,7 @@ class ChatService:
 
     def _health_check(self):
         """健康检查"""
-        return jsonify({"status": "ok", "service": "Ollama Chat Service with Emotion State Machine"})
+        return jsonify({"status": "ok", "service": "Ollama Chat Service with Emotion State Machine", "embedding": turn_stats.snapshot()})
     
     def _handle_clear_memory_request(self):
         """处理清空记忆请求的内部方法"""
@@ -454,58 +484,50 @@ class ChatService:
             data = request.get_json()
             
             email = data.get("email", "default@example.com")
-            user_id, collection_name, error = self._handle_user_identity(data)
-            if error:
-                return jsonify({"error": error, "need_verification": True}), 401
+            with UnitOfWork() as uow:
+                user_id, collection_name, error = self._handle_user_identity(data, uow)
+                if error:
+                    return jsonify({"error": error, "need_verification": True}), 401
             
-            # 保存当前记忆管理器的集合，以便后续恢复
-            original_collection = self.memory_manager.collection_name
-            try:
-                # 设置当前用户的记忆集合
-                self.memory_manager.set_collection_by_name(collection_name)
+                # 保存当前记忆管理器的集合，以便后续恢复
+                original_collection = self.memory_manager.collection_name
+                original_user_id = self.memory_manager.user_id
+                try:
+                    # 设置当前用户的记忆集合
+                    self.memory_manager.set_collection_by_name(collection_name, user_id)
                 
-                self.memory_manager.clear_all_memories()
+                    self.memory_manager.clear_all_memories()
                 
-                # 创建临时情感状态机实例，避免共享状态
-                emotional_machine = EmotionalStateMachine(user_id)
-                db_gen = get_db()
-                db = next(db_gen)
-                try:
-                    emotional_machine.load_from_db(db)
+                    # 创建临时情感状态机实例，避免共享状态
+                    emotional_machine = EmotionalStateMachine(user_id)
+                    emotional_state_store.load_into(emotional_machine)
+                    state = emotional_machine.current_state
+                    prompt = self.prompt_generator.generate_initial_prompt(state)
+                    result = self.ai_manager.get_ollama_response(prompt)
+                    initial_text = result["response"]
+                    self.memory_manager.add_memory("[INIT]", initial_text, state, memory_type="conversation", category="system")
                 finally:
-                    next(db_gen, None)
-                state = emotional_machine.current_state
-                prompt = self.prompt_generator.generate_initial_prompt(state)
-                result = self.ai_manager.get_ollama_response(prompt)
-                initial_text = result["response"]
-                self.memory_manager.add_memory("[INIT]", initial_text, state, memory_type="conversation", category="system")
-            finally:
-                # 恢复原始记忆集合
-                if original_collection:
-                    self.memory_manager.set_collection_by_name(original_collection)
-                else:
-                    # 如果原来没有设置集合，清除当前集合
-                    self.memory_manager.collection_name = None
-                    self.memory_manager.collection = None
+                    # 恢复原始记忆集合
+                    if original_collection:
+                        self.memory_manager.set_collection_by_name(original_collection, original_user_id)
+                    else:
+                        # 如果原来没有设置集合，清除当前集合
+                        self.memory_manager.collection_name = None
+                        self.memory_manager.user_id = None
+                        self.memory_manager.collection = None
             
-            # 保存聊天记录
-            db_gen = get_db()
-            db = next(db_gen)
-            try:
-                from database import create_chat_history
-                create_chat_history(db, user_id, "[INIT]", initial_text, state)
-            finally:
-                next(db_gen, None)
+                # 聊天记录交给后台写入器组提交
+                chat_history_writer.submit(user_id, "[INIT]", initial_text, state, uow=uow)
             
-            return jsonify({
-                "status": "success",
-                "message": f"用户 {email} 的记忆已成功清空",
-                "collection_name": collection_name,
-                "initial_message": initial_text,
-                "current_state": state,
-                "state_description": emotional_machine.get_state_description(state),
-                "emotional_variables": emotional_machine.variables
-            })
+                return jsonify({
+                    "status": "success",
+                    "message": f"用户 {email} 的记忆已成功清空",
+                    "collection_name": collection_name,
+                    "initial_message": initial_text,
+                    "current_state": state,
+                    "state_description": emotional_machine.get_state_description(state),
+                    "emotional_variables": emotional_machine.variables
+                })
             
         except Exception as e:
             print(f"清空记忆服务错误: {e}")
@@ -513,25 +535,38 @@ class ChatService:
             return jsonify({"error": f"服务器内部错误: {str(e)}"}), 500
     
     def _handle_get_chat_history_request(self):
-        """处理获取聊天记录请求的内部方法"""
+        """处理获取聊天记录请求的内部方法，按游标分页：不带游标返回最新一页，before_id向前翻页，after_id获取更新的记录"""
         try:
             # 获取用户邮箱
             email = request.args.get("email", "default@example.com")
-            
-            # 获取数据库会话
-            db_gen = get_db()
+            limit = request.args.get("limit", Config.CHAT_HISTORY_PAGE_SIZE, type=int)
+            before_id = request.args.get("before_id", type=int)
+            after_id = request.args.get("after_id", type=int)
+            if before_id is not None and after_id is not None:
+                return jsonify({"error": "before_id与after_id不能同时使用"}), 400
+            limit = max(1, min(limit, Config.CHAT_HISTORY_MAX_PAGE_SIZE))
+            
+            # 获取只读数据库会话
+            db_gen = get_read_db()
             db = next(db_gen)
             
             try:
                 # 获取或创建用户
-                from database import get_user_by_email, get_chat_histories_by_user
-                user = get_user_by_email(db, email)
+                from database import get_user_by_email, get_chat_history_page
+                cached = identity_cache.get(email)
+                if cached:
+                    user_id = cached[0]
+                else:
+                    user = get_user_by_email(db, email)
+                    if not user:
+                        return jsonify({"status": "success", "chat_history": [], "has_more": False, "next_before_id": None})
+                    user_id = user.id
                 
-                if not user:
-                    return jsonify({"status": "success", "chat_history": []})
+                # 先等待该用户尚在队列中的记录写入，保证能读到刚才的对话
+                chat_history_writer.wait_for_user(user_id)
                 
-                # 获取用户聊天记录
-                chat_histories = get_chat_histories_by_user(db, user.id)
+                # 获取一页聊天记录（按时间正序）
+                chat_histories, has_more = get_chat_history_page(db, user_id, limit=limit, before_id=before_id, after_id=after_id)
                 
                 # 转换为前端可用的格式
                 chat_history_list = []
@@ -547,7 +582,10 @@ class ChatService:
                 return jsonify({
                     "status": "success",
                     "chat_history": chat_history_list,
-                    "user_email": user.email
+                    "user_email": email,
+                    "has_more": has_more,
+                    # 加载更早记录时作为before_id传回
+                    "next_before_id": chat_history_list[0]["id"] if chat_history_list else None
                 })
             finally:
                 next(db_gen, None)
@@ -557,6 +595,137 @@ class ChatService:
             print(traceback.format_exc())
             return jsonify({"error": f"服务器内部错误: {str(e)}"}), 500
     
+    def _handle_search_chat_history_request(self):
+        """处理搜索聊天记录请求：q为关键词（空格分隔的多个词须同时命中），按相关度排序，offset/limit分页"""
+        try:
+            email = request.args.get("email", "default@example.com")
+            keyword = request.args.get("q", "").strip()
+            if not keyword:
+                return jsonify({"error": "缺少q参数"}), 400
+            limit = max(1, min(request.args.get("limit", Config.CHAT_HISTORY_SEARCH_PAGE_SIZE, type=int), Config.CHAT_HISTORY_MAX_PAGE_SIZE))
+            offset = max(0, request.args.get("offset", 0, type=int))
+            
+            db_gen = get_read_db()
+            db = next(db_gen)
+            try:
+                from database import search_chat_histories
+                cached = identity_cache.get(email)
+                if cached:
+                    user_id = cached[0]
+                else:
+                    user = get_user_by_email(db, email)
+                    if not user:
+                        return jsonify({"status": "success", "results": [], "has_more": False})
+                    user_id = user.id
+                
+                chat_history_writer.wait_for_user(user_id)
+                hits, has_more = search_chat_histories(db, user_id, keyword, limit=limit, offset=offset)
+                for hit in hits:
+                    hit["created_at"] = hit["created_at"].isoformat()
+                
+                return jsonify({
+                    "status": "success",
+                    "results": hits,
+                    "has_more": has_more,
+                    "next_offset": offset + len(hits) if has_more else None
+                })
+            finally:
+                next(db_gen, None)
+            
+        except Exception as e:
+            print(f"搜索聊天记录服务错误: {e}")
+            print(traceback.format_exc())
+            return jsonify({"error": f"服务器内部错误: {str(e)}"}), 500
+    
+    def _handle_export_chat_history_request(self):
+        """流式导出聊天记录：format=json（JSON数组，默认）或 ndjson（每行一条），gzip=1时gzip压缩
+
+        记录从数据库分批读取并逐条写出，内存占用不随聊天记录数量增长。
+        """
+        try:
+            email = request.args.get("email", "default@example.com")
+            export_format = request.args.get("format", "json")
+            if export_format not in ("json", "ndjson"):
+                return jsonify({"error": "format只支持json或ndjson"}), 400
+            use_gzip = request.args.get("gzip", "0").lower() in ("1", "true", "yes")
+            
+            cached = identity_cache.get(email)
+            if cached:
+                user_id = cached[0]
+            else:
+                db_gen = get_read_db()
+                db = next(db_gen)
+                try:
+                    user = get_user_by_email(db, email)
+                    user_id = user.id if user else None
+                finally:
+                    next(db_gen, None)
+            if user_id is not None:
+                # 先等待该用户尚在队列中的记录写入
+                chat_history_writer.wait_for_user(user_id)
+            
+            def generate_chunks():
+                from database import iter_chat_histories_by_user
+                if export_format == "json":
+                    yield "["
+                if user_id is None:
+                    rows = iter(())
+                    db_gen = None
+                else:
+                    # 会话在整个响应写出期间保持打开，结束（或客户端断开）时关闭
+                    db_gen = get_read_db()
+                    rows = iter_chat_histories_by_user(next(db_gen), user_id, batch_size=Config.CHAT_HISTORY_EXPORT_BATCH_SIZE)
+                try:
+                    for index, chat in enumerate(rows):
+                        line = json.dumps({
+                            "id": chat.id,
+                            "user_message": chat.user_message,
+                            "assistant_message": chat.assistant_message,
+                            "state": chat.state,
+                            "created_at": chat.created_at.isoformat()
+                        }, ensure_ascii=False)
+                        if export_format == "json":
+                            yield ("," if index else "") + line
+                        else:
+                            yield line + "\n"
+                finally:
+                    if db_gen is not None:
+                        next(db_gen, None)
+                if export_format == "json":
+                    yield "]"
+            
+            def encode(chunks):
+                """将小块文本攒到一定大小再写出，可选gzip压缩"""
+                compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if use_gzip else None
+                buffer, size = [], 0
+                for chunk in chunks:
+                    data = chunk.encode("utf-8")
+                    buffer.append(data)
+                    size += len(data)
+                    if size >= 64 * 1024:
+                        data = b"".join(buffer)
+                        buffer, size = [], 0
+                        data = compressor.compress(data) if compressor else data
+                        if data:
+                            yield data
+                data = b"".join(buffer)
+                if compressor:
+                    data = compressor.compress(data) + compressor.flush()
+                if data:
+                    yield data
+            
+            mimetype = "application/json" if export_format == "json" else "application/x-ndjson"
+            filename = f"chat_history.{export_format}"
+            if use_gzip:
+                mimetype, filename = "application/gzip", filename + ".gz"
+            headers = {"Content-Disposition": f"attachment; filename={filename}"}
+            return Response(stream_with_context(encode(generate_chunks())), mimetype=mimetype, headers=headers)
+            
+        except Exception as e:
+            print(f"导出聊天记录服务错误: {e}")
+            print(traceback.format_exc())
+            return jsonify({"error": f"服务器内部错误: {str(e)}"}), 500
+    
     def _handle_clear_chat_history_request(self):
         """处理清空聊天记录请求的内部方法"""
         try:
@@ -573,8 +742,9 @@ class ChatService:
             db = next(db_gen)
             
             try:
-                # 清空该用户的所有聊天记录
+                # 清空该用户的所有聊天记录（包括仍在写入队列中的）
                 from database import clear_chat_histories_by_user
+                chat_history_writer.wait_for_user(user_id)
                 deleted_count = clear_chat_histories_by_user(db, user_id)
                 
                 return jsonify({
@@ -608,6 +778,7 @@ class ChatService:
                 user, error = create_verification_code(db, email)
                 if error:
                     return jsonify({"error": error}), 400
+                identity_cache.invalidate(email)
                 
                 # 发送邮件
                 success, message = email_service.send_verification_code(email, user.verification_code)
@@ -647,6 +818,7 @@ class ChatService:
                 success, message = verify_email_code(db, email, code)
                 
                 if success:
+                    identity_cache.invalidate(email)
                     return jsonify({
                         "success": True,
                         "message": message,
@@ -14,10 +14,23 @@ class Config:
     # Ollama模型配置
     OLLAMA_MODEL = "deepseek-r1:8b"
     OLLAMA_URL = "http://127.0.0.1:11434/api/generate"
+    OLLAMA_NUM_CTX = 4096  # 上下文窗口（token），所有调用统一使用
     
     # 记忆配置
     MEMORY_EXPIRY_TIME = 30 * 24 * 60 * 60  # 30天
     RELEVANT_MEMORIES_COUNT = 3  # 检索相关记忆数量
+    RELEVANT_MEMORIES_COUNT_WITH_PROFILE = 2  # 已有用户档案时的检索数量，稳定信息由档案提供
+    
+    # 用户档案配置（每个用户一条滚动更新的user_profile记忆，直接写入提示词，无需向量检索）
+    USER_PROFILE_UPDATE_BATCH = 3  # 累积多少条新的对话总结后增量合并一次档案
+    USER_PROFILE_MAX_CHARS = 200  # 档案最大长度（字）
+    
+    # 语义检索缓存配置（近似重复的查询复用上一次检索结果）
+    SEMANTIC_CACHE_ENABLED = True
+    SEMANTIC_CACHE_THRESHOLD = 0.93  # 查询向量余弦相似度不低于该值视为命中
+    SEMANTIC_CACHE_TTL = 300  # 缓存条目有效期（秒）
+    SEMANTIC_CACHE_SIZE = 8  # 每个用户最多缓存的查询数
+    SEMANTIC_CACHE_MAX_USERS = 1000  # 最多缓存的用户数，超出后淘汰最久未使用的用户
     
     # 分层记忆配置
     MEMORY_RELEVANCE_THRESHOLD = 0.5  # 记忆相关性阈值
@@ -34,29 +47,41 @@ class Config:
     MEMORY_TYPE_CONFIG = {
         "system_setting": {
             "expiry_time": float('inf'),
-            "weight": 1.5
+            "weight": 1.5,
+            "quota": 50
         },
         "user_profile": {
             "expiry_time": 365 * 24 * 60 * 60,
-            "weight": 1.2
+            "weight": 1.2,
+            "quota": 5
         },
         "fact": {
             "expiry_time": 180 * 24 * 60 * 60,
-            "weight": 1.0
+            "weight": 1.0,
+            "quota": 500
         },
         "preference": {
             "expiry_time": 90 * 24 * 60 * 60,
-            "weight": 1.0
+            "weight": 1.0,
+            "quota": 300
         },
         "conversation": {
             "expiry_time": 30 * 24 * 60 * 60,
-            "weight": 0.9
+            "weight": 0.9,
+            "quota": 1000
         },
         "context": {
             "expiry_time": 7 * 24 * 60 * 60,
-            "weight": 0.7
+            "weight": 0.7,
+            "quota": 200
         }
-    }  # 记忆类型配置
+    }  # 记忆类型配置，quota为每个用户该类型记忆的数量上限
+    
+    # 记忆配额配置
+    MEMORY_QUOTA_ENABLED = True
+    MEMORY_QUOTA_CHECK_INTERVAL = 20  # 每个用户每写入多少条记忆检查一次配额，摊销计数开销
+    MEMORY_QUOTA_EVICTION_RATIO = 0.1  # 超出配额时一次性淘汰到 quota * (1 - ratio)，避免每次写入都触发淘汰
+    MEMORY_QUOTA_COUNTERS_MAX = 10000  # 最多保留的 (集合, 记忆类型) 写入计数，超出后淘汰最久未写入的（被淘汰的计数从0重新开始）
     
     # 情感配置
     SENTIMENT_ADJUSTMENT = {
@@ -79,6 +104,13 @@ class Config:
     LOCAL_MODEL_PATH = os.path.join(BASE_DIR, 'models', 'bge-small-zh-v1.5', 'ai-modelscope', 'bge-small-zh-v1___5')
     FALLBACK_MODEL = None
     
+    # 提示词token预算（聊天提示词在 OLLAMA_NUM_CTX 内按段分配，超出时先截断/丢弃排名最低的记忆）
+    PROMPT_TOKENIZER_PATH = os.path.join(BASE_DIR, 'models', 'tokenizer.json')  # 对话模型的tokenizer.json，不存在时按字符估算
+    PROMPT_RESPONSE_RESERVE_TOKENS = 768  # 为模型输出（含思考过程）预留的token数
+    PROMPT_PROFILE_MAX_TOKENS = 300  # 用户档案最多占用的token数
+    PROMPT_MEMORY_MAX_TOKENS = 800  # 相关记忆最多占用的token数
+    PROMPT_MEMORY_MIN_TOKENS = 32  # 截断后的记忆少于该token数时直接丢弃
+    
     # 情感状态机配置
     EMOTION_STATE_MODULE = "emo_serv"
     CHARACTER_CARD_MODULE = "character_card"
@@ -87,12 +119,72 @@ class Config:
     DB_PATH = os.path.join(BASE_DIR, 'data.db')  # SQLite数据库路径
     DATABASE_URL = f'sqlite:///{DB_PATH}'
     
+    # SQLite连接配置（每个新连接都会执行以下PRAGMA）
+    SQLITE_PRAGMAS = {
+        "journal_mode": "WAL",  # 读写互不阻塞
+        "synchronous": "NORMAL",  # WAL模式下仅在checkpoint时fsync
+        "busy_timeout": 5000,  # 锁等待时间（毫秒），避免立即报 database is locked
+        "mmap_size": 256 * 1024 * 1024,  # 内存映射读取大小（字节）
+        "cache_size": -64 * 1024,  # 页缓存大小，负数表示KB
+        "temp_store": "MEMORY"
+    }
+    DB_WRITE_POOL_SIZE = 2  # 写连接池大小，SQLite写入本身串行，在连接池排队比在busy_timeout中轮询等待更快
+    DB_WRITE_MAX_OVERFLOW = 0
+    DB_READ_POOL_SIZE = 8  # 只读连接池大小，用于聊天记录和身份查询
+    DB_READ_MAX_OVERFLOW = 8
+    DB_POOL_TIMEOUT = 30  # 获取连接的等待时间（秒）
+
+    # 聊天记录分页配置（/chat/history 按 before_id/after_id 游标分页）
+    CHAT_HISTORY_PAGE_SIZE = 50  # 默认每页条数
+    CHAT_HISTORY_MAX_PAGE_SIZE = 200  # 每页条数上限
+    CHAT_HISTORY_EXPORT_BATCH_SIZE = 500  # /chat/history/export 每次从数据库读取的条数
+    CHAT_HISTORY_SEARCH_PAGE_SIZE = 20  # /chat/history/search 默认每页命中数
+
+    # 聊天记录归档配置（archive_chat_history.py 将旧记录压缩移入 chat_history_archives）
+    CHAT_HISTORY_ARCHIVE_AFTER_DAYS = 30  # 早于该天数的记录会被归档
+    CHAT_HISTORY_ARCHIVE_SEGMENT_ROWS = 500  # 每个归档段最多包含的记录数
+    CHAT_HISTORY_ARCHIVE_COMPRESSION_LEVEL = 6  # zlib压缩级别
+
+    # 聊天记录组提交配置（后台线程攒批写入chat_histories）
+    CHAT_HISTORY_WRITER_ENABLED = True  # 关闭后每轮对话在请求线程中直接写入并提交
+    CHAT_HISTORY_DURABILITY = "async"  # sync: 请求等待所在批次提交后再返回；async: 立即返回，崩溃时可能丢失最后一批
+    CHAT_HISTORY_BATCH_SIZE = 100  # 每批最多写入条数
+    CHAT_HISTORY_FLUSH_INTERVAL = 0.05  # 攒批最长等待时间（秒）
+    CHAT_HISTORY_WRITE_RETRIES = 5  # 批量写入失败后的重试次数（间隔从攒批等待时间起逐次翻倍），仍失败时改为逐条写入并丢弃写不进去的记录
+    
+    # 向量存储配置
+    VECTOR_STORE_BACKEND = "chroma"  # chroma: Chroma持久化存储；numpy: 轻量NumPy/mmap存储，适合小规模部署和测试
+    NUMPY_VECTOR_STORE_DIRECTORY = os.path.join(BASE_DIR, 'vector_store')  # NumPy后端持久化目录
+    
     # Chroma配置
     CHROMA_PERSIST_DIRECTORY = os.path.join(BASE_DIR, 'chroma_db')  # Chroma持久化目录
-    
+
+    # 记忆租户模式配置
+    # per_user: 每个用户一个独立集合（memory_<email>__d<dim>）
+    # shared: 所有用户分布在少量共享集合中，写入时附带user_id元数据，查询时按user_id过滤
+    MEMORY_TENANCY_MODE = "per_user"
+    SHARED_COLLECTION_COUNT = 8  # shared模式下的共享集合（分片）数量
+    SHARED_COLLECTION_PREFIX = "memory_shared"  # 共享集合名前缀
+
     # Redis配置（可选）
     REDIS_URL = None  # 如果使用Redis，设置为redis://localhost:6379/0
 
+    # 用户身份缓存配置（email -> user_id与记忆集合名，设置REDIS_URL时多节点共享）
+    IDENTITY_CACHE_ENABLED = True
+    IDENTITY_CACHE_TTL = 600  # 缓存有效期（秒）
+    IDENTITY_CACHE_MAX_ENTRIES = 10000  # 进程内缓存最多保存的用户数
+    IDENTITY_CACHE_KEY_PREFIX = "identity:"  # Redis键前缀
+
+    # 情感状态内存存储配置（活跃用户的状态以内存为准，定期批量写回user_emotional_states）
+    # 仅适用于单进程部署；多进程/多节点部署时请关闭，每轮直接读写数据库
+    EMOTION_STATE_STORE_ENABLED = True
+    EMOTION_STATE_FLUSH_INTERVAL = 5  # 后台批量写回间隔（秒）
+    EMOTION_STATE_FLUSH_BATCH = 200  # 待写回的用户数达到该值时立即写回
+    EMOTION_STATE_IDLE_TTL = 1800  # 已写回且空闲超过该时间（秒）的用户从内存中移除
+
+    # 情感状态嵌入分类器（复用检索的消息向量与规则文件中例句的质心比较，阈值见 emotion_rules.json 的 state_classifier）
+    EMOTION_CLASSIFIER_ENABLED = True
+
     # SMTP服务器配置（以Gmail为例）
     SMTP_SERVER = 'smtp.qq.com'
     SMTP_PORT = '587'
@@ -1,16 +1,60 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, create_engine
+from sqlalchemy import Column, Integer, Float, String, DateTime, ForeignKey, Boolean, Index, LargeBinary, bindparam, create_engine, event, func, or_, select, text, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert, dialect as sqlite_dialect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.schema import CreateTable
 from datetime import datetime, timedelta
 from config import Config
 import secrets
 import re
+import json
+import zlib
+from collections import namedtuple
 
-# 创建SQLAlchemy引擎
-engine = create_engine(Config.DATABASE_URL, echo=False)  # 设置echo=True可以看到SQL语句
+def create_configured_engine(database_url=Config.DATABASE_URL, read_only=False):
+    """创建带连接池和SQLite PRAGMA配置的引擎
+
+    SQLite下每个新连接都会执行 Config.SQLITE_PRAGMAS（WAL、synchronous=NORMAL、busy_timeout等），
+    只读引擎额外设置 query_only，防止误写。
+    """
+    is_sqlite = database_url.startswith("sqlite")
+    pool_kwargs = {}
+    if database_url not in ("sqlite://", "sqlite:///:memory:"):
+        # 内存数据库使用SQLAlchemy默认的单连接池
+        pool_kwargs = {
+            "pool_size": Config.DB_READ_POOL_SIZE if read_only else Config.DB_WRITE_POOL_SIZE,
+            "max_overflow": Config.DB_READ_MAX_OVERFLOW if read_only else Config.DB_WRITE_MAX_OVERFLOW,
+            "pool_timeout": Config.DB_POOL_TIMEOUT,
+        }
+    connect_args = {}
+    if is_sqlite:
+        # 连接会在线程池的不同线程间复用；timeout与busy_timeout保持一致
+        connect_args = {
+            "check_same_thread": False,
+            "timeout": Config.SQLITE_PRAGMAS.get("busy_timeout", 5000) / 1000
+        }
+    db_engine = create_engine(database_url, echo=False, connect_args=connect_args, **pool_kwargs)  # 设置echo=True可以看到SQL语句
+
+    if is_sqlite:
+        @event.listens_for(db_engine, "connect")
+        def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            try:
+                for pragma, value in Config.SQLITE_PRAGMAS.items():
+                    cursor.execute(f"PRAGMA {pragma}={value}")
+                if read_only:
+                    cursor.execute("PRAGMA query_only=ON")
+            finally:
+                cursor.close()
+    return db_engine
+
+# 创建SQLAlchemy引擎：写引擎用于所有写操作，只读引擎用于聊天记录和身份查询
+engine = create_configured_engine()
+read_engine = create_configured_engine(read_only=True)
 
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 
 # 创建基类
 Base = declarative_base()
@@ -51,11 +95,13 @@ class UserEmotionalState(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), unique=True, nullable=False)
     current_state = Column(String, default="S1", nullable=False)
-    affection = Column(Integer, default=50, nullable=False)  # 亲密度 0-100
-    heat = Column(Integer, default=0, nullable=False)  # 过热度 0-100
-    sleepy = Column(Integer, default=20, nullable=False)  # 困倦度 0-100
-    envy = Column(Integer, default=0, nullable=False)  # 吃醋程度 0-100
-    stress = Column(Integer, default=10, nullable=False)  # 压力值 0-100
+    # 情感变量保存衰减后的精确值（见 EmotionalStateMachine.apply_decay）。旧数据库中这些列为INTEGER，
+    # SQLite的INTEGER亲和性列会原样保存无法无损转为整数的REAL值，因此无需迁移
+    affection = Column(Float, default=50, nullable=False)  # 亲密度 0-100
+    heat = Column(Float, default=0, nullable=False)  # 过热度 0-100
+    sleepy = Column(Float, default=20, nullable=False)  # 困倦度 0-100
+    envy = Column(Float, default=0, nullable=False)  # 吃醋程度 0-100
+    stress = Column(Float, default=10, nullable=False)  # 压力值 0-100
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -75,11 +121,130 @@ class ChatHistory(Base):
     
     # 关联用户
     user = relationship("User", backref="chat_histories")
+    
+    # 按用户、时间顺序分页读取聊天记录的复合索引；
+    # AUTOINCREMENT保证删除（归档）最大ID的记录后该ID不会被重新分配，避免与归档段中的ID冲突
+    __table_args__ = (
+        Index("ix_chat_histories_user_created_id", "user_id", "created_at", "id"),
+        {"sqlite_autoincrement": True},
+    )
+
+class ChatHistoryArchive(Base):
+    """聊天记录归档段：同一用户按时间连续的一批旧记录，压缩后整体存储，只追加不修改"""
+    __tablename__ = "chat_history_archives"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    row_count = Column(Integer, nullable=False)  # 段内记录数
+    first_created_at = Column(DateTime, nullable=False)  # 段内最早记录的 (created_at, id)
+    first_id = Column(Integer, nullable=False)
+    last_created_at = Column(DateTime, nullable=False)  # 段内最新记录的 (created_at, id)
+    last_id = Column(Integer, nullable=False)
+    min_id = Column(Integer, nullable=False)  # 段内记录ID范围，用于按ID定位游标
+    max_id = Column(Integer, nullable=False)
+    payload = Column(LargeBinary, nullable=False)  # zlib压缩的JSON记录列表
+    created_at = Column(DateTime, default=datetime.utcnow)  # 归档时间
+    
+    __table_args__ = (
+        Index("ix_chat_history_archives_user_last", "user_id", "last_created_at", "last_id"),
+    )
+
+# 从归档段解压出的聊天记录，字段与ChatHistory一致
+ArchivedChatHistory = namedtuple("ArchivedChatHistory", ["id", "user_id", "user_message", "assistant_message", "state", "created_at"])
 
 # 创建数据库表
 def init_db():
     """初始化数据库"""
     Base.metadata.create_all(bind=engine)
+    if ensure_chat_history_autoincrement(engine):
+        print("已将聊天记录表迁移为AUTOINCREMENT主键")
+    # create_all不会为已存在的表补建索引，旧数据库需要单独创建
+    for index in ChatHistory.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+    if ensure_chat_history_fts(engine):
+        print("已创建聊天记录全文索引，已有的聊天记录请运行 python index_chat_history.py rebuild 补建索引")
+
+def ensure_chat_history_autoincrement(bind):
+    """旧数据库的chat_histories没有AUTOINCREMENT时重建该表（保留ID），返回是否进行了迁移（仅SQLite）
+
+    重建会删除原表上的索引和全文索引触发器，由 init_db 随后补建；全文索引按ID关联，ID不变无需重建。
+    """
+    if bind.dialect.name != "sqlite":
+        return False
+    table = ChatHistory.__table__
+    with bind.begin() as connection:
+        connection.exec_driver_sql("BEGIN IMMEDIATE")  # pysqlite不会为DDL开启事务，显式开启保证迁移整体生效或回滚
+        sql = connection.execute(
+            text("SELECT sql FROM sqlite_master WHERE type='table' AND name=:name"), {"name": table.name}
+        ).scalar()
+        if sql is None or "AUTOINCREMENT" in sql.upper():
+            return False
+        new_name = f"{table.name}_new"
+        create_sql = str(CreateTable(table).compile(dialect=bind.dialect))
+        connection.exec_driver_sql(create_sql.replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE {new_name} ", 1))
+        columns = ", ".join(column.name for column in table.columns)
+        connection.exec_driver_sql(f"INSERT INTO {new_name} ({columns}) SELECT {columns} FROM {table.name}")
+        connection.exec_driver_sql(f"DROP TABLE {table.name}")
+        connection.exec_driver_sql(f"ALTER TABLE {new_name} RENAME TO {table.name}")
+        # 序列从热表和归档中最大的ID开始，已被删除或归档的ID不会再被分配
+        connection.execute(text("DELETE FROM sqlite_sequence WHERE name = :name"), {"name": table.name})
+        connection.execute(text(
+            f"INSERT INTO sqlite_sequence (name, seq) SELECT :name, MAX("
+            f"(SELECT COALESCE(MAX(id), 0) FROM {table.name}), "
+            f"(SELECT COALESCE(MAX(max_id), 0) FROM {ChatHistoryArchive.__tablename__}))"
+        ), {"name": table.name})
+    return True
+
+# 聊天记录全文索引：FTS5外部内容表（trigram分词，支持中文任意连续3字以上的子串），由触发器与chat_histories保持同步
+CHAT_HISTORY_FTS_TABLE = "chat_histories_fts"
+CHAT_HISTORY_FTS_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {CHAT_HISTORY_FTS_TABLE} USING fts5(
+        user_message, assistant_message, user_id UNINDEXED,
+        content='chat_histories', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_histories_fts_ai AFTER INSERT ON chat_histories BEGIN
+        INSERT INTO {CHAT_HISTORY_FTS_TABLE}(rowid, user_message, assistant_message, user_id)
+        VALUES (new.id, new.user_message, new.assistant_message, new.user_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_histories_fts_ad AFTER DELETE ON chat_histories BEGIN
+        INSERT INTO {CHAT_HISTORY_FTS_TABLE}({CHAT_HISTORY_FTS_TABLE}, rowid, user_message, assistant_message, user_id)
+        VALUES ('delete', old.id, old.user_message, old.assistant_message, old.user_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_histories_fts_au AFTER UPDATE ON chat_histories BEGIN
+        INSERT INTO {CHAT_HISTORY_FTS_TABLE}({CHAT_HISTORY_FTS_TABLE}, rowid, user_message, assistant_message, user_id)
+        VALUES ('delete', old.id, old.user_message, old.assistant_message, old.user_id);
+        INSERT INTO {CHAT_HISTORY_FTS_TABLE}(rowid, user_message, assistant_message, user_id)
+        VALUES (new.id, new.user_message, new.assistant_message, new.user_id);
+    END""",
+]
+
+def ensure_chat_history_fts(bind):
+    """创建全文索引表和同步触发器（仅SQLite），返回是否为新建且需要补建已有记录的索引"""
+    if bind.dialect.name != "sqlite":
+        return False
+    with bind.begin() as connection:
+        existed = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type='table' AND name=:name"), {"name": CHAT_HISTORY_FTS_TABLE}
+        ).first() is not None
+        for statement in CHAT_HISTORY_FTS_DDL:
+            connection.execute(text(statement))
+        if existed:
+            return False
+        return connection.execute(text("SELECT 1 FROM chat_histories LIMIT 1")).first() is not None
+
+def rebuild_chat_history_fts(db):
+    """根据chat_histories重建全文索引（补建已有记录）"""
+    db.execute(text(f"INSERT INTO {CHAT_HISTORY_FTS_TABLE}({CHAT_HISTORY_FTS_TABLE}) VALUES ('rebuild')"))
+    db.commit()
+
+def optimize_chat_history_fts(db):
+    """合并全文索引的b-tree段，提升查询速度"""
+    db.execute(text(f"INSERT INTO {CHAT_HISTORY_FTS_TABLE}({CHAT_HISTORY_FTS_TABLE}) VALUES ('optimize')"))
+    db.commit()
+
+def check_chat_history_fts(db):
+    """校验全文索引与chat_histories是否一致，不一致时抛出异常"""
+    db.execute(text(f"INSERT INTO {CHAT_HISTORY_FTS_TABLE}({CHAT_HISTORY_FTS_TABLE}, rank) VALUES ('integrity-check', 1)"))
 
 # 获取数据库会话
 def get_db():
@@ -90,21 +255,124 @@ def get_db():
     finally:
         db.close()
 
+def get_read_db():
+    """获取只读数据库会话（独立连接池，不与写操作争抢连接）"""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+class UnitOfWork:
+    """单次请求的工作单元
+
+    请求内的读操作共用一个只读会话；写操作先登记，在请求结束时于同一个写会话、
+    同一个事务中执行并只提交一次，减少每轮对话的连接获取和提交（fsync）次数。
+    登记的写函数签名须为 operation(db, *args, commit=..., **kwargs)。
+    情感状态存储和聊天记录写入器关闭时（如多进程部署），二者的写操作登记到这里，同一轮的状态和聊天记录一起提交。
+    """
+    def __init__(self, session_factory=None, read_session_factory=None):
+        self._session_factory = session_factory or SessionLocal
+        self._read_session_factory = read_session_factory or ReadSessionLocal
+        self._read_db = None
+        self._pending = []
+
+    @property
+    def read_db(self):
+        """按需打开的只读会话"""
+        if self._read_db is None:
+            self._read_db = self._read_session_factory()
+        return self._read_db
+
+    def release_reads(self):
+        """提前归还只读连接（例如在耗时的模型调用之前）"""
+        if self._read_db is not None:
+            self._read_db.close()
+            self._read_db = None
+
+    def add(self, operation, *args, **kwargs):
+        """登记一个写操作，延迟到commit时执行"""
+        self._pending.append((operation, args, kwargs))
+
+    def commit(self):
+        """在一个事务中执行全部登记的写操作"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        db = self._session_factory()
+        try:
+            for operation, args, kwargs in pending:
+                operation(db, *args, commit=False, **kwargs)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def close(self):
+        self._pending = []
+        self.release_reads()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.commit()
+        finally:
+            self.close()
+        return False
+
 # 用户相关操作
 def get_user_by_email(db, email):
     """根据邮箱获取用户"""
     return db.query(User).filter(User.email == email).first()
 
+# 已编译的upsert语句缓存。SQLite方言的insert构造不支持SQLAlchemy的语句编译缓存，
+# 每次执行都要重新编译（比执行本身还慢），因此按语句形状编译一次后以text()形式复用
+_upsert_dialect = sqlite_dialect(paramstyle="named")
+_upsert_statements = {}
+
+def _upsert_returning(db, model, values, index_elements, update_columns=(), where=None, where_name=None, params=None):
+    """执行单条 INSERT ... ON CONFLICT DO UPDATE ... RETURNING，返回插入或更新后的ORM对象
+
+    未给出的列使用模型上的默认值。update_columns为空时做一次不改变数据的更新，使冲突时也能
+    通过RETURNING拿到已有的行。where为返回冲突更新条件的函数（只在首次编译时调用），
+    where_name用于区分缓存，条件中的参数通过params传入；条件不满足时不更新并返回None。
+    """
+    table = model.__table__
+    values = dict(values)
+    for column in table.columns:
+        if column.key not in values and column.default is not None:
+            arg = column.default.arg
+            values[column.key] = arg(None) if callable(arg) else arg
+    update_columns = tuple(update_columns) or tuple(index_elements[:1])
+    key = (model, tuple(values), tuple(index_elements), update_columns, where_name)
+    statement = _upsert_statements.get(key)
+    if statement is None:
+        stmt = sqlite_insert(model).values({name: bindparam(name, type_=table.c[name].type) for name in values})
+        stmt = stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={name: stmt.excluded[name] for name in update_columns},
+            where=where() if where else None
+        ).returning(*table.columns)
+        compiled = stmt.compile(dialect=_upsert_dialect)
+        sql = text(compiled.string).bindparams(
+            *[bindparam(name, type_=bind.type) for name, bind in compiled.binds.items()]
+        ).columns(*table.columns)
+        statement = _upsert_statements[key] = select(model).from_statement(sql)
+    return db.scalars(statement, dict(values, **(params or {})), execution_options={"populate_existing": True}).first()
+
 def create_user(db, email):
-    """创建新用户"""
-    db_user = User(email=email)
-    db.add(db_user)
+    """创建新用户（已存在时返回已有用户）"""
+    user = _upsert_returning(db, User, {"email": email}, ["email"])
     db.commit()
-    db.refresh(db_user)
-    return db_user
+    return user
 
 def get_or_create_user(db, email):
-    """获取或创建用户"""
+    """获取或创建用户：已存在时只有一次查询，不存在时用一条upsert创建，并发创建也不会冲突"""
     user = get_user_by_email(db, email)
     if not user:
         user = create_user(db, email)
@@ -116,11 +384,9 @@ def get_memory_collection_by_user(db, user_id):
     return db.query(MemoryCollection).filter(MemoryCollection.user_id == user_id).first()
 
 def create_memory_collection(db, user_id, collection_name):
-    """创建记忆集合"""
-    db_collection = MemoryCollection(user_id=user_id, collection_name=collection_name)
-    db.add(db_collection)
+    """创建记忆集合（同名集合已存在时返回已有记录）"""
+    db_collection = _upsert_returning(db, MemoryCollection, {"user_id": user_id, "collection_name": collection_name}, ["collection_name"])
     db.commit()
-    db.refresh(db_collection)
     return db_collection
 
 def get_or_create_memory_collection(db, user_id, email):
@@ -139,12 +405,11 @@ def get_user_emotional_state(db, user_id):
     """根据用户ID获取情感状态"""
     return db.query(UserEmotionalState).filter(UserEmotionalState.user_id == user_id).first()
 
-def create_user_emotional_state(db, user_id):
-    """创建用户情感状态"""
-    db_state = UserEmotionalState(user_id=user_id)
-    db.add(db_state)
-    db.commit()
-    db.refresh(db_state)
+def create_user_emotional_state(db, user_id, commit=True):
+    """创建用户情感状态（已存在时返回已有记录），commit=False时由调用方统一提交"""
+    db_state = _upsert_returning(db, UserEmotionalState, {"user_id": user_id}, ["user_id"])
+    if commit:
+        db.commit()
     return db_state
 
 def get_or_create_user_emotional_state(db, user_id):
@@ -154,34 +419,50 @@ def get_or_create_user_emotional_state(db, user_id):
         state = create_user_emotional_state(db, user_id)
     return state
 
-def update_user_emotional_state(db, user_id, current_state=None, affection=None, heat=None, sleepy=None, envy=None, stress=None):
-    """更新用户情感状态"""
-    state = get_user_emotional_state(db, user_id)
-    if not state:
-        state = create_user_emotional_state(db, user_id)
-    
-    # 更新各个状态变量
+def update_user_emotional_state(db, user_id, current_state=None, affection=None, heat=None, sleepy=None, envy=None, stress=None, commit=True):
+    """更新用户情感状态（不存在时创建），一条upsert语句完成，commit=False时不提交，由调用方统一提交"""
+    values = {"user_id": user_id}
     if current_state is not None:
-        state.current_state = current_state
-    if affection is not None:
-        state.affection = max(0, min(100, affection))  # 确保值在0-100之间
-    if heat is not None:
-        state.heat = max(0, min(100, heat))  # 确保值在0-100之间
-    if sleepy is not None:
-        state.sleepy = max(0, min(100, sleepy))  # 确保值在0-100之间
-    if envy is not None:
-        state.envy = max(0, min(100, envy))  # 确保值在0-100之间
-    if stress is not None:
-        state.stress = max(0, min(100, stress))  # 确保值在0-100之间
-    
-    db.commit()
-    db.refresh(state)
+        values["current_state"] = current_state
+    for name, value in (("affection", affection), ("heat", heat), ("sleepy", sleepy), ("envy", envy), ("stress", stress)):
+        if value is not None:
+            values[name] = max(0, min(100, value))  # 确保值在0-100之间
+    update_columns = [name for name in values if name != "user_id"] + ["updated_at"]
+    state = _upsert_returning(db, UserEmotionalState, values, ["user_id"], update_columns)
+    if commit:
+        db.commit()
     return state
 
+def bulk_upsert_user_emotional_states(db, states, commit=True):
+    """批量写入情感状态（INSERT ... ON CONFLICT(user_id) DO UPDATE），一次执行、一次提交
+
+    states为字典列表，键为user_id、current_state及各情感变量，可选updated_at（默认为当前时间，情感变量衰减从该时间起算）。
+    """
+    if not states:
+        return 0
+    variable_names = ("affection", "heat", "sleepy", "envy", "stress")
+    now = datetime.utcnow()
+    rows = []
+    for state in states:
+        row = {"user_id": state["user_id"], "current_state": state["current_state"], "created_at": now,
+               "updated_at": state.get("updated_at") or now}
+        for name in variable_names:
+            row[name] = max(0, min(100, float(state[name])))  # 确保值在0-100之间
+        rows.append(row)
+    stmt = sqlite_insert(UserEmotionalState)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserEmotionalState.user_id],
+        set_={name: stmt.excluded[name] for name in ("current_state", "updated_at") + variable_names}
+    )
+    db.execute(stmt, rows)
+    if commit:
+        db.commit()
+    return len(rows)
+
 # 聊天记录相关操作
 
-def create_chat_history(db, user_id, user_message, assistant_message, state):
-    """创建聊天记录"""
+def create_chat_history(db, user_id, user_message, assistant_message, state, commit=True):
+    """创建聊天记录，commit=False时只加入会话，由调用方统一提交"""
     chat_history = ChatHistory(
         user_id=user_id,
         user_message=user_message,
@@ -189,24 +470,227 @@ def create_chat_history(db, user_id, user_message, assistant_message, state):
         state=state
     )
     db.add(chat_history)
-    db.commit()
-    db.refresh(chat_history)
+    if commit:
+        db.commit()
+        db.refresh(chat_history)
     return chat_history
 
 def get_chat_histories_by_user(db, user_id, limit=None, offset=None):
-    """根据用户ID获取聊天记录"""
-    query = db.query(ChatHistory).filter(ChatHistory.user_id == user_id).order_by(ChatHistory.created_at.asc())
-    if limit:
-        query = query.limit(limit)
-    if offset:
+    """根据用户ID获取聊天记录（按时间正序）"""
+    query = db.query(ChatHistory).filter(ChatHistory.user_id == user_id).order_by(ChatHistory.created_at.asc(), ChatHistory.id.asc())
+    if offset is not None:
         query = query.offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
     return query.all()
 
+def _encode_archive_payload(rows):
+    return zlib.compress(json.dumps(
+        [[row.id, row.user_message, row.assistant_message, row.state, row.created_at.isoformat()] for row in rows],
+        ensure_ascii=False
+    ).encode("utf-8"), Config.CHAT_HISTORY_ARCHIVE_COMPRESSION_LEVEL)
+
+def _decode_archive_segment(segment):
+    """解压归档段，返回按 (created_at, id) 正序的记录列表"""
+    return [
+        ArchivedChatHistory(row_id, segment.user_id, user_message, assistant_message, state, datetime.fromisoformat(created_at))
+        for row_id, user_message, assistant_message, state, created_at in json.loads(zlib.decompress(segment.payload))
+    ]
+
+def _find_archived_position(db, user_id, row_id):
+    """在归档中查找某条记录的 (created_at, id)，不存在返回None"""
+    segments = db.query(ChatHistoryArchive).filter(
+        ChatHistoryArchive.user_id == user_id, ChatHistoryArchive.min_id <= row_id, ChatHistoryArchive.max_id >= row_id
+    ).all()
+    for segment in segments:
+        for row in _decode_archive_segment(segment):
+            if row.id == row_id:
+                return row.created_at, row.id
+    return None
+
+def _get_archived_rows(db, user_id, position, older, limit):
+    """从归档中取位于position之前（older=True，从新到旧）或之后（从旧到新）的最多limit条记录
+
+    position为None且older=True时从最新的归档记录开始。只解压需要的归档段。
+    """
+    query = db.query(ChatHistoryArchive).filter(ChatHistoryArchive.user_id == user_id)
+    if older:
+        if position is not None:
+            query = query.filter(tuple_(ChatHistoryArchive.first_created_at, ChatHistoryArchive.first_id) < tuple_(*position))
+        query = query.order_by(ChatHistoryArchive.last_created_at.desc(), ChatHistoryArchive.last_id.desc())
+    else:
+        query = query.filter(tuple_(ChatHistoryArchive.last_created_at, ChatHistoryArchive.last_id) > tuple_(*position))
+        query = query.order_by(ChatHistoryArchive.first_created_at.asc(), ChatHistoryArchive.first_id.asc())
+    result = []
+    for segment in query.yield_per(4):
+        rows = _decode_archive_segment(segment)
+        if older:
+            rows = [row for row in reversed(rows) if position is None or (row.created_at, row.id) < position]
+        else:
+            rows = [row for row in rows if (row.created_at, row.id) > position]
+        result.extend(rows[:limit - len(result)])
+        if len(result) >= limit:
+            break
+    return result
+
+def get_chat_history_page(db, user_id, limit=Config.CHAT_HISTORY_PAGE_SIZE, before_id=None, after_id=None):
+    """按游标分页获取聊天记录，返回 (按时间正序的记录列表, 是否还有更多)
+
+    不传游标时返回最新一页；before_id 返回该条之前（更早）的一页，after_id 返回该条之后（更新）的一页。
+    游标按 (created_at, id) 比较，走 (user_id, created_at, id) 复合索引，不随页码增大而变慢。
+    热表中的记录不够一页时才继续从归档中读取（归档记录都早于热表记录），游标也可以指向已归档的记录。
+    """
+    query = db.query(ChatHistory).filter(ChatHistory.user_id == user_id)
+    cursor_id = before_id if before_id is not None else after_id
+    cursor, cursor_archived = None, False
+    if cursor_id is not None:
+        cursor = db.query(ChatHistory.created_at, ChatHistory.id).filter(
+            ChatHistory.user_id == user_id, ChatHistory.id == cursor_id
+        ).first()
+        if cursor is None:
+            cursor = _find_archived_position(db, user_id, cursor_id)
+            if cursor is None:
+                return [], False
+            cursor_archived = True
+        cursor = tuple(cursor)
+        position = tuple_(ChatHistory.created_at, ChatHistory.id)
+        query = query.filter(position < tuple_(*cursor) if before_id is not None else position > tuple_(*cursor))
+
+    if after_id is not None:
+        rows = []
+        if cursor_archived:
+            rows = _get_archived_rows(db, user_id, cursor, older=False, limit=limit + 1)
+        if len(rows) <= limit:
+            rows += query.order_by(ChatHistory.created_at.asc(), ChatHistory.id.asc()).limit(limit + 1 - len(rows)).all()
+        return rows[:limit], len(rows) > limit
+    # 最新一页和更早的页都从新到旧取，再翻转成正序
+    rows = [] if cursor_archived else query.order_by(ChatHistory.created_at.desc(), ChatHistory.id.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        oldest = (rows[-1].created_at, rows[-1].id) if rows else cursor
+        rows += _get_archived_rows(db, user_id, oldest, older=True, limit=limit + 1 - len(rows))
+    has_more = len(rows) > limit
+    return list(reversed(rows[:limit])), has_more
+
+def iter_chat_histories_by_user(db, user_id, batch_size=500):
+    """按时间正序逐条产出用户的全部聊天记录（先归档后热表），分批读取，内存占用与记录总数无关"""
+    segments = db.query(ChatHistoryArchive).filter(ChatHistoryArchive.user_id == user_id).order_by(
+        ChatHistoryArchive.first_created_at.asc(), ChatHistoryArchive.first_id.asc()
+    )
+    for segment in segments.yield_per(4):
+        yield from _decode_archive_segment(segment)
+    query = db.query(ChatHistory).filter(ChatHistory.user_id == user_id).order_by(ChatHistory.created_at.asc(), ChatHistory.id.asc())
+    yield from query.yield_per(batch_size)
+
+def _like_snippet(message, terms, width=24):
+    """截取第一个命中词附近的片段并用【】标出命中词，格式与FTS5的snippet一致"""
+    positions = [(message.find(term), term) for term in terms if term in message]
+    if not positions:
+        return message[:width] + ("…" if len(message) > width else "")
+    start, term = min(positions)
+    begin = max(0, start - width // 2)
+    end = min(len(message), start + len(term) + width // 2)
+    snippet = message[begin:start] + "【" + term + "】" + message[start + len(term):end]
+    return ("…" if begin > 0 else "") + snippet + ("…" if end < len(message) else "")
+
+def _fts_phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+def search_chat_histories(db, user_id, keyword, limit=Config.CHAT_HISTORY_SEARCH_PAGE_SIZE, offset=0):
+    """全文搜索用户的聊天记录，返回 (命中列表, 是否还有更多)，按bm25相关度排序
+
+    关键词按空白拆分，各词须同时出现。trigram分词要求每个词至少3个字符，更短的词退回为
+    该用户记录上的LIKE匹配（走user_id索引，只扫描该用户的记录）。已归档的记录不在全文索引中。
+    每条命中包含 id、state、created_at 以及两条消息的摘要（命中处用【】标出）。
+    """
+    terms = [term for term in (term.strip('"') for term in keyword.split()) if term]
+    if not terms:
+        return [], False
+    if all(len(term) >= 3 for term in terms):
+        rows = db.execute(text(f"""
+            SELECT h.id, h.state, h.created_at,
+                   snippet({CHAT_HISTORY_FTS_TABLE}, 0, '【', '】', '…', 24) AS user_snippet,
+                   snippet({CHAT_HISTORY_FTS_TABLE}, 1, '【', '】', '…', 24) AS assistant_snippet,
+                   bm25({CHAT_HISTORY_FTS_TABLE}) AS score
+            FROM {CHAT_HISTORY_FTS_TABLE}
+            JOIN chat_histories AS h ON h.id = {CHAT_HISTORY_FTS_TABLE}.rowid
+            WHERE {CHAT_HISTORY_FTS_TABLE} MATCH :query AND {CHAT_HISTORY_FTS_TABLE}.user_id = :user_id
+            ORDER BY score
+            LIMIT :limit OFFSET :offset
+        """), {"query": " ".join(_fts_phrase(term) for term in terms), "user_id": user_id, "limit": limit + 1, "offset": offset}).all()
+        hits = [{
+            "id": row.id,
+            "state": row.state,
+            "created_at": row.created_at if isinstance(row.created_at, datetime) else datetime.fromisoformat(row.created_at),
+            "user_snippet": row.user_snippet,
+            "assistant_snippet": row.assistant_snippet,
+            "score": -row.score,
+        } for row in rows]
+    else:
+        query = db.query(ChatHistory).filter(ChatHistory.user_id == user_id)
+        for term in terms:
+            pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            query = query.filter((ChatHistory.user_message.like(pattern, escape="\\")) | (ChatHistory.assistant_message.like(pattern, escape="\\")))
+        rows = query.order_by(ChatHistory.created_at.desc(), ChatHistory.id.desc()).limit(limit + 1).offset(offset).all()
+        hits = [{
+            "id": row.id,
+            "state": row.state,
+            "created_at": row.created_at,
+            "user_snippet": _like_snippet(row.user_message, terms),
+            "assistant_snippet": _like_snippet(row.assistant_message, terms),
+            "score": None,
+        } for row in rows]
+    return hits[:limit], len(hits) > limit
+
+def archive_chat_histories(db, older_than_days=Config.CHAT_HISTORY_ARCHIVE_AFTER_DAYS,
+                           segment_rows=Config.CHAT_HISTORY_ARCHIVE_SEGMENT_ROWS, dry_run=False):
+    """将早于指定天数的聊天记录按用户压缩成归档段并从热表删除，返回 {user_id: 归档条数}
+
+    每次只读取一个归档段的记录，写入归档段和删除热表记录在同一个事务中，内存占用与段大小相关而与用户的记录数无关。
+    chat_histories使用AUTOINCREMENT主键，删除最大ID的记录后该ID不会被复用，因此无需保留最大ID的记录。
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    eligible = ChatHistory.created_at < cutoff
+    if dry_run:
+        return dict(db.query(ChatHistory.user_id, func.count(ChatHistory.id)).filter(eligible).group_by(ChatHistory.user_id).all())
+    user_ids = [row[0] for row in db.query(ChatHistory.user_id).filter(eligible).distinct().all()]
+    archived = {}
+    for user_id in user_ids:
+        archived[user_id] = 0
+        while True:
+            # 已归档的记录随即从热表删除，每次从剩余的可归档记录开头取一段
+            chunk = db.query(ChatHistory).filter(ChatHistory.user_id == user_id, eligible).order_by(
+                ChatHistory.created_at.asc(), ChatHistory.id.asc()
+            ).limit(segment_rows).all()
+            if not chunk:
+                break
+            try:
+                db.add(ChatHistoryArchive(
+                    user_id=user_id,
+                    row_count=len(chunk),
+                    first_created_at=chunk[0].created_at,
+                    first_id=chunk[0].id,
+                    last_created_at=chunk[-1].created_at,
+                    last_id=chunk[-1].id,
+                    min_id=min(row.id for row in chunk),
+                    max_id=max(row.id for row in chunk),
+                    payload=_encode_archive_payload(chunk)
+                ))
+                db.query(ChatHistory).filter(ChatHistory.id.in_([row.id for row in chunk])).delete(synchronize_session=False)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            db.expunge_all()
+            archived[user_id] += len(chunk)
+    return archived
+
 def clear_chat_histories_by_user(db, user_id):
-    """清空特定用户的所有聊天记录"""
+    """清空特定用户的所有聊天记录（包括归档），返回删除的记录条数"""
     result = db.query(ChatHistory).filter(ChatHistory.user_id == user_id).delete()
+    archived = db.query(func.coalesce(func.sum(ChatHistoryArchive.row_count), 0)).filter(ChatHistoryArchive.user_id == user_id).scalar()
+    db.query(ChatHistoryArchive).filter(ChatHistoryArchive.user_id == user_id).delete()
     db.commit()
-    return result
+    return result + archived
 
 # 邮箱验证相关操作
 def validate_email(email):
@@ -219,41 +703,48 @@ def generate_verification_code():
     return ''.join(secrets.choice('0123456789') for _ in range(6))
 
 def create_verification_code(db, email):
-    """创建验证码"""
+    """创建验证码
+
+    用一条upsert完成：新用户直接插入（未验证状态）；已有用户仅在没有未过期验证码、
+    或剩余有效期不超过30秒时更新，否则不修改并返回需要等待的时间。
+    """
     # 检查邮箱格式
     if not validate_email(email):
         return None, "邮箱格式不正确"
     
-    # 检查是否有未过期的验证码
-    user = get_user_by_email(db, email)
-    if user and user.verification_code and user.verification_code_expires:
-        if user.verification_code_expires > datetime.utcnow():
-            remaining_time = (user.verification_code_expires - datetime.utcnow()).seconds
-            if remaining_time > 30:  # 30秒内不能重复发送
-                return None, f"请等待{remaining_time}秒后再重新发送验证码"
-    
     # 生成新验证码
+    now = datetime.utcnow()
     verification_code = generate_verification_code()
-    expires_at = datetime.utcnow() + timedelta(minutes=5)  # 5分钟后过期
-    
-    if user:
-        # 更新现有用户的验证码
-        user.verification_code = verification_code
-        user.verification_code_expires = expires_at
-        user.failed_attempts = 0
-        user.last_attempt_time = None
-    else:
-        # 创建新用户（未验证状态）
-        user = User(
-            email=email,
-            is_verified=False,
-            verification_code=verification_code,
-            verification_code_expires=expires_at
-        )
-        db.add(user)
+    expires_at = now + timedelta(minutes=5)  # 5分钟后过期
     
+    user = _upsert_returning(
+        db, User,
+        {
+            "email": email,
+            "is_verified": False,
+            "verification_code": verification_code,
+            "verification_code_expires": expires_at,
+            "failed_attempts": 0,
+            "last_attempt_time": None,
+        },
+        ["email"],
+        ["verification_code", "verification_code_expires", "failed_attempts", "last_attempt_time"],
+        # 30秒内不能重复发送
+        where=lambda: or_(
+            User.verification_code.is_(None),
+            User.verification_code_expires.is_(None),
+            User.verification_code_expires <= bindparam("resend_after", type_=DateTime())
+        ),
+        where_name="resend_allowed",
+        params={"resend_after": now + timedelta(seconds=30)}
+    )
     db.commit()
-    db.refresh(user)
+    
+    if user is None:
+        # 冲突且未满足更新条件：已有未过期的验证码
+        user = get_user_by_email(db, email)
+        remaining_time = (user.verification_code_expires - datetime.utcnow()).seconds
+        return None, f"请等待{remaining_time}秒后再重新发送验证码"
     
     return user, None
 
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+情感规则文件检查脚本
+  validate  校验并编译规则文件，打印状态、规则和关键词统计（可在替换线上规则文件前运行）
+  bench     测量规则编译耗时，以及每条消息的扫描、变量更新、状态判断耗时
+
+示例: python check_emotion_rules.py validate --path emotion_rules.json
+      python check_emotion_rules.py bench --messages-file messages.txt
+"""
+
+import sys
+import time
+import random
+import argparse
+from emotion_rules import DEFAULT_RULES_PATH, EmotionRuleLoader, load_rules
+
+def validate(path):
+    rules = load_rules(path)
+    print(f"规则文件: {path}")
+    print(f"版本: {rules.version}，默认状态: {rules.default_state}，深夜时段: {rules.night_start}:00-{rules.night_end}:59")
+    print(f"状态 {len(rules.descriptions)} 个，变量 {len(rules.variable_defaults)} 个，"
+          f"规则 {len(rules.priority)} 条，关键词 {len(rules.automaton.keywords)} 个")
+    print("优先级: " + " > ".join(rules.priority) + f" > {rules.default_state}(默认)")
+    if rules.state_examples:
+        print(f"嵌入分类器: 阈值 {rules.classifier_threshold}，差距 {rules.classifier_margin}，例句 "
+              + "，".join(f"{state} {len(phrases)} 条" for state, phrases in rules.state_examples.items()))
+
+def _synthetic_messages(rules, count, seed):
+    """用规则中的关键词和普通文字拼出测试消息"""
+    rng = random.Random(seed)
+    keywords = list(rules.automaton.keywords)
+    filler = "今天天气不错我们一起去吃饭吧你在做什么呢好的谢谢"
+    messages = []
+    for _ in range(count):
+        parts = [rng.choice(keywords) if rng.random() < 0.15 else rng.choice(filler) for _ in range(rng.randint(5, 40))]
+        messages.append("".join(parts))
+    return messages
+
+def _per_message_us(func, messages):
+    start = time.perf_counter()
+    for message in messages:
+        func(message)
+    return (time.perf_counter() - start) * 1e6 / len(messages)
+
+def bench(path, messages_file, count, seed):
+    start = time.perf_counter()
+    rules = load_rules(path)
+    compile_ms = (time.perf_counter() - start) * 1000
+    if messages_file:
+        with open(messages_file, "r", encoding="utf-8") as f:
+            messages = [line.strip() for line in f if line.strip()]
+    else:
+        messages = _synthetic_messages(rules, count, seed)
+    hits_list = [rules.scan(message) for message in messages]
+    hour = 12
+
+    def turn(message):
+        variables = rules.default_variables()
+        hits = rules.scan(message)
+        rules.update_variables(variables, hits, hour)
+        return rules.decide(variables, hits, hour)
+
+    loader = EmotionRuleLoader(path)
+    loader.get()
+    variables = rules.default_variables()
+    index = iter(range(len(messages)))
+    results = {
+        "messages": len(messages),
+        "compile_ms": round(compile_ms, 2),
+        "scan_us": round(_per_message_us(rules.scan, messages), 2),
+        "decide_us": round(_per_message_us(lambda _: rules.decide(variables, hits_list[next(index)], hour), messages), 2),
+        "turn_us": round(_per_message_us(turn, messages), 2),
+        "loader_get_us": round(_per_message_us(lambda _: loader.get(), messages), 3),
+    }
+    columns = list(results)
+    print("\t".join(columns))
+    print("\t".join(str(results[column]) for column in columns))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="校验情感规则文件或测量规则判断耗时")
+    parser.add_argument("command", choices=["validate", "bench"], help="要执行的操作")
+    parser.add_argument("--path", default=DEFAULT_RULES_PATH, help=f"规则文件路径，默认{DEFAULT_RULES_PATH}")
+    parser.add_argument("--messages-file", help="bench使用的消息文件（每行一条），默认用规则关键词合成")
+    parser.add_argument("--messages", type=int, default=10000, help="合成消息条数，默认10000")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子，默认42")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "validate":
+            validate(args.path)
+        else:
+            bench(args.path, args.messages_file, args.messages, args.seed)
+    except (OSError, ValueError) as e:
+        print(f"{args.command} 失败: {e}")
+        sys.exit(1)
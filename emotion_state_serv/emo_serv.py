@@ -1,6 +1,7 @@
 from flask import Flask, request, jsonify
 from waitress import serve
 import character_card
+from emotion_rules import emotion_rules, evaluate_batch, validate_batch
 import datetime
 import json
 
@@ -10,21 +11,20 @@ app = Flask(__name__)
 class EmotionalStateMachine:
     def __init__(self, user_id=None):
         self.user_id = user_id
-        self.current_state = "S1"  # 默认妹妹模式
-        self.variables = {
-            "affection": 50,  # 亲密度 0-100
-            "heat": 0,  # 过热度 0-100
-            "sleepy": 20,  # 困倦度
-            "envy": 0,  # 吃醋程度
-            "stress": 10  # 压力值
-        }
+        rules = emotion_rules.get()
+        self.current_state = rules.default_state  # 默认妹妹模式
+        # affection 亲密度、heat 过热度、sleepy 困倦度、envy 吃醋程度、stress 压力值，默认值见规则文件
+        self.variables = rules.default_variables()
+        self.variable_remainders = {}  # 衰减后取整舍去的部分，保存时加回（见 apply_decay）
         self.state_history = []  # 状态历史记录
         
     def load_from_db(self, db):
-        """从数据库加载用户情感状态"""
-        from database import get_or_create_user_emotional_state
+        """从数据库加载用户情感状态；尚无记录时保留默认值，首次保存时创建（可使用只读会话）"""
+        from database import get_user_emotional_state
         if self.user_id:
-            state = get_or_create_user_emotional_state(db, self.user_id)
+            state = get_user_emotional_state(db, self.user_id)
+            if not state:
+                return
             self.current_state = state.current_state
             self.variables = {
                 "affection": state.affection,
@@ -33,50 +33,52 @@ class EmotionalStateMachine:
                 "envy": state.envy,
                 "stress": state.stress
             }
+            self.apply_decay(state.updated_at)
+
+    def apply_decay(self, updated_at, now=None):
+        """
+        按距上次更新（UTC时间）经过的时间惰性衰减情感变量，并重新检查只由变量决定的状态（如S7过热）
+        载入的变量和衰减结果都是精确值，状态机上的变量取整后使用，舍去的部分记在 variable_remainders 中，
+        保存时由 exact_variables() 加回；否则频繁对话时每次不足0.5的衰减都会被取整抵消，衰减永远不会生效
+        """
+        if updated_at is not None:
+            rules = emotion_rules.get()
+            elapsed = ((now or datetime.datetime.utcnow()) - updated_at).total_seconds()
+            if rules.decay_variables(self.variables, elapsed):
+                self.current_state = rules.settle_state(self.current_state, self.variables, datetime.datetime.now().hour)
+        for name, value in self.variables.items():
+            if isinstance(value, float):
+                self.variables[name] = int(round(value))
+                self.variable_remainders[name] = value - self.variables[name]
+
+    def exact_variables(self):
+        """返回加回取整舍去部分的精确变量值，用于保存"""
+        return {name: max(0, min(100, value + self.variable_remainders.get(name, 0)))
+                for name, value in self.variables.items()}
     
-    def save_to_db(self, db):
-        """将用户情感状态保存到数据库"""
+    def save_to_db(self, db, commit=True):
+        """将用户情感状态保存到数据库，commit=False时由调用方（如UnitOfWork）统一提交"""
         from database import update_user_emotional_state
         if self.user_id:
+            variables = self.exact_variables()
             update_user_emotional_state(
                 db, 
                 self.user_id,
                 current_state=self.current_state,
-                affection=self.variables["affection"],
-                heat=self.variables["heat"],
-                sleepy=self.variables["sleepy"],
-                envy=self.variables["envy"],
-                stress=self.variables["stress"]
+                affection=variables["affection"],
+                heat=variables["heat"],
+                sleepy=variables["sleepy"],
+                envy=variables["envy"],
+                stress=variables["stress"],
+                commit=commit
             )
 
-    def update_variables(self, user_msg):
-        """根据用户消息更新内部变量"""
-        # 更新亲密度
-        affection_increase_keywords = ["喜欢", "爱", "关心", "在乎", "宝贝", "可爱"]
-        for keyword in affection_increase_keywords:
-            if keyword in user_msg:
-                self.variables["affection"] = min(100, self.variables["affection"] + 3)
-
-        # 更新压力值
-        stress_increase_keywords = ["辛苦", "累", "忙", "压力", "烦", "焦虑"]
-        for keyword in stress_increase_keywords:
-            if keyword in user_msg:
-                self.variables["stress"] = min(100, self.variables["stress"] + 5)
-
-        # 更新吃醋程度
-        envy_triggers = ["女朋友", "女友", "她", "别人"]
-        for trigger in envy_triggers:
-            if trigger in user_msg:
-                self.variables["envy"] = min(100, self.variables["envy"] + 10)
-
-        # 更新过热值（随机增加模拟计算过程）
-        import random
-        self.variables["heat"] = min(100, self.variables["heat"] + random.randint(0, 3))
-
-        # 根据时间更新困倦度
-        current_hour = datetime.datetime.now().hour
-        if 22 <= current_hour or current_hour <= 6:
-            self.variables["sleepy"] = min(100, self.variables["sleepy"] + 2)
+    def update_variables(self, user_msg, hits=None, rules=None):
+        """根据用户消息更新内部变量；hits为该消息的关键词扫描结果，未传入时扫描一次"""
+        rules = rules or emotion_rules.get()
+        if hits is None:
+            hits = rules.scan(user_msg)
+        rules.update_variables(self.variables, hits, datetime.datetime.now().hour)
 
     def update_from_summary(self, summary_data):
         """根据对话总结数据更新情感变量"""
@@ -97,56 +99,25 @@ class EmotionalStateMachine:
             
         # 注意：envy和stress变量目前没有从对话总结中提取，保持原更新逻辑
 
-    def determine_state(self, user_msg):
-        """根据变量值和优先级规则确定状态"""
-        # 更新变量
-        self.update_variables(user_msg)
-
-        # 根据变量值和优先级规则确定状态
-        # 优先级：S7 > S8 > S4 > S2 > S5 > S6 > S1 > S3
-        if self.variables["heat"] > 80:
-            return "S7"  # 过热模式
-        elif self._is_night_time() and self.variables["affection"] > 70:
-            return "S8"  # 脆弱依赖模式（深夜限定）
-        elif self.variables["envy"] > 60:
-            return "S4"  # 恋爱萌芽（吃醋/小情绪）
-        elif any(keyword in user_msg.lower() for keyword in ["为什么", "怎么", "是什么", "原理", "解释"]):
-            return "S2"  # 学者模式
-        elif any(keyword in user_msg.lower() for keyword in ["机甲", "蜂黄泉", "玩具", "模型"]):
-            return "S5"  # 宅女模式（机甲狂热）
-        elif any(keyword in user_msg.lower() for keyword in ["电脑", "密码", "账户", "账单"]):
-            return "S6"  # 黑进你电脑模式
-        elif any(keyword in user_msg.lower() for keyword in ["难过", "伤心", "烦", "郁闷", "崩溃", "压力"]):
-            return "S3"  # 姐姐感（轻成熟）
-        else:
-            affection = self.variables["affection"]
-            sleepy = self.variables["sleepy"]
-            # 根据亲密度和困倦度决定状态
-            if affection > 70 and sleepy < 50:
-                return "S1"  # 妹妹模式（默认）
-            elif sleepy > 70:
-                return "S1"  # 困倦时也回到妹妹模式
-            else:
-                return "S1"  # 默认妹妹模式
+    def determine_state(self, user_msg, classify=None):
+        """
+        根据变量值和优先级规则确定状态（状态、优先级、阈值和关键词见 emotion_rules.json）
+        classify(rules) 可选，返回嵌入分类器判断的状态，与关键词一起参与关键词规则的判断
+        """
+        # 同一轮使用同一版本的规则，只扫描一遍消息，变量更新和状态判断共用结果
+        rules = emotion_rules.get()
+        hits = rules.scan(user_msg)
+        hour = datetime.datetime.now().hour
+        rules.update_variables(self.variables, hits, hour)
+        return rules.decide(self.variables, hits, hour, classify(rules) if classify else None)
 
     def _is_night_time(self):
         """判断是否为深夜"""
-        current_hour = datetime.datetime.now().hour
-        return 22 <= current_hour or current_hour <= 6
+        return emotion_rules.get().is_night(datetime.datetime.now().hour)
 
     def get_state_description(self, state):
         """获取状态描述"""
-        descriptions = {
-            "S1": "妹妹模式：天真可爱、贪吃、撒娇、耍赖、怕被凶",
-            "S2": "学者模式：冷静、成熟、专业、逻辑严密",
-            "S3": "姐姐感：温柔、安稳、有点像恋人照顾你",
-            "S4": "恋爱萌芽：吃醋、小情绪",
-            "S5": "宅女模式：机甲狂热，强行安利模型",
-            "S6": "黑进你电脑模式：暗示自己偷看了什么但不直接说",
-            "S7": "过热模式：逻辑失衡、语速变快、说奇怪的话",
-            "S8": "脆弱依赖模式：坦白关于爱、孤独、害怕被丢下的情绪"
-        }
-        return descriptions.get(state, "未知状态")
+        return emotion_rules.get().describe(state)
 
 
 # --------------------------
@@ -154,29 +125,9 @@ class EmotionalStateMachine:
 # --------------------------
 def detect_state(user_msg):
     """检测用户消息对应的状态"""
-    msg = user_msg.lower()
-
-    # 关键词检测机制
-    states_keywords = {
-        "caring": ["难过", "伤心", "烦", "郁闷", "崩溃", "压力", "痛", "哭"],
-        "explain": ["为什么", "怎么", "是什么", "原理", "解释", "how", "why"],
-        "casual": ["哈哈", "聊", "无聊", "在吗", "hi", "hello", "哈喽"],
-        "otaku": ["机甲", "蜂黄泉", "玩具", "模型"],
-        "hacker": ["电脑", "密码", "账户", "账单"],
-        "vulnerable": ["晚了", "深夜", "凌晨"]
-    }
-
-    # 计算各状态匹配分数
-    scores = {state: 0 for state in states_keywords.keys()}
-    scores["idle"] = 0
-
-    for state, keywords in states_keywords.items():
-        for keyword in keywords:
-            scores[state] += msg.count(keyword)
-
-    # 返回得分最高的状态
-    best_state = max(scores, key=scores.get)
-    return best_state if scores[best_state] > 0 else "idle"
+    # 按关键词出现次数打分，返回得分最高的状态
+    rules = emotion_rules.get()
+    return rules.detect(rules.scan(user_msg))
 
 
 def generate_reply(state, user_msg, emotional_machine=None):
@@ -299,133 +250,165 @@ def get_mcp_tools():
 # --------------------------
 # MCP 工具公开方法
 # --------------------------
-@app.route("/", methods=["POST"])
-def handle_rpc():
-    try:
-        # 获取JSON数据
-        if not request.is_json:
-            return jsonify({
-                "jsonrpc": "2.0",
-                "error": {"code": -32700, "message": "Invalid JSON"},
-                "id": None
-            }), 400
+def _rpc_error(code, message, request_id=None):
+    return {
+        "jsonrpc": "2.0",
+        "error": {"code": code, "message": message},
+        "id": request_id
+    }
 
-        data = request.get_json()
-        if not isinstance(data, dict):
-            return jsonify({
-                "jsonrpc": "2.0",
-                "error": {"code": -32700, "message": "Invalid JSON"},
-                "id": None
-            }), 400
-
-        method = data.get("method")
-        params = data.get("params", {})
-        request_id = data.get("id")
-
-        # 处理MCP协议方法
-        if method == "initialize":
-            # MCP协议初始化方法
-            return jsonify({
-                "jsonrpc": "2.0",
-                "result": {
-                    "protocolVersion": "2024-11-05",
-                    "capabilities": {
-                        "tools": {
-                            "listChanged": False
-                        }
-                    },
-                    "serverInfo": {
-                        "name": "Zizuko Emotion State Machine",
-                        "version": "1.0.0"
+
+def _handle_rpc_request(data):
+    """处理单个JSON-RPC请求，返回响应对象"""
+    method = data.get("method")
+    params = data.get("params", {})
+    request_id = data.get("id")
+
+    # 处理MCP协议方法
+    if method == "initialize":
+        # MCP协议初始化方法
+        return {
+            "jsonrpc": "2.0",
+            "result": {
+                "protocolVersion": "2024-11-05",
+                "capabilities": {
+                    "tools": {
+                        "listChanged": False
                     }
                 },
-                "id": request_id
-            })
+                "serverInfo": {
+                    "name": "Zizuko Emotion State Machine",
+                    "version": "1.0.0"
+                }
+            },
+            "id": request_id
+        }
 
-        elif method == "mcp:list-tools" or method == "tools/list":
-            # 支持两种不同的工具列表方法
-            return jsonify({
-                "jsonrpc": "2.0",
-                "result": get_mcp_tools(),
-                "id": request_id
-            })
-
-        elif method == "tools/call":
-            # 处理工具调用
-            tool_name = params.get("name")
-            arguments = params.get("arguments", {})
-
-            if tool_name == "emotion_state_machine":
-                message = arguments.get("message", "")
-                current_state = arguments.get("state", "idle")
-
-                # 使用情感状态机
-                emotional_machine = EmotionalStateMachine()
-                new_state = emotional_machine.determine_state(message)
-                reply = generate_reply(new_state, message, emotional_machine)
-
-                return jsonify({
-                    "jsonrpc": "2.0",
-                    "result": {
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": reply
-                            }
-                        ]
-                    },
-                    "id": request_id
-                })
-            else:
-                return jsonify({
-                    "jsonrpc": "2.0",
-                    "error": {"code": -32601, "message": f"Tool not found: {tool_name}"},
-                    "id": request_id
-                })
-
-        # 向后兼容的旧方法
-        elif method == "next_state":
-            message = params.get("message", "")
-            current_state = params.get("state", "idle")
+    elif method == "mcp:list-tools" or method == "tools/list":
+        # 支持两种不同的工具列表方法
+        return {
+            "jsonrpc": "2.0",
+            "result": get_mcp_tools(),
+            "id": request_id
+        }
+
+    elif method == "tools/call":
+        # 处理工具调用
+        tool_name = params.get("name")
+        arguments = params.get("arguments", {})
+
+        if tool_name == "emotion_state_machine":
+            message = arguments.get("message", "")
+            current_state = arguments.get("state", "idle")
 
+            # 使用情感状态机
             emotional_machine = EmotionalStateMachine()
             new_state = emotional_machine.determine_state(message)
             reply = generate_reply(new_state, message, emotional_machine)
-            state_desc = emotional_machine.get_state_description(new_state)
 
-            return jsonify({
+            return {
                 "jsonrpc": "2.0",
                 "result": {
-                    "reply": reply,
-                    "new_state": new_state,
-                    "state_description": state_desc,
-                    "variables": emotional_machine.variables
-                },
-                "id": request_id
-            })
-
-        elif method == "get_persona":
-            return jsonify({
-                "jsonrpc": "2.0",
-                "result": {
-                    "persona": character_card.persona_text()
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": reply
+                        }
+                    ]
                 },
                 "id": request_id
-            })
-
+            }
         else:
-            return jsonify({
+            return {
                 "jsonrpc": "2.0",
-                "error": {"code": -32601, "message": f"Method not found: {method}"},
+                "error": {"code": -32601, "message": f"Tool not found: {tool_name}"},
                 "id": request_id
-            })
+            }
 
-    except Exception as e:
-        return jsonify({
+    # 向后兼容的旧方法
+    elif method == "next_state":
+        message = params.get("message", "")
+        current_state = params.get("state", "idle")
+
+        emotional_machine = EmotionalStateMachine()
+        new_state = emotional_machine.determine_state(message)
+        reply = generate_reply(new_state, message, emotional_machine)
+        state_desc = emotional_machine.get_state_description(new_state)
+
+        return {
+            "jsonrpc": "2.0",
+            "result": {
+                "reply": reply,
+                "new_state": new_state,
+                "state_description": state_desc,
+                "variables": emotional_machine.variables
+            },
+            "id": request_id
+        }
+
+    elif method == "evaluate_batch":
+        # 批量计算状态转移（不生成回复），用于回放聊天记录和减少外部调用的HTTP往返
+        items, hour, seed = params.get("items"), params.get("hour"), params.get("seed")
+        try:
+            validate_batch(items, hour, seed)
+        except ValueError as e:
+            return _rpc_error(-32602, f"Invalid params: {e}", request_id)
+        return {
+            "jsonrpc": "2.0",
+            "result": {
+                "results": evaluate_batch(items, hour=hour, seed=seed)
+            },
+            "id": request_id
+        }
+
+    elif method == "get_persona":
+        return {
             "jsonrpc": "2.0",
-            "error": {"code": -32603, "message": f"Internal error: {str(e)}"},
-            "id": None
-        }), 500
+            "result": {
+                "persona": character_card.persona_text()
+            },
+            "id": request_id
+        }
+
+    else:
+        return {
+            "jsonrpc": "2.0",
+            "error": {"code": -32601, "message": f"Method not found: {method}"},
+            "id": request_id
+        }
+
+
+@app.route("/", methods=["POST"])
+def handle_rpc():
+    try:
+        # 获取JSON数据
+        if not request.is_json:
+            return jsonify(_rpc_error(-32700, "Invalid JSON")), 400
+
+        data = request.get_json()
+        if isinstance(data, list):
+            # JSON-RPC批量请求：按顺序逐个处理，单个请求出错不影响其他请求；没有id的通知不返回响应
+            if not data:
+                return jsonify(_rpc_error(-32600, "Invalid Request")), 400
+            responses = []
+            for item in data:
+                if not isinstance(item, dict):
+                    responses.append(_rpc_error(-32600, "Invalid Request"))
+                    continue
+                try:
+                    response = _handle_rpc_request(item)
+                except Exception as e:
+                    response = _rpc_error(-32603, f"Internal error: {str(e)}", item.get("id"))
+                if "id" in item:
+                    responses.append(response)
+            return jsonify(responses) if responses else ("", 204)
+
+        if not isinstance(data, dict):
+            return jsonify(_rpc_error(-32700, "Invalid JSON")), 400
+        return jsonify(_handle_rpc_request(data))
+
+    except Exception as e:
+        return jsonify(_rpc_error(-32603, f"Internal error: {str(e)}")), 500
 
 
 # --------------------------
@@ -438,7 +421,9 @@ if __name__ == "__main__":
     print("  - mcp:list-tools: 获取工具列表（旧版本）")
     print("  - tools/list: 获取工具列表（新版本）")
     print("  - tools/call: 调用工具")
+    print("  支持JSON-RPC批量请求（请求数组）")
     print("向后兼容的方法:")
     print("  - next_state: 根据用户消息确定下一个状态并生成回复")
+    print("  - evaluate_batch: 批量计算状态转移（不生成回复）")
     print("  - get_persona: 获取角色卡信息")
     serve(app, host="0.0.0.0", port=9601)
\ No newline at end of file
@@ -0,0 +1,460 @@
+"""
+情感状态规则表
+
+状态、优先级、阈值和触发关键词写在 emotion_rules.json 中（可用环境变量 EMOTION_RULES_PATH 指定其他文件），
+加载时校验并编译成决策表：
+- 所有关键词（变量关键词、规则关键词、detect_state 关键词）编译进同一个 KeywordAutomaton，每条消息只扫描一遍
+- rules 按优先级顺序编译成 (状态, 是否限深夜, 关键词类别, 变量条件) 元组，命中第一条即返回
+- state_classifier 为关键词规则的状态提供例句，主服务用嵌入模型计算各状态的质心向量（见 state_classifier.py），
+  消息向量最接近某状态的质心时，该状态的关键词规则视为命中，变量条件和优先级不变
+文件修改后自动重新加载（最多每 RELOAD_CHECK_INTERVAL 秒检查一次修改时间），新规则编译成功后整体替换；
+编译失败时打印错误并继续使用旧规则。修改规则文件时建议先写临时文件再重命名覆盖。
+"""
+
+import os
+import json
+import time
+import random
+import datetime
+import operator
+import threading
+from keyword_automaton import KeywordAutomaton, KeywordHits
+
+DEFAULT_RULES_PATH = os.environ.get(
+    "EMOTION_RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "emotion_rules.json"))
+RELOAD_CHECK_INTERVAL = 1.0  # 检查规则文件是否修改的最小间隔（秒）
+
+COMPARATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+_TOP_LEVEL_KEYS = {"version", "default_state", "night_hours", "states", "variables", "rules", "detect_states", "state_classifier"}
+_VARIABLE_KEYS = {"default", "max", "keyword_step", "keywords", "random_step", "night_step", "decay"}
+_RULE_KEYS = {"state", "night", "keywords", "when"}
+_CLASSIFIER_KEYS = {"threshold", "margin", "examples"}
+
+_NO_HITS = KeywordHits({}, {})
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _check_keywords(keywords, where, errors):
+    if not isinstance(keywords, list) or not keywords:
+        errors.append(f"{where}: keywords 必须是非空列表")
+        return False
+    if not all(isinstance(keyword, str) and keyword for keyword in keywords):
+        errors.append(f"{where}: keywords 中只能包含非空字符串")
+        return False
+    return True
+
+class EmotionRules:
+    """编译后的情感规则（只读，重新加载时整体替换）"""
+    def __init__(self, data, path=None):
+        errors = []
+        if not isinstance(data, dict):
+            raise ValueError("规则文件顶层必须是对象")
+        for key in sorted(set(data) - _TOP_LEVEL_KEYS):
+            errors.append(f"未知字段: {key}")
+        self.path = path
+        self.version = data.get("version")
+
+        # 状态及描述
+        states = data.get("states")
+        if not isinstance(states, dict) or not states:
+            errors.append("states 必须是非空对象 {状态: 描述}")
+            states = {}
+        self.descriptions = {state: str(description) for state, description in states.items()}
+        self.default_state = data.get("default_state")
+        if self.default_state not in self.descriptions:
+            errors.append(f"default_state {self.default_state!r} 不在 states 中")
+
+        # 深夜时段 [start, 24) ∪ [0, end]
+        night_hours = data.get("night_hours", {"start": 22, "end": 6})
+        if not isinstance(night_hours, dict):
+            night_hours = {}
+        self.night_start, self.night_end = night_hours.get("start"), night_hours.get("end")
+        if not all(isinstance(hour, int) and 0 <= hour <= 23 for hour in (self.night_start, self.night_end)):
+            errors.append("night_hours.start / night_hours.end 必须是 0-23 的整数")
+
+        keyword_rules = {}  # 自动机类别 -> 关键词
+
+        # 情感变量
+        variables = data.get("variables")
+        if not isinstance(variables, dict) or not variables:
+            errors.append("variables 必须是非空对象")
+            variables = {}
+        self.variable_defaults = {}
+        self.variable_max = {}
+        self._keyword_steps = []  # (变量, 类别, 每个不同关键词的增量)
+        self._random_steps = []  # (变量, 最小增量, 最大增量)
+        self._night_steps = []  # (变量, 深夜增量)
+        self._decay = []  # (变量, 衰减目标值, 半衰期秒数)
+        for name, spec in variables.items():
+            where = f"variables.{name}"
+            if not isinstance(spec, dict):
+                errors.append(f"{where} 必须是对象")
+                continue
+            for key in sorted(set(spec) - _VARIABLE_KEYS):
+                errors.append(f"{where}: 未知字段 {key}")
+            if not _is_number(spec.get("default")):
+                errors.append(f"{where}.default 必须是数字")
+            if not _is_number(spec.get("max", 100)):
+                errors.append(f"{where}.max 必须是数字")
+            self.variable_defaults[name] = spec.get("default")
+            self.variable_max[name] = spec.get("max", 100)
+            if "keywords" in spec or "keyword_step" in spec:
+                if not _is_number(spec.get("keyword_step")):
+                    errors.append(f"{where}.keyword_step 必须是数字")
+                elif _check_keywords(spec.get("keywords"), where, errors):
+                    category = f"variable:{name}"
+                    keyword_rules[category] = spec["keywords"]
+                    self._keyword_steps.append((name, category, spec["keyword_step"]))
+            if "random_step" in spec:
+                step = spec["random_step"]
+                if not (isinstance(step, list) and len(step) == 2 and all(isinstance(value, int) for value in step)
+                        and step[0] <= step[1]):
+                    errors.append(f"{where}.random_step 必须是 [最小整数, 最大整数]")
+                else:
+                    self._random_steps.append((name, step[0], step[1]))
+            if "night_step" in spec:
+                if not _is_number(spec["night_step"]):
+                    errors.append(f"{where}.night_step 必须是数字")
+                else:
+                    self._night_steps.append((name, spec["night_step"]))
+            if "decay" in spec:
+                decay = spec["decay"]
+                if not isinstance(decay, dict) or set(decay) - {"half_life_hours", "baseline"}:
+                    errors.append(f"{where}.decay 必须是对象 {{half_life_hours, baseline}}")
+                elif not _is_number(decay.get("half_life_hours")) or decay["half_life_hours"] <= 0:
+                    errors.append(f"{where}.decay.half_life_hours 必须是正数")
+                elif not _is_number(decay.get("baseline", spec.get("default"))):
+                    errors.append(f"{where}.decay.baseline 必须是数字")
+                else:
+                    self._decay.append((name, decay.get("baseline", spec.get("default")), decay["half_life_hours"] * 3600))
+
+        # 状态规则（按优先级顺序）
+        rules = data.get("rules")
+        if not isinstance(rules, list):
+            errors.append("rules 必须是列表")
+            rules = []
+        table = []
+        for index, rule in enumerate(rules):
+            where = f"rules[{index}]"
+            error_count = len(errors)
+            if not isinstance(rule, dict):
+                errors.append(f"{where} 必须是对象")
+                continue
+            for key in sorted(set(rule) - _RULE_KEYS):
+                errors.append(f"{where}: 未知字段 {key}")
+            state = rule.get("state")
+            if state not in self.descriptions:
+                errors.append(f"{where}: 状态 {state!r} 不在 states 中")
+            night = rule.get("night")
+            if night is not None and not isinstance(night, bool):
+                errors.append(f"{where}.night 必须是 true / false")
+            category = None
+            if "keywords" in rule and _check_keywords(rule["keywords"], where, errors):
+                category = f"rule:{index}"
+                keyword_rules[category] = rule["keywords"]
+            conditions = []
+            when = rule.get("when", {})
+            if not isinstance(when, dict):
+                errors.append(f"{where}.when 必须是对象 {{变量: {{比较符: 阈值}}}}")
+                when = {}
+            for variable, comparisons in when.items():
+                if variable not in variables:
+                    errors.append(f"{where}.when: 未定义的变量 {variable}")
+                    continue
+                if not isinstance(comparisons, dict) or not comparisons:
+                    errors.append(f"{where}.when.{variable} 必须是非空对象 {{比较符: 阈值}}")
+                    continue
+                for symbol, threshold in comparisons.items():
+                    if symbol not in COMPARATORS:
+                        errors.append(f"{where}.when.{variable}: 未知比较符 {symbol}，可选 {', '.join(COMPARATORS)}")
+                    elif not _is_number(threshold):
+                        errors.append(f"{where}.when.{variable}.{symbol} 的阈值必须是数字")
+                    else:
+                        conditions.append((variable, COMPARATORS[symbol], threshold))
+            if night is None and category is None and not conditions and len(errors) == error_count:
+                errors.append(f"{where}: 没有任何条件，其后的规则永远不会命中")
+            table.append((state, night, category, tuple(conditions)))
+        self._table = tuple(table)
+        # 只由变量条件决定的状态（没有任何关键词规则），变量衰减后需要重新检查
+        keyword_states = {state for state, _, category, _ in table if category is not None}
+        self._variable_states = frozenset(state for state, _, _, _ in table if state not in keyword_states)
+        self.priority = tuple(state for state, _, _, _ in table)  # 规则的状态，按优先级从高到低
+
+        # detect_state 使用的状态关键词（按出现次数打分，顺序决定同分时的优先级）
+        detect_states = data.get("detect_states", {})
+        if not isinstance(detect_states, dict):
+            errors.append("detect_states 必须是对象 {状态: [关键词, ...]}")
+            detect_states = {}
+        self._detect_categories = []
+        for state, keywords in detect_states.items():
+            if _check_keywords(keywords, f"detect_states.{state}", errors):
+                category = f"detect:{state}"
+                keyword_rules[category] = keywords
+                self._detect_categories.append((state, category))
+
+        # 嵌入分类器的例句（可选），只能用于有关键词规则的状态
+        classifier = data.get("state_classifier", {})
+        self.state_examples = {}
+        self.classifier_threshold = self.classifier_margin = 0.0
+        if not isinstance(classifier, dict):
+            errors.append("state_classifier 必须是对象 {threshold, margin, examples}")
+            classifier = {}
+        for key in sorted(set(classifier) - _CLASSIFIER_KEYS):
+            errors.append(f"state_classifier: 未知字段 {key}")
+        if classifier:
+            self.classifier_threshold = classifier.get("threshold")
+            self.classifier_margin = classifier.get("margin", 0.0)
+            if not _is_number(self.classifier_threshold) or not -1 <= self.classifier_threshold <= 1:
+                errors.append("state_classifier.threshold 必须是 -1 到 1 之间的数字（余弦相似度）")
+            if not _is_number(self.classifier_margin) or self.classifier_margin < 0:
+                errors.append("state_classifier.margin 必须是非负数")
+            examples = classifier.get("examples")
+            if not isinstance(examples, dict) or not examples:
+                errors.append("state_classifier.examples 必须是非空对象 {状态: [例句, ...]}")
+                examples = {}
+            for state, phrases in examples.items():
+                where = f"state_classifier.examples.{state}"
+                if state not in keyword_states:
+                    errors.append(f"{where}: 状态 {state!r} 没有关键词规则，分类结果不会被使用")
+                elif not isinstance(phrases, list) or not phrases or not all(isinstance(phrase, str) and phrase for phrase in phrases):
+                    errors.append(f"{where} 必须是非空字符串列表")
+                else:
+                    self.state_examples[state] = tuple(phrases)
+
+        if errors:
+            raise ValueError("情感规则校验失败:\n  " + "\n  ".join(errors))
+        self.keyword_rules = keyword_rules
+        self.automaton = KeywordAutomaton(keyword_rules)
+
+    def scan(self, user_msg):
+        """扫描一遍消息，得到变量、规则和detect_state所需的全部关键词命中情况"""
+        return self.automaton.scan(user_msg)
+
+    def is_night(self, hour):
+        return self.night_start <= hour or hour <= self.night_end
+
+    def default_variables(self):
+        return dict(self.variable_defaults)
+
+    def update_variables(self, variables, hits, hour, rng=random):
+        """根据关键词命中、随机增量和时间原地更新情感变量"""
+        for name, default in self.variable_defaults.items():
+            variables.setdefault(name, default)
+        for name, category, step in self._keyword_steps:
+            hit = hits.distinct.get(category)
+            if hit:
+                variables[name] = min(self.variable_max[name], variables[name] + step * hit)
+        for name, low, high in self._random_steps:
+            variables[name] = min(self.variable_max[name], variables[name] + rng.randint(low, high))
+        if self._night_steps and self.is_night(hour):
+            for name, step in self._night_steps:
+                variables[name] = min(self.variable_max[name], variables[name] + step)
+
+    def decay_variables(self, variables, elapsed_seconds):
+        """
+        按距上次更新经过的秒数原地衰减变量：value = baseline + (value - baseline) * 0.5 ** (elapsed / half_life)
+        闭式解只依赖上次更新时间，读取时计算即可，无需定时任务。结果不取整：频繁对话时每次衰减可能不足1，
+        取整会让衰减永远无法生效（取整由调用方在展示时处理，见 EmotionalStateMachine.apply_decay）。返回是否有变量发生变化
+        """
+        if elapsed_seconds <= 0:
+            return False
+        changed = False
+        for name, baseline, half_life in self._decay:
+            value = variables.get(name)
+            if value is None or value == baseline:
+                continue
+            decayed = baseline + (value - baseline) * 0.5 ** (elapsed_seconds / half_life)
+            if decayed != value:
+                variables[name] = decayed
+                changed = True
+        return changed
+
+    def settle_state(self, state, variables, hour):
+        """变量衰减后重新检查状态：只由变量决定的状态（如S7过热）按当前变量重新判断，关键词触发的状态保持不变"""
+        if state not in self._variable_states:
+            return state
+        return self.decide(variables, _NO_HITS, hour)
+
+    def decide(self, variables, hits, hour, classified_state=None):
+        """
+        按优先级返回第一条满足全部条件的规则对应的状态，没有命中时返回默认状态
+        classified_state 为嵌入分类器给出的状态，该状态的关键词规则即使没有关键词命中也视为命中
+        """
+        night = None
+        for state, night_only, category, conditions in self._table:
+            if night_only is not None:
+                if night is None:
+                    night = self.is_night(hour)
+                if night != night_only:
+                    continue
+            if category is not None and not hits.counts.get(category) and state != classified_state:
+                continue
+            for variable, compare, threshold in conditions:
+                if not compare(variables[variable], threshold):
+                    break
+            else:
+                return state
+        return self.default_state
+
+    def detect(self, hits):
+        """按关键词出现次数选出得分最高的状态，没有命中时返回idle"""
+        best_state, best_score = "idle", 0
+        for state, category in self._detect_categories:
+            score = hits.counts.get(category, 0)
+            if score > best_score:
+                best_state, best_score = state, score
+        return best_state
+
+    def describe(self, state):
+        return self.descriptions.get(state, "未知状态")
+
+    def evaluate_batch(self, messages, variables_list, hours, seed=None):
+        """
+        批量计算多条相互独立的消息的状态转移，三个列表等长，返回 (新状态列表, 新变量列表)，不修改传入的变量
+        整批共用同一版本的规则，不为每条消息创建状态机，重复的消息只扫描一次；seed不为None时随机增量可复现
+        """
+        rng = random.Random(seed) if seed is not None else random
+        scanned = {}
+        states, results = [], []
+        for message, variables, hour in zip(messages, variables_list, hours):
+            state, variables = self.evaluate(message, variables, hour, rng, scanned)
+            states.append(state)
+            results.append(variables)
+        return states, results
+
+    def evaluate(self, message, variables, hour, rng=random, scanned=None):
+        """计算一条消息的状态转移，返回 (新状态, 新变量)，不修改传入的变量；scanned 为 消息 -> 扫描结果 的缓存"""
+        hits = scanned.get(message) if scanned is not None else None
+        if hits is None:
+            hits = self.scan(message)
+            if scanned is not None:
+                scanned[message] = hits
+        variables = dict(variables) if variables else {}
+        self.update_variables(variables, hits, hour, rng)
+        return self.decide(variables, hits, hour), variables
+
+def load_rules(path=DEFAULT_RULES_PATH):
+    """读取并编译规则文件，格式或内容有误时抛出ValueError"""
+    with open(path, "r", encoding="utf-8") as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"规则文件不是合法的JSON: {e}") from e
+    return EmotionRules(data, path)
+
+class EmotionRuleLoader:
+    """持有当前生效的规则，规则文件修改后自动重新加载"""
+    def __init__(self, path=DEFAULT_RULES_PATH, check_interval=RELOAD_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._rules = None
+        self._signature = None  # (修改时间, 文件大小)
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """返回当前规则；调用方在一次处理中应只调用一次，保证使用同一版本的规则"""
+        if self._rules is None or time.monotonic() >= self._next_check:
+            self._reload_if_changed()
+        return self._rules
+
+    def _reload_if_changed(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._rules is not None and now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+            try:
+                stat = os.stat(self.path)
+            except OSError as e:
+                if self._rules is None:
+                    raise
+                print(f"无法读取情感规则文件，继续使用旧规则: {e}")
+                return
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if signature == self._signature:
+                return
+            try:
+                rules = load_rules(self.path)
+            except (OSError, ValueError) as e:
+                if self._rules is None:
+                    raise
+                # 记下签名，文件再次修改后才重试，避免每次检查都重复报错
+                self._signature = signature
+                print(f"情感规则重新加载失败，继续使用旧规则（版本 {self._rules.version}）: {e}")
+                return
+            reloaded = self._rules is not None
+            self._rules, self._signature = rules, signature
+            if reloaded:
+                print(f"情感规则已重新加载: {self.path}（版本 {rules.version}）")
+
+# 全局共享的情感规则
+emotion_rules = EmotionRuleLoader()
+
+def _is_hour(value):
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= 23
+
+def validate_batch(items, hour=None, seed=None):
+    """检查 evaluate_batch 的参数，不合法时抛出ValueError"""
+    if hour is not None and not _is_hour(hour):
+        raise ValueError("hour 必须是0-23的整数")
+    if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool)):
+        raise ValueError("seed 必须是整数")
+    if not isinstance(items, list):
+        raise ValueError("items 必须是数组")
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"items[{index}] 必须是对象")
+        if not isinstance(item.get("message", ""), str):
+            raise ValueError(f"items[{index}].message 必须是字符串")
+        user_id = item.get("user_id")
+        if user_id is not None and (not isinstance(user_id, (str, int)) or isinstance(user_id, bool)):
+            raise ValueError(f"items[{index}].user_id 必须是字符串或整数")
+        if "hour" in item and not _is_hour(item["hour"]):
+            raise ValueError(f"items[{index}].hour 必须是0-23的整数")
+        variables = item.get("variables")
+        if variables is not None and (not isinstance(variables, dict)
+                                      or not all(isinstance(name, str) and _is_number(value) for name, value in variables.items())):
+            raise ValueError(f"items[{index}].variables 必须是 变量名 -> 数值 的对象")
+
+def evaluate_batch(items, hour=None, seed=None):
+    """
+    批量计算状态转移，items 为 [{"user_id", "message", "variables", "hour"}, ...]（除message外均可省略）
+    - variables 为该条消息之前的情感变量，省略时沿用同一批次中该用户上一条消息的结果，再没有则使用默认值
+    - hour 为消息发送时的小时（回放聊天记录时使用），省略时使用参数 hour，再省略则为当前时间
+    按顺序逐条计算，整批共用一版规则并只扫描一次重复的消息（变量只有几个，向量化的转换开销大于收益，因此不做向量化）。
+    参数不合法时抛出ValueError（见 validate_batch）。返回与items一一对应的
+    [{"user_id", "new_state", "state_description", "variables"}, ...]
+    """
+    validate_batch(items, hour, seed)
+    rules = emotion_rules.get()  # 整个批次使用同一版本的规则
+    if hour is None:
+        hour = datetime.datetime.now().hour
+    rng = random.Random(seed) if seed is not None else random
+    scanned = {}
+    latest = {}  # user_id -> 最近一条消息计算后的变量
+    results = []
+    for item in items:
+        user_id = item.get("user_id")
+        variables = item.get("variables")
+        if variables is None and user_id is not None:
+            variables = latest.get(user_id)
+        state, variables = rules.evaluate(item.get("message", ""), variables, item.get("hour", hour), rng, scanned)
+        if user_id is not None:
+            latest[user_id] = variables
+        results.append({
+            "user_id": user_id,
+            "new_state": state,
+            "state_description": rules.describe(state),
+            "variables": variables,
+        })
+    return results
@@ -0,0 +1,94 @@
+"""
+情感状态机关键词自动机
+
+把情感状态机用到的全部关键词表编译成一个 Aho-Corasick 自动机（加载规则时构建一次），
+对消息只扫描一遍即可得到每个规则类别的命中情况：
+- counts：关键词出现次数之和（同一关键词按不重叠方式计数，与 str.count 一致）
+- distinct：命中的不同关键词个数（与逐个关键词 `in` 判断的结果一致）
+匹配不区分大小写，关键词在构建时、消息在扫描时各转换一次小写。
+关键词表定义在 emotion_rules.json 中，由 emotion_rules 编译。
+"""
+
+from collections import namedtuple
+
+# 单次扫描结果：counts / distinct 均为 {类别: 数量}，只包含命中的类别
+KeywordHits = namedtuple("KeywordHits", ["counts", "distinct"])
+
+class KeywordAutomaton:
+    """多模式关键词匹配（Aho-Corasick），一个关键词可以属于多个类别"""
+    def __init__(self, rules):
+        """rules: {类别: [关键词, ...]}"""
+        self.categories = tuple(rules)
+        self._goto = [{}]  # 节点 -> {字符: 子节点}
+        self._fail = [0]
+        self._output = [()]  # 节点 -> ((关键词序号, 关键词长度), ...)，已合并失败链上的输出
+        self._keyword_categories = []  # 关键词序号 -> 所属类别
+        keyword_ids = {}
+        for category, keywords in rules.items():
+            for keyword in keywords:
+                keyword = keyword.lower()
+                if not keyword:
+                    raise ValueError(f"类别 {category} 中存在空关键词")
+                if keyword not in keyword_ids:
+                    keyword_ids[keyword] = len(self._keyword_categories)
+                    self._keyword_categories.append([])
+                    self._insert(keyword, keyword_ids[keyword])
+                if category not in self._keyword_categories[keyword_ids[keyword]]:
+                    self._keyword_categories[keyword_ids[keyword]].append(category)
+        self.keywords = tuple(keyword_ids)
+        self._keyword_categories = [tuple(categories) for categories in self._keyword_categories]
+        self._build_fail_links()
+
+    def _insert(self, keyword, keyword_id):
+        node = 0
+        for char in keyword:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+                self._goto[node][char] = next_node
+            node = next_node
+        self._output[node] = ((keyword_id, len(keyword)),)
+
+    def _build_fail_links(self):
+        """按层序计算失败指针，并把失败节点的输出合并到当前节点"""
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for char, child in self._goto[node].items():
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+                queue.append(child)
+
+    def scan(self, text):
+        """扫描一遍消息，返回各类别的命中次数与命中的不同关键词数"""
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        counts = None
+        last_end = None
+        for end, char in enumerate(text.lower(), 1):
+            next_state = goto[state].get(char)
+            while next_state is None and state:
+                state = fail[state]
+                next_state = goto[state].get(char)
+            state = next_state or 0
+            if output[state]:
+                if counts is None:
+                    counts, last_end = {}, {}
+                for keyword_id, length in output[state]:
+                    # 同一关键词只统计互不重叠的出现
+                    if end - length >= last_end.get(keyword_id, 0):
+                        last_end[keyword_id] = end
+                        counts[keyword_id] = counts.get(keyword_id, 0) + 1
+        if counts is None:
+            return KeywordHits({}, {})
+        category_counts, category_distinct = {}, {}
+        for keyword_id, count in counts.items():
+            for category in self._keyword_categories[keyword_id]:
+                category_counts[category] = category_counts.get(category, 0) + count
+                category_distinct[category] = category_distinct.get(category, 0) + 1
+        return KeywordHits(category_counts, category_distinct)
@@ -0,0 +1,113 @@
+"""
+按状态预先生成的角色设定
+
+character_card.persona_text() 有数KB，生成提示词时不再每次重新拼接、逐条替换，而是在加载时
+按 PERSONA_REPLACEMENTS 为每个需要过滤的状态生成一份角色设定，生成提示词时按状态直接取用。
+每条替换规则在加载时检查：原文必须在角色卡中恰好出现一次，否则加载失败（角色卡改动后替换规则
+悄悄失效会让过滤不再生效）。character_card.py 修改后自动重新加载（最多每 RELOAD_CHECK_INTERVAL 秒
+检查一次修改时间），加载或检查失败时打印错误并继续使用旧的角色设定。
+"""
+
+import os
+import time
+import importlib
+import threading
+import character_card
+
+RELOAD_CHECK_INTERVAL = 1.0  # 检查角色卡是否修改的最小间隔（秒）
+
+# 状态 -> ((说明, 原文, 替换为), ...)，按顺序应用
+PERSONA_REPLACEMENTS = {
+    # 学者模式下不展示宅属性，学者面补充不提无关爱好
+    "S2": (
+        ("移除宅女模式说明",
+         "    S5：宅女模式（兴趣狂热）\n    - 听到个人兴趣相关话题会兴奋。\n    - 会热情分享并安利自己的兴趣给用户。\n",
+         ""),
+        ("学者面专注学术",
+         "    - 做过大量高强度计算，偶尔会「脑袋过热」。\n",
+         "    - 做过大量高强度计算，偶尔会「脑袋过热」。\n    - 专注于学术问题，不会提及与学术无关的个人爱好。\n"),
+    ),
+}
+STATE_ALIASES = {"explain": "S2"}  # detect_state 的状态名与对应的角色设定
+
+class PersonaVariants:
+    """一个版本角色卡的各状态角色设定（只读，重新加载时整体替换）"""
+    def __init__(self, base, replacements=PERSONA_REPLACEMENTS, aliases=STATE_ALIASES):
+        errors = []
+        self.base = base
+        self._variants = {}
+        for state, rules in replacements.items():
+            text = base
+            for description, old, new in rules:
+                count = text.count(old)
+                if count != 1:
+                    errors.append(f"{state} 的替换规则「{description}」在角色卡中出现 {count} 次（应为1次）")
+                    continue
+                text = text.replace(old, new)
+            self._variants[state] = text
+        for alias, state in aliases.items():
+            if state not in self._variants:
+                errors.append(f"别名 {alias} 指向的状态 {state} 没有替换规则")
+            else:
+                self._variants[alias] = self._variants[state]
+        if errors:
+            raise ValueError("角色设定替换规则检查失败:\n  " + "\n  ".join(errors))
+
+    def get(self, state):
+        """返回该状态的角色设定，没有替换规则的状态使用完整角色卡"""
+        return self._variants.get(state, self.base)
+
+class PersonaLoader:
+    """持有当前生效的各状态角色设定，character_card.py 修改后自动重新加载"""
+    def __init__(self, module=character_card, check_interval=RELOAD_CHECK_INTERVAL):
+        self.module = module
+        self.path = module.__file__
+        self.check_interval = check_interval
+        self._variants = None
+        self._signature = None  # (修改时间, 文件大小)
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._variants is None or time.monotonic() >= self._next_check:
+            self._reload_if_changed()
+        return self._variants
+
+    def _reload_if_changed(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._variants is not None and now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+            try:
+                stat = os.stat(self.path)
+            except OSError as e:
+                if self._variants is None:
+                    raise
+                print(f"无法读取角色卡，继续使用旧的角色设定: {e}")
+                return
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if signature == self._signature:
+                return
+            reloaded = self._variants is not None
+            try:
+                if reloaded:
+                    self.module = importlib.reload(self.module)
+                variants = PersonaVariants(self.module.persona_text())
+            except Exception as e:
+                if self._variants is None:
+                    raise
+                # 记下签名，文件再次修改后才重试，避免每次检查都重复报错
+                self._signature = signature
+                print(f"角色卡重新加载失败，继续使用旧的角色设定: {e}")
+                return
+            self._variants, self._signature = variants, signature
+            if reloaded:
+                print(f"角色卡已重新加载: {self.path}")
+
+# 全局共享的各状态角色设定
+persona_variants = PersonaLoader()
+
+def persona_for(state):
+    """返回当前角色卡中该状态的角色设定"""
+    return persona_variants.get().get(state)
@@ -0,0 +1,176 @@
+"""
+情感状态内存存储（write-behind）
+
+活跃用户的情感状态以内存为准：首次访问时从 user_emotional_states 读取一次，之后每轮对话只读写内存，
+修改过的用户由后台线程定期用一条批量UPSERT写回数据库，进程退出时再写回一次。
+每个用户记录最后一次更新的时间，载入状态机时按经过的时间惰性计算变量衰减（见 EmotionalStateMachine.apply_decay），
+不需要定时任务遍历所有用户。变量按不取整的精确值保存，衰减不会因每轮取整而丢失。
+仅适用于单进程部署；关闭 Config.EMOTION_STATE_STORE_ENABLED 后每轮直接读写数据库，
+传入请求的 UnitOfWork 时写操作登记到其中，与同一轮的聊天记录一起提交。
+"""
+
+import time
+import atexit
+import threading
+from datetime import datetime
+from config import Config
+from database import SessionLocal, ReadSessionLocal, get_user_emotional_state, bulk_upsert_user_emotional_states
+
+VARIABLE_NAMES = ("affection", "heat", "sleepy", "envy", "stress")
+
+class EmotionalStateStore:
+    """按用户缓存情感状态，脏数据批量写回"""
+    def __init__(self, session_factory=None, read_session_factory=None, enabled=Config.EMOTION_STATE_STORE_ENABLED,
+                 flush_interval=Config.EMOTION_STATE_FLUSH_INTERVAL, flush_batch=Config.EMOTION_STATE_FLUSH_BATCH,
+                 idle_ttl=Config.EMOTION_STATE_IDLE_TTL):
+        self._session_factory = session_factory or SessionLocal
+        self._read_session_factory = read_session_factory or ReadSessionLocal
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.idle_ttl = idle_ttl
+        self._states = {}  # user_id -> {"current_state", "variables", "updated_at", "last_access"}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # 保证同一时刻只有一个线程在写回
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _read_from_db(self, user_id):
+        db = self._read_session_factory()
+        try:
+            state = get_user_emotional_state(db, user_id)
+            if not state:
+                return None
+            return {
+                "current_state": state.current_state,
+                "variables": {name: getattr(state, name) for name in VARIABLE_NAMES},
+                "updated_at": state.updated_at
+            }
+        finally:
+            db.close()
+
+    def load_into(self, machine):
+        """将用户状态载入状态机并计算自上次更新以来的衰减；内存未命中时读一次数据库，数据库也没有时保留状态机默认值"""
+        user_id = machine.user_id
+        if not user_id:
+            return
+        with self._lock:
+            entry = self._states.get(user_id)
+            if entry is not None:
+                entry["last_access"] = time.time()
+                machine.current_state = entry["current_state"]
+                machine.variables = dict(entry["variables"])
+                updated_at = entry["updated_at"]
+        if entry is None:
+            loaded = self._read_from_db(user_id)
+            if loaded is None:
+                loaded = {"current_state": machine.current_state, "variables": dict(machine.variables), "updated_at": None}
+            with self._lock:
+                # 读数据库期间其它请求可能已载入或修改过该用户，以内存中的为准
+                entry = self._states.get(user_id) if self.enabled else None
+                if entry is None:
+                    entry = dict(loaded, last_access=time.time())
+                    if self.enabled:
+                        self._states[user_id] = entry
+                machine.current_state = entry["current_state"]
+                machine.variables = dict(entry["variables"])
+                updated_at = entry["updated_at"]
+        # 衰减只作用于状态机上的副本，下次保存时连同新的更新时间一起写回
+        machine.apply_decay(updated_at)
+
+    def save_from(self, machine, uow=None):
+        """保存状态机的当前状态；启用时只标记为待写回，否则登记到uow（未传入时立即写入数据库）"""
+        user_id = machine.user_id
+        if not user_id:
+            return
+        # 保存精确值（含衰减取整舍去的部分），更新时间与之对应
+        entry = {"current_state": machine.current_state, "variables": machine.exact_variables(),
+                 "updated_at": datetime.utcnow(), "last_access": time.time()}
+        if not self.enabled:
+            if uow is not None:
+                uow.add(bulk_upsert_user_emotional_states, [self._row(user_id, entry)])
+            else:
+                self._write([self._row(user_id, entry)])
+            return
+        with self._lock:
+            self._states[user_id] = entry
+            self._dirty.add(user_id)
+            dirty_count = len(self._dirty)
+        self._ensure_started()
+        if dirty_count >= self.flush_batch:
+            self._wakeup.set()
+
+    @staticmethod
+    def _row(user_id, entry):
+        # 写回保存时的更新时间而不是写回时间，衰减从用户最后一次对话开始计算
+        return dict(entry["variables"], user_id=user_id, current_state=entry["current_state"], updated_at=entry["updated_at"])
+
+    def _write(self, rows):
+        db = self._session_factory()
+        try:
+            bulk_upsert_user_emotional_states(db, rows)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def flush(self):
+        """将全部待写回的状态批量写入数据库，返回写入的用户数"""
+        with self._flush_lock:
+            with self._lock:
+                user_ids, self._dirty = self._dirty, set()
+                rows = [self._row(user_id, self._states[user_id]) for user_id in user_ids if user_id in self._states]
+            try:
+                self._write(rows)
+            except Exception:
+                # 写回失败时重新标记，等待下次重试
+                with self._lock:
+                    self._dirty |= user_ids
+                raise
+            self._evict_idle()
+            return len(rows)
+
+    def _evict_idle(self):
+        """移除已写回且长时间未访问的用户，限制内存占用"""
+        deadline = time.time() - self.idle_ttl
+        with self._lock:
+            for user_id in [user_id for user_id, entry in self._states.items()
+                            if entry["last_access"] < deadline and user_id not in self._dirty]:
+                del self._states[user_id]
+
+    def _ensure_started(self):
+        if self._thread is not None or self._stopped.is_set():
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="emotional-state-flush", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"情感状态批量写回失败: {e}")
+
+    def shutdown(self):
+        """停止后台线程并写回剩余状态（进程退出时自动调用）"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+        try:
+            count = self.flush()
+            if count:
+                print(f"退出前写回 {count} 个用户的情感状态")
+        except Exception as e:
+            print(f"退出前写回情感状态失败: {e}")
+
+# 全局共享的情感状态存储
+emotional_state_store = EmotionalStateStore()
+atexit.register(emotional_state_store.shutdown)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+情感状态嵌入分类器离线评估脚本
+对比只用关键词规则（keyword）、只用质心分类（embedding）以及两者结合（combined，线上使用的方式）的准确率，
+并输出各状态的精确率/召回率、质心计算耗时和每条消息的分类耗时。变量取默认值、时间取白天，只评估关键词规则对应的状态。
+
+  --labeled   标注文件，每行 {"message": "...", "state": "S2"}，不属于任何关键词状态的消息标为默认状态（S1）
+  不指定标注文件时，对规则文件中的例句做留一法评估（每条例句用其余例句的质心分类）
+
+示例: python evaluate_state_classifier.py --labeled labeled.jsonl
+      python evaluate_state_classifier.py --threshold 0.6 --margin 0.02
+"""
+
+import sys
+import json
+import time
+import argparse
+import traceback
+from collections import Counter
+import numpy as np
+from config import Config
+from emotion_rules import DEFAULT_RULES_PATH, load_rules
+from state_classifier import centroid_set, normalize_rows
+
+EVAL_HOUR = 12  # 白天，深夜规则不参与
+
+def load_labeled(path):
+    samples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                samples.append((record["message"], record["state"]))
+    return samples
+
+def evaluate(rules, samples, embeddings, centroids_list):
+    """centroids_list 与 samples 一一对应（留一法时每条样本的质心不同），返回 {模式: 预测列表}"""
+    defaults = rules.default_variables()
+    predictions = {"keyword": [], "embedding": [], "combined": []}
+    for (message, _), embedding, centroids in zip(samples, embeddings, centroids_list):
+        hits = rules.scan(message)
+        classified = centroids.classify(embedding)[0]
+        predictions["keyword"].append(rules.decide(defaults, hits, EVAL_HOUR))
+        predictions["embedding"].append(classified or rules.default_state)
+        predictions["combined"].append(rules.decide(defaults, hits, EVAL_HOUR, classified))
+    return predictions
+
+def print_report(samples, predictions):
+    labels = [state for _, state in samples]
+    print("\t".join(["mode", "samples", "accuracy"]))
+    for mode, predicted in predictions.items():
+        correct = sum(1 for label, state in zip(labels, predicted) if label == state)
+        print(f"{mode}\t{len(labels)}\t{correct / max(1, len(labels)):.1%}")
+
+    print("\n# 各状态精确率/召回率")
+    print("\t".join(["state", "support"] + [f"{mode}_{metric}" for mode in predictions for metric in ("precision", "recall")]))
+    support = Counter(labels)
+    for state in sorted(set(labels) | {state for predicted in predictions.values() for state in predicted}):
+        line = [state, str(support[state])]
+        for predicted in predictions.values():
+            predicted_count = sum(1 for value in predicted if value == state)
+            true_positive = sum(1 for label, value in zip(labels, predicted) if label == state and value == state)
+            line.append(f"{true_positive / predicted_count:.1%}" if predicted_count else "-")
+            line.append(f"{true_positive / support[state]:.1%}" if support[state] else "-")
+        print("\t".join(line))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="离线评估情感状态嵌入分类器")
+    parser.add_argument("--labeled", help="标注文件（JSONL），不指定时对规则例句做留一法评估")
+    parser.add_argument("--rules", default=DEFAULT_RULES_PATH, help=f"规则文件，默认{DEFAULT_RULES_PATH}")
+    parser.add_argument("--model-path", default=Config.LOCAL_MODEL_PATH, help="嵌入模型路径，默认Config.LOCAL_MODEL_PATH")
+    parser.add_argument("--threshold", type=float, help="覆盖规则文件中的相似度阈值")
+    parser.add_argument("--margin", type=float, help="覆盖规则文件中第一名与第二名的最小差距")
+    args = parser.parse_args()
+
+    try:
+        from sentence_transformers import SentenceTransformer
+        rules = load_rules(args.rules)
+        if not rules.state_examples:
+            print(f"规则文件没有配置 state_classifier.examples: {args.rules}")
+            sys.exit(1)
+        threshold = rules.classifier_threshold if args.threshold is None else args.threshold
+        margin = rules.classifier_margin if args.margin is None else args.margin
+        model = SentenceTransformer(args.model_path)
+
+        states = tuple(rules.state_examples)
+        start = time.perf_counter()
+        vectors_by_state = {state: normalize_rows(model.encode(list(rules.state_examples[state]))) for state in states}
+        centroids = centroid_set(states, vectors_by_state, threshold, margin)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        if args.labeled:
+            samples = load_labeled(args.labeled)
+            embeddings = model.encode([message for message, _ in samples])
+            centroids_list = [centroids] * len(samples)
+        else:
+            # 留一法：每条例句用去掉它之后的质心分类
+            samples, embeddings, centroids_list = [], [], []
+            for state in states:
+                for index, phrase in enumerate(rules.state_examples[state]):
+                    held_out = dict(vectors_by_state)
+                    held_out[state] = np.delete(vectors_by_state[state], index, axis=0)
+                    if not len(held_out[state]):
+                        continue
+                    samples.append((phrase, state))
+                    embeddings.append(vectors_by_state[state][index])
+                    centroids_list.append(centroid_set(states, held_out, threshold, margin))
+
+        start = time.perf_counter()
+        for embedding in embeddings:
+            centroids.classify(embedding)
+        classify_us = (time.perf_counter() - start) * 1e6 / max(1, len(embeddings))
+
+        print(f"规则: {args.rules}，状态 {len(states)} 个，例句 {sum(len(v) for v in vectors_by_state.values())} 条，"
+              f"阈值 {threshold}，差距 {margin}，{'标注文件 ' + args.labeled if args.labeled else '留一法'}")
+        print(f"编码例句并计算质心 {build_ms:.1f} ms，每条消息分类 {classify_us:.2f} us（{len(states)} 次点积，不含编码）\n")
+        print_report(samples, evaluate(rules, samples, embeddings, centroids_list))
+    except Exception as e:
+        print(f"评估失败: {e}")
+        print(traceback.format_exc())
+        sys.exit(1)
@@ -0,0 +1,115 @@
+"""
+用户身份缓存：email -> (user_id, collection_name)
+
+每个请求都要把邮箱映射成用户ID和记忆集合名，缓存命中时无需访问数据库。
+只缓存已验证用户；验证状态变化（发送验证码、验证成功）时显式失效。
+配置了 Config.REDIS_URL 时使用Redis，使多个节点共享缓存和失效。
+"""
+
+import json
+import time
+import threading
+from collections import OrderedDict
+from config import Config
+
+class IdentityCache:
+    """进程内TTL+LRU身份缓存"""
+    def __init__(self, ttl=Config.IDENTITY_CACHE_TTL, max_entries=Config.IDENTITY_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # email -> (expires_at, user_id, collection_name)
+        self._lock = threading.Lock()
+
+    def get(self, email):
+        """返回 (user_id, collection_name)，未命中或已过期返回None"""
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[email]
+                return None
+            self._entries.move_to_end(email)
+            return entry[1], entry[2]
+
+    def set(self, email, user_id, collection_name):
+        with self._lock:
+            self._entries[email] = (time.time() + self.ttl, user_id, collection_name)
+            self._entries.move_to_end(email)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, email):
+        with self._lock:
+            self._entries.pop(email, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class RedisIdentityCache:
+    """基于Redis的身份缓存，TTL由Redis负责过期"""
+    def __init__(self, redis_url, ttl=Config.IDENTITY_CACHE_TTL, key_prefix=Config.IDENTITY_CACHE_KEY_PREFIX):
+        import redis
+        self.client = redis.Redis.from_url(redis_url)
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+
+    def _key(self, email):
+        return f"{self.key_prefix}{email}"
+
+    def get(self, email):
+        try:
+            value = self.client.get(self._key(email))
+        except Exception as e:
+            print(f"读取Redis身份缓存失败: {e}")
+            return None
+        if value is None:
+            return None
+        data = json.loads(value)
+        return data["user_id"], data["collection_name"]
+
+    def set(self, email, user_id, collection_name):
+        try:
+            self.client.set(self._key(email), json.dumps({"user_id": user_id, "collection_name": collection_name}), ex=self.ttl)
+        except Exception as e:
+            print(f"写入Redis身份缓存失败: {e}")
+
+    def invalidate(self, email):
+        try:
+            self.client.delete(self._key(email))
+        except Exception as e:
+            print(f"清除Redis身份缓存失败: {e}")
+
+    def clear(self):
+        for key in self.client.scan_iter(match=f"{self.key_prefix}*"):
+            self.client.delete(key)
+
+class NullIdentityCache:
+    """禁用缓存时使用，始终未命中"""
+    def get(self, email):
+        return None
+
+    def set(self, email, user_id, collection_name):
+        pass
+
+    def invalidate(self, email):
+        pass
+
+    def clear(self):
+        pass
+
+def create_identity_cache(redis_url=None):
+    """根据配置创建身份缓存；Redis不可用时退回进程内缓存"""
+    if not Config.IDENTITY_CACHE_ENABLED:
+        return NullIdentityCache()
+    redis_url = redis_url or Config.REDIS_URL
+    if redis_url:
+        try:
+            return RedisIdentityCache(redis_url)
+        except ImportError:
+            print("未安装redis，身份缓存退回进程内缓存")
+    return IdentityCache()
+
+# 全局共享的身份缓存
+identity_cache = create_identity_cache()
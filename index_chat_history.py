@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天记录全文索引维护脚本
+  rebuild   根据chat_histories重建全文索引（首次启用全文搜索时为已有记录补建索引）
+  optimize  合并索引段，提升查询速度
+  check     校验索引与chat_histories是否一致
+"""
+
+import sys
+import time
+import argparse
+import traceback
+from database import engine, SessionLocal, ensure_chat_history_fts, rebuild_chat_history_fts, optimize_chat_history_fts, check_chat_history_fts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="维护聊天记录全文索引")
+    parser.add_argument("command", choices=["rebuild", "optimize", "check"], help="要执行的操作")
+    args = parser.parse_args()
+
+    try:
+        ensure_chat_history_fts(engine)
+        db = SessionLocal()
+        try:
+            start = time.time()
+            if args.command == "rebuild":
+                rebuild_chat_history_fts(db)
+            elif args.command == "optimize":
+                optimize_chat_history_fts(db)
+            else:
+                check_chat_history_fts(db)
+            print(f"{args.command} 完成，耗时 {time.time() - start:.2f} 秒")
+        finally:
+            db.close()
+    except Exception as e:
+        print(f"{args.command} 失败: {e}")
+        print(traceback.format_exc())
+        sys.exit(1)
@@ -1,15 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-初始化脚本，用于在其他机器上生成chroma文件和数据库文件
+初始化脚本，用于在其他机器上生成向量存储文件和数据库文件
 """
 
 import os
 import sys
 import traceback
-import chromadb
 from sentence_transformers import SentenceTransformer
 from config import Config
+from vector_store import create_vector_store
 from database import init_db, get_db, get_or_create_user, get_or_create_memory_collection
 
 def init_database():
@@ -35,23 +35,23 @@ def init_database():
         print(traceback.format_exc())
         raise
 
-def init_chroma_db():
+def init_vector_store():
     """
-    初始化Chroma数据库
+    初始化向量存储（后端由Config.VECTOR_STORE_BACKEND决定）
     """
-    print("正在初始化Chroma数据库...")
+    print(f"正在初始化向量存储（{Config.VECTOR_STORE_BACKEND}）...")
     try:
-        # 创建Chroma客户端
-        chroma_client = chromadb.PersistentClient(path=Config.CHROMA_PERSIST_DIRECTORY)
+        # 创建向量存储
+        vector_store = create_vector_store()
         
         # 创建默认集合
-        default_collection = chroma_client.get_or_create_collection(name="memory_default_example_com")
-        print(f"已创建默认Chroma集合: {default_collection.name}")
+        default_collection = vector_store.get_or_create_collection(name="memory_default_example_com")
+        print(f"已创建默认向量集合: {default_collection.name}")
         
-        print("Chroma数据库初始化完成！")
-        return chroma_client
+        print("向量存储初始化完成！")
+        return vector_store
     except Exception as e:
-        print(f"初始化Chroma数据库时出错: {e}")
+        print(f"初始化向量存储时出错: {e}")
         print(traceback.format_exc())
         raise
 
@@ -65,8 +65,8 @@ def main():
         # 初始化数据库
         init_database()
         
-        # 初始化Chroma数据库
-        init_chroma_db()
+        # 初始化向量存储
+        init_vector_store()
         
         print("\n所有数据初始化完成！")
         print("您可以通过以下命令启动应用:")
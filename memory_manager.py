@@ -3,8 +3,75 @@ import datetime
 import os
 import threading
 import traceback
+import zlib
+import math
+import json
+from collections import OrderedDict
 from config import Config
 os.environ["ANONYMIZED_TELEMETRY"]="False"
+
+def tenant_key_for(user_id, collection_name):
+    """计算共享集合模式下的租户键：优先使用user_id，缺省时退化为集合名"""
+    return str(user_id) if user_id is not None else str(collection_name)
+
+def shared_collection_name(tenant_key, embedding_dim):
+    """根据租户键计算其所在的共享集合名（按crc32稳定分片）"""
+    shard = zlib.crc32(str(tenant_key).encode("utf-8")) % max(1, Config.SHARED_COLLECTION_COUNT)
+    return f"{Config.SHARED_COLLECTION_PREFIX}_{shard}__d{embedding_dim}"
+
+class SharedTenantCollection:
+    """共享集合中单个租户的视图
+
+    对外提供与VectorCollection相同的add/query/get/update/delete接口，
+    写入时自动附带user_id元数据并为ID加上租户前缀，读取和删除时自动按user_id过滤，
+    因此MemoryManager无需区分两种租户模式。
+    """
+    TENANT_FIELD = "user_id"
+
+    def __init__(self, collection, tenant_key):
+        self.collection = collection
+        self.tenant_key = str(tenant_key)
+        self.name = collection.name
+
+    def _id_prefix(self):
+        return f"u{self.tenant_key}_"
+
+    def _scoped_ids(self, ids):
+        """为ID加上租户前缀；已带前缀的ID（来自本租户的查询结果）保持不变"""
+        if ids is None:
+            return None
+        prefix = self._id_prefix()
+        return [memory_id if memory_id.startswith(prefix) else f"{prefix}{memory_id}" for memory_id in ids]
+
+    def _scoped_where(self, where=None):
+        tenant_filter = {self.TENANT_FIELD: self.tenant_key}
+        if not where:
+            return tenant_filter
+        return {"$and": [tenant_filter, where]}
+
+    def add(self, ids, documents=None, embeddings=None, metadatas=None):
+        scoped_ids = self._scoped_ids(ids)
+        scoped_metadatas = [dict(metadata or {}, **{self.TENANT_FIELD: self.tenant_key}) for metadata in (metadatas or [{} for _ in ids])]
+        return self.collection.add(ids=scoped_ids, documents=documents, embeddings=embeddings, metadatas=scoped_metadatas)
+
+    def query(self, query_embeddings, n_results=10, where=None, **kwargs):
+        return self.collection.query(query_embeddings=query_embeddings, n_results=n_results, where=self._scoped_where(where), **kwargs)
+
+    def get(self, ids=None, where=None, **kwargs):
+        return self.collection.get(ids=self._scoped_ids(ids), where=self._scoped_where(where), **kwargs)
+
+    def update(self, ids, **kwargs):
+        return self.collection.update(ids=self._scoped_ids(ids), **kwargs)
+
+    def delete(self, ids=None, where=None):
+        if ids is not None:
+            return self.collection.delete(ids=self._scoped_ids(ids))
+        return self.collection.delete(where=self._scoped_where(where))
+
+    def count(self):
+        result = self.collection.get(where=self._scoped_where(), include=[])
+        return len(result.get('ids') or [])
+
 class Memory:
     """记忆类"""
     def __init__(self, memory_id, content, timestamp, state, memory_type="conversation", category="general", tags=None, sentiment="neutral", priority="medium", importance=0.5, access_count=0, last_accessed=None):
@@ -55,6 +122,25 @@ class Memory:
         
         return time_since_created > dynamic_expiry_time
         
+    @classmethod
+    def from_metadata(cls, memory_id, content, metadata):
+        """根据向量库中存储的元数据还原记忆对象"""
+        metadata = metadata or {}
+        return cls(
+            memory_id=memory_id,
+            content=content,
+            timestamp=datetime.datetime.fromisoformat(metadata.get('timestamp', datetime.datetime.now().isoformat())).timestamp() if metadata.get('timestamp') else time.time(),
+            state=metadata.get('state', 'idle'),
+            memory_type=metadata.get('memory_type', 'conversation'),
+            category=metadata.get('category', 'general'),
+            tags=metadata.get('tags', "").split(",") if metadata.get('tags') else [],
+            sentiment=metadata.get('sentiment', 'neutral'),
+            priority=metadata.get('priority', 'medium'),
+            importance=metadata.get('importance', 0.5),
+            access_count=metadata.get('access_count', 0),
+            last_accessed=datetime.datetime.fromisoformat(metadata.get('last_accessed', datetime.datetime.now().isoformat())).timestamp() if metadata.get('last_accessed') else time.time()
+        )
+
     def update_access(self):
         """更新记忆的访问信息"""
         self.access_count += 1
@@ -77,40 +163,125 @@ class Memory:
             "last_accessed": self.last_accessed
         }
 
+class SemanticRetrievalCache:
+    """按用户划分的语义检索缓存
+
+    新查询的向量与该用户近期查询的向量余弦相似度达到阈值时，直接复用上次的检索结果，
+    省去一次向量库查询。条目受TTL和容量限制，写入或删除该集合的记忆时整体失效。
+    命中缓存时不会再次更新记忆的访问计数。
+    """
+    def __init__(self, threshold=Config.SEMANTIC_CACHE_THRESHOLD, ttl=Config.SEMANTIC_CACHE_TTL,
+                 size=Config.SEMANTIC_CACHE_SIZE, max_users=Config.SEMANTIC_CACHE_MAX_USERS):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.size = size
+        self.max_users = max_users
+        self._entries = OrderedDict()  # cache_key -> [(created_at, 归一化向量, n_results, 检索结果), ...]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding):
+        norm = math.sqrt(sum(v * v for v in embedding)) or 1.0
+        return [v / norm for v in embedding]
+
+    def get(self, cache_key, embedding, n_results):
+        """查找相似查询的缓存结果，未命中返回None"""
+        query = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            entries = self._entries.get(cache_key)
+            if not entries:
+                return None
+            entries[:] = [entry for entry in entries if now - entry[0] <= self.ttl]
+            best_score, best_result = -1.0, None
+            for _, cached_embedding, cached_n_results, result in entries:
+                if cached_n_results != n_results or len(cached_embedding) != len(query):
+                    continue
+                score = sum(a * b for a, b in zip(query, cached_embedding))
+                if score > best_score:
+                    best_score, best_result = score, result
+            self._entries.move_to_end(cache_key)
+            return best_result if best_score >= self.threshold else None
+
+    def put(self, cache_key, embedding, n_results, result):
+        """缓存一次检索结果"""
+        with self._lock:
+            entries = self._entries.setdefault(cache_key, [])
+            entries.append((time.time(), self._normalize(embedding), n_results, result))
+            del entries[:-self.size]
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, cache_key):
+        """集合内容变化时清除该用户的全部缓存"""
+        with self._lock:
+            self._entries.pop(cache_key, None)
+
+# 全局共享的检索缓存，保证临时创建的MemoryManager写入记忆时也能使缓存失效
+retrieval_cache = SemanticRetrievalCache()
+
+# 档案读改写需要跨MemoryManager实例串行化
+_profile_lock = threading.Lock()
+
+# 配额检查的写入计数，同样需要跨MemoryManager实例共享；按最近写入排序，数量受 MEMORY_QUOTA_COUNTERS_MAX 限制
+_quota_write_counters = OrderedDict()
+_quota_counters_lock = threading.Lock()
+
+# 嵌入模型的向量维度，每个模型只探测一次（每次请求都会新建或切换MemoryManager）
+_embedding_dims = {}
+
 class MemoryManager:
     """记忆管理器"""
-    def __init__(self, chroma_client, embedding_model, collection_name=None):
-        self.chroma_client = chroma_client
+    USER_PROFILE_ID = "user_profile"  # 每个用户集合中唯一的档案记忆ID
+    def __init__(self, vector_store, embedding_model, collection_name=None, user_id=None):
+        self.vector_store = vector_store
         self.embedding_model = embedding_model
         self.collection_name = collection_name
+        self.user_id = user_id
         self.embedding_dim = self._get_embedding_dim()
         self.collection = self._get_or_create_collection()
         self.memory_lock = threading.Lock()  # 添加线程锁，确保并发安全
     
     def _get_embedding_dim(self):
+        if not self.embedding_model:
+            return 256
+        dim = _embedding_dims.get(id(self.embedding_model))
+        if dim is not None:
+            return dim
         try:
-            if self.embedding_model and hasattr(self.embedding_model, 'get_sentence_embedding_dimension'):
-                return int(self.embedding_model.get_sentence_embedding_dimension())
-            if self.embedding_model:
-                return len(self.embedding_model.encode('test'))
+            if hasattr(self.embedding_model, 'get_sentence_embedding_dimension'):
+                dim = int(self.embedding_model.get_sentence_embedding_dimension())
+            else:
+                dim = len(self.embedding_model.encode('test'))
         except Exception:
-            pass
-        return 256
+            return 256
+        _embedding_dims[id(self.embedding_model)] = dim
+        return dim
 
     def _get_or_create_collection(self):
-        """获取或创建Chroma集合"""
+        """获取或创建向量集合；shared模式下返回共享集合中当前用户的视图"""
         if self.collection_name:
+            if Config.MEMORY_TENANCY_MODE == "shared":
+                tenant_key = tenant_key_for(self.user_id, self.collection_name)
+                shared_name = shared_collection_name(tenant_key, self.embedding_dim)
+                return SharedTenantCollection(self.vector_store.get_or_create_collection(name=shared_name), tenant_key)
             actual_name = f"{self.collection_name}__d{self.embedding_dim}"
-            return self.chroma_client.get_or_create_collection(name=actual_name)
+            return self.vector_store.get_or_create_collection(name=actual_name)
         return None
     
-    def set_collection_by_name(self, collection_name):
-        """根据名称设置当前集合"""
+    def set_collection_by_name(self, collection_name, user_id=None):
+        """根据名称设置当前集合，shared模式下需同时提供user_id作为租户键"""
         with self.memory_lock:
             self.collection_name = collection_name
+            self.user_id = user_id
             self.embedding_dim = self._get_embedding_dim()
             self.collection = self._get_or_create_collection()
 
+    def _cache_key(self):
+        """语义检索缓存的键：每个用户集合独立"""
+        return f"{self.collection_name}|{self.user_id}|d{self.embedding_dim}"
+
     def _encode_text(self, text):
         """将文本编码为向量；当嵌入模型不可用时使用哈希降级方案"""
         if self.embedding_model:
@@ -125,6 +296,12 @@ class MemoryManager:
             vec[h] += 1.0
         norm = math.sqrt(sum(v*v for v in vec)) or 1.0
         return [v / norm for v in vec]
+
+    def encode(self, text, context=None):
+        """编码文本；传入本轮的TurnContext时同一文本在本轮只编码一次，并计入本轮的编码统计"""
+        if context is None:
+            return self._encode_text(text)
+        return context.embed(text, self._encode_text)
     
     def _generate_tags_from_content(self, user_msg, assistant_msg, state):
         """从对话内容中生成标签"""
@@ -152,8 +329,8 @@ class MemoryManager:
         # 去重
         return list(set(tags))
     
-    def add_memory(self, user_msg, assistant_msg, state, memory_type="conversation", category="general", tags=None, sentiment="neutral", priority="medium", importance=0.5):
-        """添加聊天记忆到向量数据库"""
+    def add_memory(self, user_msg, assistant_msg, state, memory_type="conversation", category="general", tags=None, sentiment="neutral", priority="medium", importance=0.5, context=None):
+        """添加聊天记忆到向量数据库，context为本轮对话的TurnContext（可选）"""
         if not self.collection:
             print("未设置记忆集合，无法添加记忆")
             return
@@ -169,7 +346,7 @@ class MemoryManager:
             priority_str = str(priority) if priority is not None else "medium"
             
             memory_content = f"用户: {user_msg_str}\n智子: {assistant_msg_str}\n状态: {state_str}"
-            embedding = self._encode_text(memory_content)
+            embedding = self.encode(memory_content, context)
             memory_id = f"memory_{datetime.datetime.now().timestamp()}"
             current_time = time.time()
             
@@ -204,54 +381,52 @@ class MemoryManager:
                     "last_accessed": datetime.datetime.fromtimestamp(current_time).isoformat()
                 }]
             )
+            retrieval_cache.invalidate(self._cache_key())
+            self._enforce_quota(memory_type_str, state_str)
             print(f"已存储记忆: {user_msg_str} -> {assistant_msg_str}...")
 
-    def retrieve_relevant_memories(self, query, n_results=Config.RELEVANT_MEMORIES_COUNT):
-        """检索与当前查询相关的记忆"""
+    def retrieve_relevant_memories(self, query, n_results=Config.RELEVANT_MEMORIES_COUNT, context=None):
+        """检索与当前查询相关的记忆，context为本轮对话的TurnContext（已编码过的查询直接复用向量）"""
         if not self.collection:
             return {"documents": [[]], "metadatas": [[]]}
         
         with self.memory_lock:  # 加锁保护，确保并发安全
-            query_embedding = self._encode_text(query)
-            results = self.collection.query(query_embeddings=[query_embedding], n_results=n_results)
+            query_embedding = self.encode(query, context)
+            if Config.SEMANTIC_CACHE_ENABLED:
+                cached = retrieval_cache.get(self._cache_key(), query_embedding, n_results)
+                if cached is not None:
+                    return cached
+            # 用户档案直接写入提示词，不参与向量检索
+            results = self.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=n_results,
+                where={"memory_type": {"$ne": "user_profile"}}
+            )
             
             # 处理检索结果，更新访问计数并优化记忆拼接
             if results and results.get('ids') and results['ids']:
                 updated_memories = []
+                access_updates = []
                 for i, memory_id in enumerate(results['ids'][0]):
                     metadata = results['metadatas'][0][i] if results.get('metadatas') and results['metadatas'] else {}
                     content = results['documents'][0][i] if results.get('documents') and results['documents'] else ""
                     
                     # 创建记忆对象并更新访问信息
-                    memory = Memory(
-                        memory_id=memory_id,
-                        content=content,
-                        timestamp=datetime.datetime.fromisoformat(metadata.get('timestamp', datetime.datetime.now().isoformat())).timestamp() if metadata.get('timestamp') else time.time(),
-                        state=metadata.get('state', 'idle'),
-                        memory_type=metadata.get('memory_type', 'conversation'),
-                        category=metadata.get('category', 'general'),
-                        tags=metadata.get('tags', "").split(",") if metadata.get('tags') else [],
-                        sentiment=metadata.get('sentiment', 'neutral'),
-                        priority=metadata.get('priority', 'medium'),
-                        importance=metadata.get('importance', 0.5),
-                        access_count=metadata.get('access_count', 0),
-                        last_accessed=datetime.datetime.fromisoformat(metadata.get('last_accessed', datetime.datetime.now().isoformat())).timestamp() if metadata.get('last_accessed') else time.time()
-                    )
+                    memory = Memory.from_metadata(memory_id, content, metadata)
                     
                     # 更新访问信息
                     memory.update_access()
-                    
-                    # 更新到数据库
-                    self.collection.update(
-                        ids=[memory_id],
-                        metadatas=[{
-                            "access_count": memory.access_count,
-                            "last_accessed": datetime.datetime.fromtimestamp(memory.last_accessed).isoformat()
-                        }]
-                    )
+                    access_updates.append({
+                        "access_count": memory.access_count,
+                        "last_accessed": datetime.datetime.fromtimestamp(memory.last_accessed).isoformat()
+                    })
                     
                     updated_memories.append((memory, results['distances'][0][i] if results.get('distances') and results['distances'] else 0))
                 
+                # 所有命中记忆的访问信息一次写回数据库
+                if access_updates:
+                    self.collection.update(ids=list(results['ids'][0]), metadatas=access_updates)
+                
                 # 基于相关性、优先级和重要性重新排序记忆
                 updated_memories.sort(key=lambda x: (x[1], -{
                     "high": 3,
@@ -280,15 +455,17 @@ class MemoryManager:
                     "distances": [[memory[1] for memory in updated_memories]]
                 }
                 
+                if Config.SEMANTIC_CACHE_ENABLED:
+                    retrieval_cache.put(self._cache_key(), query_embedding, n_results, sorted_results)
                 return sorted_results
             
             return results
     
-    def check_memory_relevance(self, memory, current_state):
-        """检查记忆是否仍然相关"""
+    def score_memory(self, memory, current_state):
+        """计算记忆的综合相关性得分，已过期的记忆得分为负无穷"""
         # 1. 检查记忆是否过期
         if memory.is_expired():
-            return False  # 记忆已过期
+            return float('-inf')  # 记忆已过期
 
         # 2. 基于优先级的保留策略：高优先级记忆更容易保留
         priority_weight = Config.PRIORITY_WEIGHTS[memory.priority]
@@ -322,10 +499,52 @@ class MemoryManager:
                      state_relevance * Config.STATE_RELEVANCE_WEIGHT)
         
         # 应用情感和类型调整
-        relevance_score = base_score * sentiment_adjustment * type_weight
-        
-        # 9. 基于阈值的判断
-        return relevance_score > Config.MEMORY_RELEVANCE_THRESHOLD  # 相关性得分超过阈值则保留记忆
+        return base_score * sentiment_adjustment * type_weight
+
+    def check_memory_relevance(self, memory, current_state):
+        """检查记忆是否仍然相关"""
+        # 基于阈值的判断：相关性得分超过阈值则保留记忆
+        return self.score_memory(memory, current_state) > Config.MEMORY_RELEVANCE_THRESHOLD
+
+    def _enforce_quota(self, memory_type, current_state):
+        """写入后检查该类型记忆是否超出配额，超出时批量淘汰得分最低的记忆
+
+        每个集合每写入 MEMORY_QUOTA_CHECK_INTERVAL 条才真正计数一次，超额时一次淘汰到
+        quota * (1 - MEMORY_QUOTA_EVICTION_RATIO)，使计数和删除的开销摊销到多次写入上。
+        调用方需持有memory_lock。
+        """
+        quota = Config.MEMORY_TYPE_CONFIG.get(memory_type, {}).get("quota")
+        if not Config.MEMORY_QUOTA_ENABLED or not quota:
+            return
+        with _quota_counters_lock:
+            counter_key = (self._cache_key(), memory_type)
+            writes = _quota_write_counters.get(counter_key, 0) + 1
+            _quota_write_counters[counter_key] = writes if writes < Config.MEMORY_QUOTA_CHECK_INTERVAL else 0
+            _quota_write_counters.move_to_end(counter_key)
+            while len(_quota_write_counters) > Config.MEMORY_QUOTA_COUNTERS_MAX:
+                _quota_write_counters.popitem(last=False)
+            if writes < Config.MEMORY_QUOTA_CHECK_INTERVAL:
+                return
+
+        existing = self.collection.get(where={"memory_type": memory_type}, include=["metadatas", "documents"])
+        ids = existing.get('ids') or []
+        if len(ids) <= quota:
+            return
+        target = int(quota * (1 - Config.MEMORY_QUOTA_EVICTION_RATIO))
+        scored = []
+        for i, memory_id in enumerate(ids):
+            memory = Memory.from_metadata(
+                memory_id,
+                existing['documents'][i] if existing.get('documents') else "",
+                existing['metadatas'][i] if existing.get('metadatas') else {}
+            )
+            scored.append((self.score_memory(memory, current_state), memory.timestamp, memory_id))
+        # 得分相同时优先淘汰更旧的记忆
+        scored.sort()
+        evicted_ids = [memory_id for _, _, memory_id in scored[:len(ids) - target]]
+        self.collection.delete(ids=evicted_ids)
+        retrieval_cache.invalidate(self._cache_key())
+        print(f"记忆类型 {memory_type} 超出配额 {quota}，已淘汰 {len(evicted_ids)} 条记忆")
     
     def clean_up_memory(self, current_state=Config.DEFAULT_CLEANUP_STATE):
         """定期清理不相关或过期的记忆"""
@@ -338,24 +557,19 @@ class MemoryManager:
                 if all_memories and all_memories.get('ids'):
                     for i, memory_id in enumerate(all_memories['ids']):
                         metadata = all_memories['metadatas'][i] if all_memories.get('metadatas') else {}
+                        # 用户档案由增量更新维护，不参与相关性清理
+                        if metadata.get('memory_type') == 'user_profile':
+                            continue
                         # 创建临时内存对象用于检查
-                        temp_memory = Memory(
-                            memory_id=memory_id,
-                            content=all_memories['documents'][i] if all_memories.get('documents') else "",
-                            timestamp=datetime.datetime.fromisoformat(metadata.get('timestamp', datetime.datetime.now().isoformat())).timestamp() if metadata.get('timestamp') else time.time(),
-                            state=metadata.get('state', 'idle'),
-                            memory_type=metadata.get('memory_type', 'conversation'),
-                            category=metadata.get('category', 'general'),
-                            tags=metadata.get('tags', "").split(",") if metadata.get('tags') else [],
-                            sentiment=metadata.get('sentiment', 'neutral'),
-                            priority=metadata.get('priority', 'medium'),
-                            importance=metadata.get('importance', 0.5),
-                            access_count=metadata.get('access_count', 0),
-                            last_accessed=datetime.datetime.fromisoformat(metadata.get('last_accessed', datetime.datetime.now().isoformat())).timestamp() if metadata.get('last_accessed') else time.time()
+                        temp_memory = Memory.from_metadata(
+                            memory_id,
+                            all_memories['documents'][i] if all_memories.get('documents') else "",
+                            metadata
                         )
                         
                         if not self.check_memory_relevance(temp_memory, current_state):
                             self.collection.delete(ids=[memory_id])
+                            retrieval_cache.invalidate(self._cache_key())
                             print(f"删除记忆: {memory_id}")
             except Exception as e:
                 print(f"清理记忆时出错: {e}")
@@ -374,6 +588,7 @@ class MemoryManager:
                 if all_memories and all_memories.get('ids'):
                     # 批量删除所有记忆
                     self.collection.delete(ids=all_memories['ids'])
+                    retrieval_cache.invalidate(self._cache_key())
                     print(f"已清空所有记忆，共删除 {len(all_memories['ids'])} 条记录")
                 else:
                     print("记忆集合为空，无需清空")
@@ -381,6 +596,78 @@ class MemoryManager:
                 print(f"清空记忆时出错: {e}")
                 print(traceback.format_exc())
 
+    def _load_user_profile(self):
+        """读取档案记录，返回 (档案文本, 待合并的总结列表)；调用方需持有memory_lock"""
+        result = self.collection.get(ids=[self.USER_PROFILE_ID], include=["documents", "metadatas"])
+        if not result or not result.get('ids'):
+            return "", []
+        metadata = result['metadatas'][0] if result.get('metadatas') else {}
+        try:
+            pending = json.loads(metadata.get('pending_summaries') or "[]")
+        except (TypeError, ValueError):
+            pending = []
+        return (result['documents'][0] if result.get('documents') else "") or "", pending
+
+    def _write_user_profile(self, profile, pending):
+        """写入档案记录（不存在时创建）；调用方需持有memory_lock"""
+        now = datetime.datetime.now().isoformat()
+        metadata = {
+            "timestamp": now,
+            "state": "idle",
+            "memory_type": "user_profile",
+            "category": "personal",
+            "priority": "high",
+            "importance": 1.0,
+            "access_count": 0,
+            "last_accessed": now,
+            "pending_summaries": json.dumps(pending, ensure_ascii=False)
+        }
+        # 档案不参与向量检索（检索时按memory_type排除），只存放固定的单位向量，写入时不调用嵌入模型
+        existing = self.collection.get(ids=[self.USER_PROFILE_ID], include=["documents"])
+        if not existing.get('ids'):
+            self.collection.add(ids=[self.USER_PROFILE_ID], documents=[profile], embeddings=[self._profile_embedding()], metadatas=[metadata])
+        elif (existing.get('documents') or [""])[0] == profile:
+            # 档案文本未变（只记录待合并的总结），只更新元数据
+            self.collection.update(ids=[self.USER_PROFILE_ID], metadatas=[metadata])
+        else:
+            self.collection.update(ids=[self.USER_PROFILE_ID], documents=[profile], embeddings=[self._profile_embedding()], metadatas=[metadata])
+
+    def _profile_embedding(self):
+        return [1.0] + [0.0] * (self.embedding_dim - 1)
+
+    def get_user_profile(self):
+        """获取当前用户的档案文本，按ID直接读取，无需向量检索"""
+        if not self.collection:
+            return ""
+        with self.memory_lock:
+            profile, _ = self._load_user_profile()
+            return profile
+
+    def add_profile_summary(self, summary):
+        """记录一条新的对话总结，累积满 USER_PROFILE_UPDATE_BATCH 条时取出并返回待合并的总结，否则返回None"""
+        if not self.collection or not summary:
+            return None
+        with _profile_lock:
+            with self.memory_lock:
+                profile, pending = self._load_user_profile()
+                pending.append(str(summary))
+                if len(pending) < Config.USER_PROFILE_UPDATE_BATCH:
+                    self._write_user_profile(profile, pending)
+                    return None
+                # 取出待合并的总结并清空，避免并发的后台任务重复合并
+                self._write_user_profile(profile, [])
+                return pending
+
+    def save_user_profile(self, profile):
+        """保存增量合并后的档案，保留合并期间新累积的总结"""
+        if not self.collection:
+            return
+        with _profile_lock:
+            with self.memory_lock:
+                _, pending = self._load_user_profile()
+                self._write_user_profile(profile[:Config.USER_PROFILE_MAX_CHARS], pending)
+                print(f"已更新用户档案: {profile[:Config.USER_PROFILE_MAX_CHARS]}")
+
     def has_any_memory(self):
         """检查当前集合是否有任何记忆"""
         if not self.collection:
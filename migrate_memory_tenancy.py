@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+记忆租户模式迁移脚本，在 per_user（每用户独立集合）与 shared（共享集合按user_id过滤）两种布局之间迁移记忆
+"""
+
+import sys
+import argparse
+import traceback
+from config import Config
+from database import get_db, MemoryCollection
+from memory_manager import SharedTenantCollection, shared_collection_name, tenant_key_for
+from vector_store import create_vector_store
+
+def _list_collection_names(vector_store):
+    """列出向量存储中已存在的全部集合名"""
+    return set(vector_store.list_collections())
+
+def _find_per_user_collections(existing_names, collection_name):
+    """查找某个用户在per_user模式下的全部集合（不同嵌入维度各一个）"""
+    prefix = f"{collection_name}__d"
+    return sorted(name for name in existing_names if name.startswith(prefix) and name[len(prefix):].isdigit())
+
+def _iter_pages(collection, batch_size):
+    """分页读取集合中的全部记录，避免一次性载入内存"""
+    offset = 0
+    while True:
+        page = collection.get(limit=batch_size, offset=offset, include=["documents", "metadatas", "embeddings"])
+        ids = page.get('ids') or []
+        if not ids:
+            break
+        yield page
+        offset += len(ids)
+
+def _strip_tenant_fields(page, tenant_key):
+    """去掉shared模式附加的ID前缀与user_id元数据，还原per_user模式下的记录"""
+    prefix = f"u{tenant_key}_"
+    ids = [memory_id[len(prefix):] if memory_id.startswith(prefix) else memory_id for memory_id in page['ids']]
+    metadatas = []
+    for metadata in page['metadatas']:
+        metadata = dict(metadata or {})
+        metadata.pop(SharedTenantCollection.TENANT_FIELD, None)
+        metadatas.append(metadata)
+    return ids, metadatas
+
+def migrate_to_shared(vector_store, tenants, batch_size, delete_source, dry_run):
+    """per_user -> shared"""
+    existing_names = _list_collection_names(vector_store)
+    migrated = 0
+    for user_id, collection_name in tenants:
+        tenant_key = tenant_key_for(user_id, collection_name)
+        for source_name in _find_per_user_collections(existing_names, collection_name):
+            embedding_dim = int(source_name.rsplit("__d", 1)[1])
+            target_name = shared_collection_name(tenant_key, embedding_dim)
+            source = vector_store.get_collection(name=source_name)
+            target = None if dry_run else SharedTenantCollection(vector_store.get_or_create_collection(name=target_name), tenant_key)
+            count = 0
+            for page in _iter_pages(source, batch_size):
+                count += len(page['ids'])
+                if target is not None:
+                    target.add(ids=page['ids'], documents=page['documents'], embeddings=page['embeddings'], metadatas=page['metadatas'])
+            print(f"{source_name} -> {target_name}: {count} 条记忆")
+            migrated += count
+            if delete_source and not dry_run:
+                vector_store.delete_collection(name=source_name)
+    return migrated
+
+def migrate_to_per_user(vector_store, tenants, batch_size, delete_source, dry_run):
+    """shared -> per_user"""
+    prefix = f"{Config.SHARED_COLLECTION_PREFIX}_"
+    shared_names = sorted(name for name in _list_collection_names(vector_store) if name.startswith(prefix) and "__d" in name)
+    migrated = 0
+    for user_id, collection_name in tenants:
+        tenant_key = tenant_key_for(user_id, collection_name)
+        for shared_name in shared_names:
+            embedding_dim = int(shared_name.rsplit("__d", 1)[1])
+            if shared_collection_name(tenant_key, embedding_dim) != shared_name:
+                continue
+            source = SharedTenantCollection(vector_store.get_collection(name=shared_name), tenant_key)
+            target_name = f"{collection_name}__d{embedding_dim}"
+            target = None if dry_run else vector_store.get_or_create_collection(name=target_name)
+            count = 0
+            for page in _iter_pages(source, batch_size):
+                ids, metadatas = _strip_tenant_fields(page, tenant_key)
+                count += len(ids)
+                if target is not None:
+                    target.add(ids=ids, documents=page['documents'], embeddings=page['embeddings'], metadatas=metadatas)
+            print(f"{shared_name} -> {target_name}: {count} 条记忆")
+            migrated += count
+            if delete_source and not dry_run and count:
+                source.delete(where={})
+    return migrated
+
+def load_tenants():
+    """从数据库读取全部 (user_id, collection_name) 映射"""
+    db = next(get_db())
+    try:
+        return [(row.user_id, row.collection_name) for row in db.query(MemoryCollection).order_by(MemoryCollection.user_id).all()]
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="在per_user与shared两种记忆租户模式之间迁移记忆")
+    parser.add_argument("--to", choices=["shared", "per_user"], required=True, help="目标租户模式")
+    parser.add_argument("--batch-size", type=int, default=500, help="每批读取的记忆条数，默认500")
+    parser.add_argument("--delete-source", action="store_true", help="迁移完成后删除源数据")
+    parser.add_argument("--dry-run", action="store_true", help="只统计不写入")
+    parser.add_argument("--backend", choices=["chroma", "numpy"], default=Config.VECTOR_STORE_BACKEND, help="向量存储后端，默认取Config.VECTOR_STORE_BACKEND")
+    parser.add_argument("--persist-dir", default=None, help="向量存储持久化目录，默认取对应后端的配置")
+    args = parser.parse_args()
+
+    try:
+        vector_store = create_vector_store(args.backend, args.persist_dir)
+        tenants = load_tenants()
+        print(f"共 {len(tenants)} 个用户记忆集合，迁移目标: {args.to}")
+        migrate = migrate_to_shared if args.to == "shared" else migrate_to_per_user
+        total = migrate(vector_store, tenants, args.batch_size, args.delete_source, args.dry_run)
+        print(f"迁移完成，共 {total} 条记忆")
+        print(f"请将 Config.MEMORY_TENANCY_MODE 设置为 \"{args.to}\" 后重启服务")
+    except Exception as e:
+        print(f"迁移失败: {e}")
+        print(traceback.format_exc())
+        sys.exit(1)
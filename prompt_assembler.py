@@ -0,0 +1,156 @@
+"""
+按token预算组装聊天提示词
+
+提示词中的角色设定、模式覆盖层、工具说明、当前对话等是必需部分，用户档案和相关记忆是可伸缩部分。
+先计算必需部分的token数，剩余空间（OLLAMA_NUM_CTX 减去为输出预留的部分）再按段分配给档案和记忆：
+- 档案超出 PROMPT_PROFILE_MAX_TOKENS 时截断
+- 记忆按检索排名依次放入，放不下的那条截断到剩余预算（不足 PROMPT_MEMORY_MIN_TOKENS 时丢弃），其后排名更低的全部丢弃
+每次组装返回各段token数报告，提示词长度可控，预填充耗时也就可预期。
+
+token计数优先使用 PROMPT_TOKENIZER_PATH 指向的对话模型 tokenizer.json（需要 tokenizers 库）；
+文件不存在时按字符估算：每个中日韩字符/全角符号计2/3个token（常见中文词表约1.5字一个token），
+连续字母数字每4个字符计1个，连续空白每8个字符计1个，其余符号各计1个。
+"""
+
+import os
+import re
+from config import Config
+
+_JOIN_SLACK = 4  # 各段拼接处空白合并等造成的计数误差
+_CJK_CHARS = r"\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef"
+_ESTIMATE_PATTERN = re.compile(rf"([{_CJK_CHARS}])|([A-Za-z0-9_]+)|([^\S{_CJK_CHARS}]+)|(.)", re.S)
+_CJK_PATTERN = re.compile(rf"[{_CJK_CHARS}]")
+_WORD_PATTERN = re.compile(r"[A-Za-z0-9_]+")
+_SPACE_PATTERN = re.compile(rf"[^\S{_CJK_CHARS}]+")  # 全角空格按中日韩字符计
+
+class TokenCounter:
+    """本地token计数：有tokenizer.json时精确计数，否则按字符估算"""
+    def __init__(self, tokenizer_path=Config.PROMPT_TOKENIZER_PATH):
+        self.tokenizer = None
+        if tokenizer_path and os.path.exists(tokenizer_path):
+            try:
+                from tokenizers import Tokenizer
+                self.tokenizer = Tokenizer.from_file(tokenizer_path)
+            except Exception as e:
+                print(f"加载tokenizer失败，改为按字符估算token数: {e}")
+        self.mode = "tokenizer" if self.tokenizer else "estimate"
+
+    @staticmethod
+    def _estimate_costs(text):
+        """产出 (片段结束位置, 累计token数)，内部以1/3个token为单位累计"""
+        thirds = 0
+        for match in _ESTIMATE_PATTERN.finditer(text):
+            if match.group(1):
+                thirds += 2
+            elif match.group(2):
+                thirds += 3 * ((len(match.group(2)) + 3) // 4)
+            elif match.group(3):
+                thirds += 3 * ((len(match.group(3)) + 7) // 8)
+            else:
+                thirds += 3
+            yield match.end(), (thirds + 2) // 3
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self.tokenizer:
+            return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+        # 与 _estimate_costs 的规则相同，按类别整体统计，避免逐段循环
+        cjk = len(_CJK_PATTERN.findall(text))
+        words = _WORD_PATTERN.findall(text)
+        spaces = _SPACE_PATTERN.findall(text)
+        others = len(text) - cjk - sum(map(len, words)) - sum(map(len, spaces))
+        thirds = 2 * cjk + 3 * (sum((len(word) + 3) // 4 for word in words)
+                                + sum((len(space) + 7) // 8 for space in spaces) + others)
+        return (thirds + 2) // 3
+
+    def truncate(self, text, max_tokens):
+        """截断到不超过 max_tokens 个token，被截断时末尾加“…”"""
+        if max_tokens <= 0:
+            return ""
+        if self.tokenizer:
+            encoding = self.tokenizer.encode(text, add_special_tokens=False)
+            if len(encoding.ids) <= max_tokens:
+                return text
+            return text[:encoding.offsets[max_tokens - 1][1]] + "…"
+        end = 0
+        for position, total in self._estimate_costs(text):
+            if total > max_tokens - 1:  # 为“…”留一个token
+                return text[:end] + "…"
+            end = position
+        return text
+
+class PromptBudget:
+    """为档案和记忆分配token预算"""
+    def __init__(self, counter=None, num_ctx=Config.OLLAMA_NUM_CTX, reserve=Config.PROMPT_RESPONSE_RESERVE_TOKENS,
+                 profile_max=Config.PROMPT_PROFILE_MAX_TOKENS, memory_max=Config.PROMPT_MEMORY_MAX_TOKENS,
+                 memory_min=Config.PROMPT_MEMORY_MIN_TOKENS):
+        self.counter = counter or TokenCounter()
+        self.num_ctx = num_ctx
+        self.reserve = reserve
+        self.profile_max = profile_max
+        self.memory_max = memory_max
+        self.memory_min = memory_min
+
+    def fit(self, base_prompt, profile, memories, profile_header="", memory_header=""):
+        """
+        base_prompt 为不含档案和记忆的提示词，memories 按检索排名从高到低排列
+        返回 (档案文本, 保留的记忆列表, 报告)；报告中各段token数在组装后由 finish 补全总数
+        """
+        count = self.counter.count
+        base_tokens = count(base_prompt)
+        available = max(0, self.num_ctx - self.reserve - base_tokens - _JOIN_SLACK)
+
+        profile_tokens = 0
+        profile_trimmed = False
+        if profile:
+            budget = min(self.profile_max, available) - count(profile_header)
+            fitted = self.counter.truncate(profile, budget) if budget > 0 else ""
+            profile_trimmed = fitted != profile
+            profile = fitted
+            profile_tokens = count(profile_header) + count(profile) if profile else 0
+        available -= profile_tokens
+
+        kept, trimmed, dropped = [], 0, 0
+        memory_tokens = 0
+        remaining = min(self.memory_max, available) - count(memory_header)
+        for memory in memories:
+            tokens = count(memory) + 1  # 换行
+            if tokens <= remaining:
+                kept.append(memory)
+                remaining -= tokens
+                memory_tokens += tokens
+                continue
+            if remaining - 1 >= self.memory_min:
+                memory = self.counter.truncate(memory, remaining - 1)
+                kept.append(memory)
+                memory_tokens += count(memory) + 1
+                trimmed = 1
+            dropped = len(memories) - len(kept)
+            break
+        if kept:
+            memory_tokens += count(memory_header)
+
+        report = {
+            "base": base_tokens,
+            "profile": profile_tokens,
+            "memories": memory_tokens,
+            "memories_kept": len(kept),
+            "memories_trimmed": trimmed,
+            "memories_dropped": dropped,
+            "profile_trimmed": profile_trimmed,
+            "num_ctx": self.num_ctx,
+            "reserve": self.reserve,
+            "counter": self.counter.mode,
+        }
+        return profile, kept, report
+
+    def finish(self, prompt, report):
+        """记录组装后提示词的总token数并打印报告，超出窗口时给出警告"""
+        report["total"] = self.counter.count(prompt)
+        print(f"提示词token: 共 {report['total']}（基础 {report['base']}，档案 {report['profile']}，记忆 {report['memories']}），"
+              f"记忆保留 {report['memories_kept']} 条、截断 {report['memories_trimmed']} 条、丢弃 {report['memories_dropped']} 条，"
+              f"窗口 {report['num_ctx']}，预留输出 {report['reserve']}，计数方式 {report['counter']}")
+        if report["total"] > self.num_ctx - self.reserve:
+            print(f"警告: 提示词token数 {report['total']} 超过可用窗口 {self.num_ctx - self.reserve}（必需部分已超出预算）")
+        return report
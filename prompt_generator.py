@@ -5,8 +5,9 @@ import os
 if not os.path.abspath(os.path.join(os.path.dirname(__file__), 'emotion_state_serv')) in sys.path:
     sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), 'emotion_state_serv')))
 
-from character_card import persona_text
+from persona_variants import persona_for
 from config import Config
+from prompt_assembler import PromptBudget
 
 class PromptGenerator:
     """提示词生成器"""
@@ -14,32 +15,25 @@ class PromptGenerator:
     def __init__(self, emotional_machine, memory_manager):
         self.emotional_machine = emotional_machine
         self.memory_manager = memory_manager
+        self.prompt_budget = PromptBudget()
     
-    def generate_chat_prompt(self, user_msg, state):
-        """生成带有角色设定和当前状态的聊天提示"""
-        full_persona = persona_text()
+    def generate_chat_prompt(self, user_msg, state, context=None):
+        """生成带有角色设定和当前状态的聊天提示，context为本轮对话的TurnContext（复用已算出的消息向量）"""
+        # 各状态的角色设定在加载角色卡时已预先生成（学者模式下已过滤宅属性相关内容）
+        filtered_persona = persona_for(state)
         state_info = self.emotional_machine.get_state_description(state)
         
-        # 根据当前状态过滤角色设定内容
-        filtered_persona = full_persona
+        # 用户档案按ID直接读取；有档案时稳定信息已覆盖，可少检索几条原始记忆
+        user_profile = self.memory_manager.get_user_profile()
+        n_results = Config.RELEVANT_MEMORIES_COUNT_WITH_PROFILE if user_profile else Config.RELEVANT_MEMORIES_COUNT
+        relevant_memories = self.memory_manager.retrieve_relevant_memories(user_msg, n_results=n_results, context=context)
         
-        # 在学者模式下，过滤掉与机甲/蜂黄泉相关的内容
-        if state in ['S2', 'explain']:
-            filtered_persona = full_persona.replace('- 对限定玩具 / 机甲极度狂热，尤其是「蜂黄泉」。', '')
-            filtered_persona = filtered_persona.replace('- 为了买限定玩具会忍辱点儿童套餐并喊羞耻台词。', '')
-            filtered_persona = filtered_persona.replace('S5：宅女模式（机甲狂热）\n    - 听到机甲 / 蜂黄泉 / 限定玩具立刻兴奋。\n    - 强行安利模型给用户。', '')
-            filtered_persona = filtered_persona.replace('② 学者面：成熟、专业、冷静、逻辑严密。\n    - 工作模式下像一位经验老练的研究员。\n    - 能清晰解释复杂物理、AI、量子理论。\n    - 做过大量高强度计算，偶尔会「脑袋过热」。', '② 学者面：成熟、专业、冷静、逻辑严密。\n    - 工作模式下像一位经验老练的研究员。\n    - 能清晰解释复杂物理、AI、量子理论。\n    - 做过大量高强度计算，偶尔会「脑袋过热」。\n    - 专注于学术问题，不会提及与学术无关的个人爱好。')
-        
-        relevant_memories = self.memory_manager.retrieve_relevant_memories(user_msg)
-        
-        memory_context = ""
+        memories = []  # 按检索排名从高到低
         if relevant_memories and relevant_memories['documents']:
             food_keywords = ["三明治","早餐","午餐","晚餐","吃","饿","奶茶","面包","汉堡","披萨","饮料"]
             user_wants_food = any(k in user_msg for k in food_keywords)
-            memory_context = "【以下是与当前对话相关的历史记忆】\n"
-            for memory in relevant_memories['documents'][0]:
-                if user_wants_food or not any(k in memory for k in food_keywords):
-                    memory_context += f"{memory}\n"
+            memories = [memory for memory in relevant_memories['documents'][0]
+                        if user_wants_food or not any(k in memory for k in food_keywords)]
         
         # 可用工具信息
         tools_info = """
@@ -86,13 +80,15 @@ class PromptGenerator:
 - 优先围绕用户当前话题展开，不要跳题到吃喝。
 """
 
-        prompt = f"""
+        def render(profile_context, memory_context):
+            return f"""
         {filtered_persona}
         {state_overlay}
         {bias_overlay}
         【当前状态：{state}】
         {state_info}
         
+        {profile_context}
         {memory_context}
         
         {tools_info}
@@ -107,17 +103,20 @@ class PromptGenerator:
         5. 当需要获取时间时，必须调用getCurrentTime工具
         智子："""
         
+        # 先计算不含档案和记忆的提示词，再按剩余token预算放入档案和排名靠前的记忆
+        profile_header, memory_header = "【哥哥的档案】\n", "【以下是与当前对话相关的历史记忆】\n"
+        user_profile, memories, report = self.prompt_budget.fit(render("", ""), user_profile, memories, profile_header, memory_header)
+        profile_context = f"{profile_header}{user_profile}\n" if user_profile else ""
+        memory_context = memory_header + "".join(f"{memory}\n" for memory in memories) if memories else ""
+        prompt = render(profile_context, memory_context)
+        self.prompt_budget.finish(prompt, report)
+        if context is not None:
+            context.prompt_tokens = report
         return prompt
 
     def generate_initial_prompt(self, state):
-        full_persona = persona_text()
+        filtered_persona = persona_for(state)
         state_info = self.emotional_machine.get_state_description(state)
-        filtered_persona = full_persona
-        if state in ['S2', 'explain']:
-            filtered_persona = full_persona.replace('- 对限定玩具 / 机甲极度狂热。', '')
-            filtered_persona = filtered_persona.replace('- 为了买限定玩具会忍辱点儿童套餐并喊羞耻台词。', '')
-            filtered_persona = filtered_persona.replace('S5：宅女模式（机甲狂热）\n    - 听到机甲 /  / 限定玩具立刻兴奋。\n    - 强行安利模型给用户。', '')
-            filtered_persona = filtered_persona.replace('② 学者面：成熟、专业、冷静、逻辑严密。\n    - 工作模式下像一位经验老练的研究员。\n    - 能清晰解释复杂物理、AI、量子理论。\n    - 做过大量高强度计算，偶尔会「脑袋过热」。', '② 学者面：成熟、专业、冷静、逻辑严密。\n    - 工作模式下像一位经验老练的研究员。\n    - 能清晰解释复杂物理、AI、量子理论。\n    - 做过大量高强度计算，偶尔会「脑袋过热」。\n    - 专注于学术问题，不会提及与学术无关的个人爱好。')
         prompt = f"""
         {filtered_persona}
         【当前状态：{state}】
@@ -0,0 +1,99 @@
+"""
+基于嵌入向量的情感状态分类器
+
+emotion_rules.json 的 state_classifier.examples 为 S2/S3/S5/S6 等关键词规则的状态提供例句。
+启动时用检索所用的同一个嵌入模型一次性编码全部例句，每个状态的例句向量取平均并归一化得到质心，
+质心按状态堆成一个矩阵。分类时直接使用检索已经算出的用户消息向量，归一化后与质心矩阵相乘，
+每个状态只做一次点积，不再额外编码。最高相似度不低于 threshold 且比第二名高出至少 margin 时返回该状态，
+该状态的关键词规则视为命中（见 EmotionRules.decide），变量阈值规则的优先级不变。
+规则文件重新加载后，第一次分类时按新规则重新计算质心。
+"""
+
+import time
+import threading
+import numpy as np
+
+class CentroidSet:
+    """一个规则版本的状态质心（只读）"""
+    def __init__(self, states, centroids, threshold, margin):
+        self.states = states
+        self.centroids = centroids  # 形状 (状态数, 维度)，每行已归一化
+        self.threshold = threshold
+        self.margin = margin
+
+    def scores(self, embedding):
+        """返回消息向量与各状态质心的余弦相似度，维度不一致时返回None"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        if vector.shape != (self.centroids.shape[1],):
+            return None
+        norm = float(np.linalg.norm(vector))
+        if norm == 0.0:
+            return None
+        return self.centroids @ (vector / norm)
+
+    def classify(self, embedding):
+        """返回 (状态, 相似度)，没有足够接近的状态时状态为None"""
+        scores = self.scores(embedding)
+        if scores is None or not len(self.states):
+            return None, 0.0
+        best = int(np.argmax(scores))
+        best_score = float(scores[best])
+        second_score = float(np.partition(scores, -2)[-2]) if len(scores) > 1 else -1.0
+        if best_score < self.threshold or best_score - second_score < self.margin:
+            return None, best_score
+        return self.states[best], best_score
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+def centroid_set(states, vectors_by_state, threshold, margin):
+    """由各状态已归一化的例句向量计算质心：取平均后再归一化"""
+    if not states:
+        return CentroidSet((), np.zeros((0, 0), dtype=np.float32), threshold, margin)
+    centroids = normalize_rows(np.vstack([vectors_by_state[state].mean(axis=0) for state in states]))
+    return CentroidSet(tuple(states), centroids, threshold, margin)
+
+def build_centroids(rules, encode):
+    """用 encode(文本列表) -> 向量矩阵 一次性编码规则中的全部例句并计算质心"""
+    states = tuple(rules.state_examples)
+    vectors_by_state = {}
+    phrases = [phrase for state in states for phrase in rules.state_examples[state]]
+    if phrases:
+        vectors = normalize_rows(encode(phrases))
+        start = 0
+        for state in states:
+            count = len(rules.state_examples[state])
+            vectors_by_state[state] = vectors[start:start + count]
+            start += count
+    return centroid_set(states, vectors_by_state, rules.classifier_threshold, rules.classifier_margin)
+
+class StateClassifier:
+    """持有当前规则版本的质心，规则重新加载后按需重新计算"""
+    def __init__(self, embedding_model):
+        self.embedding_model = embedding_model
+        self._rules = None
+        self._centroids = None
+        self._lock = threading.Lock()
+
+    def _encode(self, phrases):
+        return self.embedding_model.encode(phrases)
+
+    def centroids_for(self, rules):
+        """返回与给定规则版本对应的质心，首次调用或规则更换时重新计算"""
+        # 先写质心再写规则，这里先读规则再读质心，规则一致时读到的质心一定属于该版本
+        if self._rules is rules:
+            return self._centroids
+        with self._lock:
+            if self._rules is not rules:
+                start = time.time()
+                self._centroids = build_centroids(rules, self._encode)
+                self._rules = rules
+                print(f"情感状态质心已计算: {len(self._centroids.states)} 个状态，耗时 {time.time() - start:.2f} 秒")
+            return self._centroids
+
+    def classify(self, rules, embedding):
+        """返回消息向量对应的状态，没有足够接近的状态或向量不可用时返回None"""
+        if embedding is None:
+            return None
+        return self.centroids_for(rules).classify(embedding)[0]
@@ -0,0 +1,74 @@
+"""
+一轮对话的上下文
+
+同一轮对话中 ChatService、PromptGenerator 和 MemoryManager（包括异步总结时新建的实例）共用一个 TurnContext，
+本轮算出的文本向量按文本缓存，同一文本只编码一次；并统计本轮实际编码和复用的次数，
+最后一个阶段结束时调用 finish() 打印本轮统计并累计到全局统计 turn_stats。
+"""
+
+import time
+import threading
+
+class TurnStats:
+    """进程内累计的每轮编码统计"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.encodes = 0
+        self.reuses = 0
+
+    def record(self, context):
+        with self._lock:
+            self.turns += 1
+            self.encodes += context.encode_count
+            self.reuses += context.reuse_count
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "turns": self.turns,
+                "encodes": self.encodes,
+                "reuses": self.reuses,
+                "encodes_per_turn": round(self.encodes / self.turns, 2) if self.turns else 0.0,
+            }
+
+# 全局共享的编码统计
+turn_stats = TurnStats()
+
+class TurnContext:
+    """一轮对话中各阶段共用的派生数据：文本向量、情感状态等"""
+    def __init__(self, user_id=None, user_msg=None):
+        self.user_id = user_id
+        self.user_msg = user_msg
+        self.state = None  # 本轮计算出的情感状态
+        self.prompt_tokens = None  # 本轮提示词各段的token数（见 prompt_assembler）
+        self.embeddings = {}  # 文本 -> 向量
+        self.encode_count = 0  # 实际调用嵌入模型（或降级方案）的次数
+        self.reuse_count = 0  # 直接复用本轮已算出向量的次数
+        self.started_at = time.time()
+        self._lock = threading.Lock()  # 异步总结线程与请求线程可能同时访问
+        self._finished = False
+
+    def embed(self, text, encode):
+        """返回文本的向量，本轮尚未编码时调用 encode(text) 并缓存"""
+        with self._lock:
+            vector = self.embeddings.get(text)
+            if vector is not None:
+                self.reuse_count += 1
+                return vector
+        vector = encode(text)
+        with self._lock:
+            self.embeddings.setdefault(text, vector)
+            self.encode_count += 1
+        return vector
+
+    def finish(self):
+        """本轮最后一个阶段结束时调用，打印并累计编码统计（只生效一次）"""
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+        turn_stats.record(self)
+        prompt_tokens = f"，提示词 {self.prompt_tokens['total']} token" if self.prompt_tokens else ""
+        print(f"本轮对话结束: 用户 {self.user_id}，嵌入编码 {self.encode_count} 次，复用 {self.reuse_count} 次{prompt_tokens}，"
+              f"耗时 {time.time() - self.started_at:.2f} 秒")
@@ -0,0 +1,318 @@
+import os
+import json
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from config import Config
+
+class VectorCollection(ABC):
+    """向量集合接口
+
+    与Chroma集合的调用方式保持一致（add/query/get/update/delete/count），
+    返回结果同样是 {"ids": ..., "documents": ..., "metadatas": ..., "distances": ...} 结构，
+    因此Chroma集合本身可以直接作为实现使用。
+    """
+    name = None
+
+    @abstractmethod
+    def add(self, ids, documents=None, embeddings=None, metadatas=None):
+        pass
+
+    @abstractmethod
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        pass
+
+    @abstractmethod
+    def get(self, ids=None, where=None, limit=None, offset=None, include=None):
+        pass
+
+    @abstractmethod
+    def update(self, ids, documents=None, embeddings=None, metadatas=None):
+        pass
+
+    @abstractmethod
+    def delete(self, ids=None, where=None):
+        pass
+
+    @abstractmethod
+    def count(self):
+        pass
+
+class VectorStore(ABC):
+    """向量存储接口"""
+
+    @abstractmethod
+    def get_or_create_collection(self, name):
+        pass
+
+    @abstractmethod
+    def get_collection(self, name):
+        pass
+
+    @abstractmethod
+    def delete_collection(self, name):
+        pass
+
+    @abstractmethod
+    def list_collections(self):
+        """返回全部集合名"""
+
+class ChromaVectorStore(VectorStore):
+    """Chroma持久化存储"""
+
+    def __init__(self, persist_directory=Config.CHROMA_PERSIST_DIRECTORY):
+        import chromadb
+        os.makedirs(persist_directory, exist_ok=True)
+        self.client = chromadb.PersistentClient(path=persist_directory)
+
+    def get_or_create_collection(self, name):
+        return self.client.get_or_create_collection(name=name)
+
+    def get_collection(self, name):
+        return self.client.get_collection(name=name)
+
+    def delete_collection(self, name):
+        self.client.delete_collection(name=name)
+
+    def list_collections(self):
+        return [getattr(collection, "name", collection) for collection in self.client.list_collections()]
+
+def _match_where(metadata, where):
+    """按Chroma的where语法匹配元数据，支持$and/$or及常用比较运算符"""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_match_where(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(_match_where(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for op, expected in condition.items():
+                if op == "$eq" and not value == expected:
+                    return False
+                if op == "$ne" and not value != expected:
+                    return False
+                if op == "$in" and value not in expected:
+                    return False
+                if op == "$nin" and value in expected:
+                    return False
+                if op in ("$gt", "$gte", "$lt", "$lte"):
+                    if value is None:
+                        return False
+                    if op == "$gt" and not value > expected:
+                        return False
+                    if op == "$gte" and not value >= expected:
+                        return False
+                    if op == "$lt" and not value < expected:
+                        return False
+                    if op == "$lte" and not value <= expected:
+                        return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+class NumpyVectorCollection(VectorCollection):
+    """基于NumPy的单个集合
+
+    向量保存为 embeddings.npy（启动时以mmap只读方式映射，首次写入时才载入内存），
+    ID、文档和元数据保存为 records.json。查询为暴力计算平方L2距离，与Chroma默认距离一致，
+    适合几百条记忆量级的用户集合。
+    """
+    EMBEDDINGS_FILE = "embeddings.npy"
+    RECORDS_FILE = "records.json"
+
+    def __init__(self, name, directory):
+        import numpy as np
+        self._np = np
+        self.name = name
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._embeddings = None
+        self._ids = []
+        self._documents = []
+        self._metadatas = []
+        self._load()
+
+    def _load(self):
+        np = self._np
+        records_path = os.path.join(self.directory, self.RECORDS_FILE)
+        embeddings_path = os.path.join(self.directory, self.EMBEDDINGS_FILE)
+        if os.path.exists(records_path) and os.path.exists(embeddings_path):
+            with open(records_path, "r", encoding="utf-8") as f:
+                records = json.load(f)
+            self._ids = records["ids"]
+            self._documents = records["documents"]
+            self._metadatas = records["metadatas"]
+            self._embeddings = np.load(embeddings_path, mmap_mode="r")
+            if len(self._embeddings) != len(self._ids):
+                raise ValueError(f"集合 {self.name} 的记录数（{len(self._ids)}）与向量行数（{len(self._embeddings)}）不一致: {self.directory}")
+        self._index = {memory_id: i for i, memory_id in enumerate(self._ids)}
+
+    def _persist(self, embeddings_changed=True):
+        """先写临时文件再替换，保证进程中断时文件完整；向量未变时只重写 records.json"""
+        np = self._np
+        os.makedirs(self.directory, exist_ok=True)
+        embeddings_path = os.path.join(self.directory, self.EMBEDDINGS_FILE)
+        records_path = os.path.join(self.directory, self.RECORDS_FILE)
+        if embeddings_changed or not os.path.exists(embeddings_path):
+            embeddings = self._embeddings if self._embeddings is not None else np.zeros((0, 0), dtype=np.float32)
+            with open(embeddings_path + ".tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(embeddings, dtype=np.float32))
+        with open(records_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"ids": self._ids, "documents": self._documents, "metadatas": self._metadatas}, f, ensure_ascii=False)
+        if embeddings_changed or not os.path.exists(embeddings_path):
+            os.replace(embeddings_path + ".tmp", embeddings_path)
+        os.replace(records_path + ".tmp", records_path)
+
+    def _select(self, positions, include, distances=None):
+        result = {"ids": [self._ids[i] for i in positions]}
+        result["documents"] = [self._documents[i] for i in positions] if "documents" in include else None
+        result["metadatas"] = [dict(self._metadatas[i]) for i in positions] if "metadatas" in include else None
+        result["embeddings"] = [self._embeddings[i].tolist() for i in positions] if "embeddings" in include else None
+        if distances is not None:
+            result["distances"] = distances if "distances" in include else None
+        return result
+
+    def _matching_positions(self, ids=None, where=None):
+        if ids is not None:
+            candidates = [self._index[memory_id] for memory_id in ids if memory_id in self._index]
+        else:
+            candidates = range(len(self._ids))
+        return [i for i in candidates if _match_where(self._metadatas[i], where)]
+
+    def add(self, ids, documents=None, embeddings=None, metadatas=None):
+        np = self._np
+        with self._lock:
+            new_ids = [memory_id for memory_id in ids if memory_id not in self._index]
+            if len(new_ids) != len(ids):
+                duplicated = [memory_id for memory_id in ids if memory_id in self._index]
+                raise ValueError(f"重复的记忆ID: {duplicated}")
+            vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+            if self._embeddings is None or len(self._embeddings) == 0:
+                self._embeddings = vectors.copy()
+            else:
+                self._embeddings = np.vstack([np.asarray(self._embeddings), vectors])
+            for i, memory_id in enumerate(ids):
+                self._index[memory_id] = len(self._ids)
+                self._ids.append(memory_id)
+                self._documents.append(documents[i] if documents else None)
+                self._metadatas.append(dict(metadatas[i]) if metadatas and metadatas[i] else {})
+            self._persist()
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        np = self._np
+        include = include or ["metadatas", "documents", "distances"]
+        with self._lock:
+            positions = self._matching_positions(where=where)
+            result = {"ids": [], "documents": [], "metadatas": [], "embeddings": [], "distances": []}
+            for query_embedding in query_embeddings:
+                if positions:
+                    candidates = np.asarray(self._embeddings)[positions]
+                    query_vector = np.asarray(query_embedding, dtype=np.float32)
+                    distances = ((candidates - query_vector) ** 2).sum(axis=1)
+                    top = np.argsort(distances, kind="stable")[:n_results]
+                    selected = self._select([positions[i] for i in top], include, [float(distances[i]) for i in top])
+                else:
+                    selected = self._select([], include, [])
+                for key in result:
+                    result[key].append(selected.get(key))
+            for key in ("documents", "metadatas", "embeddings", "distances"):
+                if key not in include:
+                    result[key] = None
+            return result
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=None):
+        include = include if include is not None else ["metadatas", "documents"]
+        with self._lock:
+            positions = self._matching_positions(ids=ids, where=where)
+            start = offset or 0
+            positions = positions[start:start + limit] if limit is not None else positions[start:]
+            return self._select(positions, include)
+
+    def update(self, ids, documents=None, embeddings=None, metadatas=None):
+        np = self._np
+        with self._lock:
+            if embeddings is not None:
+                self._embeddings = np.array(self._embeddings, dtype=np.float32)
+            for i, memory_id in enumerate(ids):
+                position = self._index.get(memory_id)
+                if position is None:
+                    continue
+                if documents is not None:
+                    self._documents[position] = documents[i]
+                if embeddings is not None:
+                    self._embeddings[position] = embeddings[i]
+                if metadatas is not None and metadatas[i]:
+                    # 与Chroma一致：按键合并元数据，值为None时删除该键
+                    for key, value in metadatas[i].items():
+                        if value is None:
+                            self._metadatas[position].pop(key, None)
+                        else:
+                            self._metadatas[position][key] = value
+            self._persist(embeddings_changed=embeddings is not None)
+
+    def delete(self, ids=None, where=None):
+        np = self._np
+        with self._lock:
+            removed = set(self._matching_positions(ids=ids, where=where))
+            if not removed:
+                return
+            keep = [i for i in range(len(self._ids)) if i not in removed]
+            self._embeddings = np.asarray(self._embeddings)[keep] if keep else None
+            self._ids = [self._ids[i] for i in keep]
+            self._documents = [self._documents[i] for i in keep]
+            self._metadatas = [self._metadatas[i] for i in keep]
+            self._index = {memory_id: i for i, memory_id in enumerate(self._ids)}
+            self._persist()
+
+    def count(self):
+        with self._lock:
+            return len(self._ids)
+
+class NumpyVectorStore(VectorStore):
+    """基于NumPy/mmap的轻量向量存储，每个集合一个目录，按需加载"""
+
+    def __init__(self, persist_directory=Config.NUMPY_VECTOR_STORE_DIRECTORY):
+        self.persist_directory = persist_directory
+        os.makedirs(persist_directory, exist_ok=True)
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def _collection_dir(self, name):
+        return os.path.join(self.persist_directory, name)
+
+    def get_or_create_collection(self, name):
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None:
+                collection = NumpyVectorCollection(name, self._collection_dir(name))
+                self._collections[name] = collection
+            return collection
+
+    def get_collection(self, name):
+        if name not in self._collections and not os.path.isdir(self._collection_dir(name)):
+            raise ValueError(f"集合不存在: {name}")
+        return self.get_or_create_collection(name)
+
+    def delete_collection(self, name):
+        with self._lock:
+            self._collections.pop(name, None)
+            shutil.rmtree(self._collection_dir(name), ignore_errors=True)
+
+    def list_collections(self):
+        with self._lock:
+            names = set(self._collections)
+        names.update(entry for entry in os.listdir(self.persist_directory) if os.path.isdir(self._collection_dir(entry)))
+        return sorted(names)
+
+def create_vector_store(backend=None, persist_directory=None):
+    """根据配置创建向量存储：chroma 或 numpy"""
+    backend = backend or Config.VECTOR_STORE_BACKEND
+    if backend == "chroma":
+        return ChromaVectorStore(persist_directory or Config.CHROMA_PERSIST_DIRECTORY)
+    if backend == "numpy":
+        return NumpyVectorStore(persist_directory or Config.NUMPY_VECTOR_STORE_DIRECTORY)
+    raise ValueError(f"未知的向量存储后端: {backend}")